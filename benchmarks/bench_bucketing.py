@@ -0,0 +1,57 @@
+"""
+Padding of size-bucketed batches under a pixel budget against random batches of the same mean size,
+on images of random resolutions.
+
+    python -m benchmarks.bench_bucketing
+"""
+import time
+
+import numpy as np
+import torch
+
+from src.datasets import BucketBatchSampler, PadCollate
+
+
+def padding(batches, sizes) -> tuple:
+    """
+    :return: number of padded pixels and padding ratio of the batches
+    """
+    n_padded = sum(len(batch) * np.prod(sizes[batch].max(0)) for batch in batches)
+    n_pixels = np.prod(sizes, axis=1).sum()
+    return n_padded, 1 - n_pixels / n_padded
+
+
+def run(n_samples=5000, min_size=32, max_size=512, max_tokens=512 * 512 * 4, n_collate_batches=20) -> dict:
+    rng = np.random.default_rng(0)
+    sizes = rng.integers(min_size, max_size + 1, (n_samples, 2))
+
+    sampler = BucketBatchSampler(sizes, max_tokens=max_tokens, seed=0)
+    bucket_batches = [np.array(batch) for batch in sampler]
+    if sorted(np.concatenate(bucket_batches).tolist()) != list(range(n_samples)):
+        raise RuntimeError("The bucketing sampler does not yield every sample once")
+    batch_size = round(n_samples / len(bucket_batches))
+    permutation = rng.permutation(n_samples)
+    random_batches = [permutation[i:i + batch_size] for i in range(0, n_samples, batch_size)]
+
+    bucket_padded, bucket_ratio = padding(bucket_batches, sizes)
+    random_padded, random_ratio = padding(random_batches, sizes)
+
+    # cost of the padding collate function on the bucketed batches
+    collate = PadCollate()
+    batches = [[{"x": torch.zeros(3, *sizes[i])} for i in batch] for batch in bucket_batches[:n_collate_batches]]
+    start_time = time.perf_counter()
+    for batch in batches:
+        collate(batch)
+    collate_time = (time.perf_counter() - start_time) / len(batches)
+
+    return {
+        "bucketing/padding_ratio": float(bucket_ratio),
+        "bucketing/random_padding_ratio": float(random_ratio),
+        "bucketing/padded_pixels_speedup": float(random_padded / bucket_padded),
+        "bucketing/collate_ms_per_batch": collate_time * 1000,
+    }
+
+
+if __name__ == "__main__":
+    for name, value in run().items():
+        print(f"{name}: {value:.3f}")
@@ -0,0 +1,64 @@
+"""
+Per-call cost of the components used on every training step or epoch: MetricMonitor,
+load_batch_to_device, Logger.save_metrics and ModelCheckpoint.
+
+    python -m benchmarks.bench_components
+"""
+import torch
+import torch.nn as nn
+
+from src.metrics import MetricMonitor
+from src.utils import Logger, ModelCheckpoint, load_batch_to_device
+from benchmarks.common import make_config, measure, temporary_output_dir
+
+
+def bench_metric_monitor(n_steps=1000) -> float:
+    losses = torch.rand(n_steps)
+
+    def epoch():
+        metric_monitor = MetricMonitor()
+        for loss in losses:
+            metric_monitor.update("loss", loss)
+        metric_monitor.get_metrics()
+
+    return measure(epoch, n_iters=5) / n_steps
+
+
+def bench_load_batch(n_iters=1000) -> float:
+    batch = {"x": torch.randn(32, 3, 32, 32), "y": torch.randint(0, 10, (32,)), "meta": [torch.zeros(32), (1, 2)]}
+    return measure(lambda: load_batch_to_device(batch, "cpu"), n_iters)
+
+
+def bench_save_metrics(n_iters=200) -> float:
+    logs = {"epoch": 0, "train/loss": 0.5, "train/lr": 1e-3, "val/loss": 0.6}
+    with temporary_output_dir():
+        logger = Logger(make_config())
+        return measure(lambda: logger.save_metrics(logs), n_iters)
+
+
+def bench_checkpoint(n_iters=5):
+    model = nn.Sequential(*[nn.Linear(1024, 1024) for _ in range(8)])
+    with temporary_output_dir():
+        model_checkpoint = ModelCheckpoint(monitor="loss")
+        epoch = iter(range(n_iters + 1))
+        # the time the training thread is blocked, and the time until the checkpoints are on disk
+        blocking_time = measure(lambda: model_checkpoint(model, {"loss": -next(epoch)}, 0), n_iters)
+        total_time = measure(lambda: (model_checkpoint(model, {"loss": 0.0}, 0), model_checkpoint.flush()), n_iters)
+        model_checkpoint.close()
+    return blocking_time, total_time
+
+
+def run() -> dict:
+    blocking_time, total_time = bench_checkpoint()
+    return {
+        "components/metric_monitor_update_us": bench_metric_monitor() * 1e6,
+        "components/load_batch_to_device_us": bench_load_batch() * 1e6,
+        "components/save_metrics_us": bench_save_metrics() * 1e6,
+        "components/checkpoint_blocking_ms": blocking_time * 1000,
+        "components/checkpoint_save_ms": total_time * 1000,
+    }
+
+
+if __name__ == "__main__":
+    for name, value in run().items():
+        print(f"{name}: {value:.3f}")
@@ -0,0 +1,54 @@
+"""
+Compare rendering the media figures in the main process with rendering them in a pool of processes.
+
+    python -m benchmarks.bench_media --n-figures 32 --n-workers 4
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from src.utils.figures import plot_image_grid, render_figures
+
+
+def measure(fn, n_iters, n_warmup=1):
+    for _ in range(n_warmup):
+        fn()
+    start_time = time.perf_counter()
+    for _ in range(n_iters):
+        fn()
+    return (time.perf_counter() - start_time) / n_iters
+
+
+def run(n_figures=32, n_workers=4, n_images=16, image_size=64, n_iters=1) -> dict:
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 256, (n_images, image_size, image_size, 3), dtype=np.uint8)
+    tasks = {f"figure_{i}": (plot_image_grid, (images,)) for i in range(n_figures)}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filenames = {name: os.path.join(tmp_dir, f"{name}.png") for name in tasks}
+        serial_time = measure(lambda: render_figures(tasks, filenames, n_workers=1), n_iters)
+        # the warmup starts the fork server, which is reused by the next pools of the process
+        pool_time = measure(
+            lambda: render_figures(tasks, filenames, n_workers=n_workers, min_figures_per_worker=1), n_iters
+        )
+    return {
+        "media/serial_figures_per_sec": n_figures / serial_time,
+        "media/pool_figures_per_sec": n_figures / pool_time,
+        "media/pool_speedup": serial_time / pool_time,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n-figures", type=int, default=32)
+    parser.add_argument("--n-workers", type=int, default=4)
+    parser.add_argument("--n-images", type=int, default=16)
+    parser.add_argument("--image-size", type=int, default=64)
+    parser.add_argument("--n-iters", type=int, default=1)
+    args = parser.parse_args()
+
+    results = run(args.n_figures, args.n_workers, args.n_images, args.image_size, args.n_iters)
+    for name, value in results.items():
+        print(f"{name}: {value:.2f}")
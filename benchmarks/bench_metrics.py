@@ -0,0 +1,110 @@
+"""
+Streaming metrics against a per-sample host reference: the results must match, and the cost per batch is compared.
+
+    python -m benchmarks.bench_metrics
+"""
+import math
+import time
+
+import numpy as np
+import torch
+
+from src.metrics import MetricMonitor, Accuracy, ClassificationMetrics, MeanIoU
+
+
+def reference_classification(preds, targets, n_classes) -> dict:
+    """
+    Metrics from the labels with python loops, macro averages over the classes present in the
+    targets or the predictions and undefined values counted as 0, as scikit-learn does.
+    """
+    matrix = np.zeros((n_classes, n_classes), dtype=np.int64)
+    for target, pred in zip(targets, preds):
+        matrix[target, pred] += 1
+    precisions, recalls, f1s = [], [], []
+    for c in range(n_classes):
+        tp = matrix[c, c]
+        n_predicted = matrix[:, c].sum()
+        n_target = matrix[c, :].sum()
+        if n_predicted + n_target == 0:
+            continue
+        precision = tp / n_predicted if n_predicted > 0 else 0.0
+        recall = tp / n_target if n_target > 0 else 0.0
+        precisions.append(precision)
+        recalls.append(recall)
+        f1s.append(2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0)
+    accuracy = np.trace(matrix) / matrix.sum()
+    return {
+        "accuracy": accuracy,
+        "precision_macro": np.mean(precisions),
+        "recall_macro": np.mean(recalls),
+        "f1_macro": np.mean(f1s),
+        "precision_micro": accuracy,
+        "recall_micro": accuracy,
+        "f1_micro": accuracy,
+    }
+
+
+def reference_top_k(scores, targets, k) -> float:
+    return np.mean([target in np.argsort(-score)[:k] for score, target in zip(scores, targets)])
+
+
+def reference_miou(preds, targets, n_classes, ignore_index) -> dict:
+    valid = targets != ignore_index
+    preds, targets = preds[valid], targets[valid]
+    ious = []
+    for c in range(n_classes):
+        intersection = np.sum((preds == c) & (targets == c))
+        union = np.sum((preds == c) | (targets == c))
+        if union > 0:
+            ious.append(intersection / union)
+    return {"miou": np.mean(ious), "pixel_accuracy": np.mean(preds == targets)}
+
+
+def check(results, reference, name):
+    for key, value in reference.items():
+        if not math.isclose(results[key], float(value), rel_tol=1e-9, abs_tol=1e-12):
+            raise RuntimeError(f"{name} {key} is {results[key]}, the reference gives {value}")
+
+
+def run(n_batches=50, batch_size=256, n_classes=10) -> dict:
+    generator = torch.Generator().manual_seed(0)
+    scores = torch.randn(n_batches, batch_size, n_classes, generator=generator)
+    targets = torch.randint(0, n_classes, (n_batches, batch_size), generator=generator)
+    # correlate the predictions with the targets and leave a class out of the predictions
+    scores[torch.arange(n_batches)[:, None], torch.arange(batch_size), targets] += 1.0
+    scores[..., n_classes - 1] -= 100.0
+
+    metric_monitor = MetricMonitor([Accuracy(), Accuracy(top_k=3), ClassificationMetrics(n_classes)])
+    start_time = time.perf_counter()
+    for output, target in zip(scores, targets):
+        metric_monitor.update_streaming_metrics(output, target)
+    results = metric_monitor.get_metrics()
+    streaming_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    flat_scores = scores.flatten(0, 1).numpy()
+    flat_targets = targets.flatten().numpy()
+    reference = reference_classification(flat_scores.argmax(1), flat_targets, n_classes)
+    reference["top3_accuracy"] = reference_top_k(flat_scores, flat_targets, 3)
+    reference_time = time.perf_counter() - start_time
+    check(results, reference, "Classification")
+
+    # segmentation, with ignored pixels
+    masks = torch.randint(0, 5, (4, 8, 32, 32), generator=generator)
+    masks[:, :, :4] = 255
+    seg_scores = torch.randn(4, 8, 5, 32, 32, generator=generator)
+    seg_monitor = MetricMonitor([MeanIoU(5, ignore_index=255)])
+    for output, target in zip(seg_scores, masks):
+        seg_monitor.update_streaming_metrics(output, target)
+    check(seg_monitor.get_metrics(), reference_miou(seg_scores.argmax(2).numpy(), masks.numpy(), 5, 255), "MeanIoU")
+
+    return {
+        "metrics/streaming_ms_per_batch": streaming_time / n_batches * 1000,
+        "metrics/reference_ms_per_batch": reference_time / n_batches * 1000,
+        "metrics/speedup": reference_time / streaming_time,
+    }
+
+
+if __name__ == "__main__":
+    for name, value in run().items():
+        print(f"{name}: {value:.3f}")
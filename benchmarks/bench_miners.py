@@ -0,0 +1,128 @@
+"""
+Chunked miners against per-anchor python loop references: the mined indices must match, and the cost is compared.
+The chunked miners are also timed on a large batch with a cross-batch memory bank.
+
+    python -m benchmarks.bench_miners
+"""
+import time
+
+import torch
+import torch.nn.functional as F
+
+from src.miners import (
+    HardTripletMiner,
+    SemiHardTripletMiner,
+    DistanceWeightedMiner,
+    MultiSimilarityMiner,
+    MemoryBank,
+    pairwise_distance,
+)
+
+
+def reference_hard(dist, labels):
+    triplets = []
+    for a in range(len(labels)):
+        positives = [j for j in range(len(labels)) if labels[j] == labels[a] and j != a]
+        negatives = [j for j in range(len(labels)) if labels[j] != labels[a]]
+        if positives and negatives:
+            triplets.append((a, max(positives, key=lambda j: dist[a][j]), min(negatives, key=lambda j: dist[a][j])))
+    return sorted(triplets)
+
+
+def reference_semi_hard(dist, labels, margin):
+    triplets = []
+    for a in range(len(labels)):
+        for p in range(len(labels)):
+            if labels[p] != labels[a] or p == a:
+                continue
+            negatives = [
+                n for n in range(len(labels))
+                if labels[n] != labels[a] and dist[a][p] < dist[a][n] < dist[a][p] + margin
+            ]
+            if negatives:
+                triplets.append((a, p, min(negatives, key=lambda n: dist[a][n])))
+    return sorted(triplets)
+
+
+def reference_multi_similarity(similarity, labels, epsilon):
+    positive_pairs, negative_pairs = [], []
+    for a in range(len(labels)):
+        positives = [j for j in range(len(labels)) if labels[j] == labels[a] and j != a]
+        negatives = [j for j in range(len(labels)) if labels[j] != labels[a]]
+        if not positives or not negatives:
+            continue
+        hardest_positive = min(similarity[a][j] for j in positives)
+        hardest_negative = max(similarity[a][j] for j in negatives)
+        positive_pairs += [(a, j) for j in positives if similarity[a][j] - epsilon < hardest_negative]
+        negative_pairs += [(a, j) for j in negatives if similarity[a][j] + epsilon > hardest_positive]
+    return sorted(positive_pairs), sorted(negative_pairs)
+
+
+def as_tuples(*indices):
+    return sorted(zip(*(x.tolist() for x in indices)))
+
+
+def check(results, reference, name):
+    if results != reference:
+        raise RuntimeError(f"{name} mined {len(results)} tuples, the reference {len(reference)}")
+
+
+def run(batch_size=128, n_classes=16, large_batch_size=2048, bank_size=2048, chunk_size=512, dim=128) -> dict:
+    generator = torch.Generator().manual_seed(0)
+    # float64 so near ties are resolved the same way by the loops
+    embeddings = F.normalize(torch.randn(batch_size, dim, generator=generator, dtype=torch.float64), dim=1)
+    labels = torch.randint(0, n_classes, (batch_size,), generator=generator)
+    dist = pairwise_distance(embeddings, embeddings).tolist()
+    similarity = (embeddings @ embeddings.T).tolist()
+    label_list = labels.tolist()
+    miners = {
+        "hard": HardTripletMiner(chunk_size=32),
+        "semi_hard": SemiHardTripletMiner(margin=0.2, chunk_size=32),
+        "multi_similarity": MultiSimilarityMiner(epsilon=0.1, chunk_size=32),
+    }
+
+    start_time = time.perf_counter()
+    outputs = {name: miner(embeddings, labels) for name, miner in miners.items()}
+    chunked_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    references = {
+        "hard": reference_hard(dist, label_list),
+        "semi_hard": reference_semi_hard(dist, label_list, 0.2),
+        "multi_similarity": reference_multi_similarity(similarity, label_list, 0.1),
+    }
+    reference_time = time.perf_counter() - start_time
+
+    check(as_tuples(*outputs["hard"]), references["hard"], "HardTripletMiner")
+    check(as_tuples(*outputs["semi_hard"]), references["semi_hard"], "SemiHardTripletMiner")
+    positive_anchors, positives, negative_anchors, negatives = outputs["multi_similarity"]
+    check(as_tuples(positive_anchors, positives), references["multi_similarity"][0], "MultiSimilarityMiner positives")
+    check(as_tuples(negative_anchors, negatives), references["multi_similarity"][1], "MultiSimilarityMiner negatives")
+    anchors, positives, negatives = DistanceWeightedMiner(chunk_size=32)(embeddings, labels)
+    if (labels[anchors] != labels[positives]).any() or (labels[anchors] == labels[negatives]).any():
+        raise RuntimeError("DistanceWeightedMiner mined triplets with wrong labels")
+
+    # large batch against a full memory bank, the distances are never materialized at full size
+    embeddings = F.normalize(torch.randn(large_batch_size, dim, generator=generator), dim=1)
+    labels = torch.randint(0, n_classes * 64, (large_batch_size,), generator=generator)
+    memory_bank = MemoryBank(bank_size)
+    memory_bank.add(F.normalize(torch.randn(bank_size, dim, generator=generator), dim=1), labels.roll(1))
+    ref_embeddings, ref_labels = memory_bank.get_references(embeddings, labels)
+    results = {}
+    for name, miner in [*miners.items(), ("distance_weighted", DistanceWeightedMiner())]:
+        miner.chunk_size = chunk_size
+        start_time = time.perf_counter()
+        miner(embeddings, labels, ref_embeddings, ref_labels)
+        results[f"miners/{name}_large_batch_ms"] = (time.perf_counter() - start_time) * 1000
+
+    return {
+        "miners/chunked_ms": chunked_time * 1000,
+        "miners/reference_ms": reference_time * 1000,
+        "miners/speedup": reference_time / chunked_time,
+        **results,
+    }
+
+
+if __name__ == "__main__":
+    for name, value in run().items():
+        print(f"{name}: {value:.3f}")
@@ -0,0 +1,54 @@
+"""
+Latency and throughput of the inference server under concurrent load, with and without micro-batching.
+
+    python -m benchmarks.bench_serving
+"""
+import torch
+
+from src.serving import InferenceServer, make_predict_fn, decode_image
+from src.serving.loadgen import random_image, run_load_test
+from src.trainers import TemplateTrainer
+from benchmarks.common import SmallCNN, make_config, temporary_output_dir
+
+
+def preprocess(data):
+    return torch.from_numpy(decode_image(data)).permute(2, 0, 1).float() / 255
+
+
+def postprocess(output):
+    return {"prediction": int(output.argmax())}
+
+
+def serve(trainer, payload, max_batch_size, n_requests, concurrency) -> dict:
+    server = InferenceServer(
+        make_predict_fn(trainer), preprocess, postprocess, port=0, max_batch_size=max_batch_size, max_wait_ms=2.0
+    )
+    server.start()
+    try:
+        # warm up the model and the connections
+        run_load_test(server.url, payload, n_requests=concurrency, concurrency=concurrency)
+        return run_load_test(server.url, payload, n_requests=n_requests, concurrency=concurrency)
+    finally:
+        server.shutdown()
+
+
+def run(n_requests=500, concurrency=16) -> dict:
+    torch.manual_seed(0)
+    payload = random_image(32, 32)
+    with temporary_output_dir():
+        trainer = TemplateTrainer(config=make_config(compile=False), model=SmallCNN())
+        batched = serve(trainer, payload, 32, n_requests, concurrency)
+        unbatched = serve(trainer, payload, 1, n_requests, concurrency)
+        trainer.model_checkpoint.close()
+
+    return {
+        "serving/requests_per_sec": batched["requests_per_sec"],
+        "serving/latency_p50_ms": batched["latency_p50_ms"],
+        "serving/latency_p99_ms": batched["latency_p99_ms"],
+        "serving/batching_speedup": batched["requests_per_sec"] / unbatched["requests_per_sec"],
+    }
+
+
+if __name__ == "__main__":
+    for name, value in run().items():
+        print(f"{name}: {value:.3f}")
@@ -0,0 +1,53 @@
+"""
+Import time of the project modules, measured in fresh interpreters. Fails if importing them
+loads any of the heavy optional dependencies, which should only be imported when used.
+
+    python -m benchmarks.bench_startup
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ["src.utils", "src.trainers", "src.datasets", "src.serving", "src.miners"]
+# dependencies that are slow to import and only needed by some runs
+LAZY_MODULES = ["wandb", "matplotlib", "albumentations", "hydra", "omegaconf", "optuna", "cv2"]
+
+
+def import_time(module, n_runs=5) -> float:
+    """
+    Median wall time of `python -c "import <module>"`, minus the interpreter startup.
+    """
+    def run_python(code):
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+        return time.perf_counter() - start_time
+
+    interpreter_time = statistics.median(run_python("pass") for _ in range(n_runs))
+    return statistics.median(run_python(f"import {module}") for _ in range(n_runs)) - interpreter_time
+
+
+def eager_imports(modules=MODULES) -> list:
+    """
+    Heavy dependencies loaded by importing the modules.
+    """
+    code = (
+        f"import sys; import {', '.join(modules)}; "
+        f"print(' '.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    )
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True, capture_output=True, text=True)
+    return output.stdout.split()
+
+
+def run() -> dict:
+    loaded = eager_imports()
+    if loaded:
+        raise RuntimeError(f"Importing {', '.join(MODULES)} eagerly imports {', '.join(loaded)}")
+    return {f"startup/import_{module}_ms": import_time(module) * 1000 for module in MODULES}
+
+
+if __name__ == "__main__":
+    for name, value in run().items():
+        print(f"{name}: {value:.3f}")
@@ -0,0 +1,58 @@
+"""
+Training and validation throughput of BaseTrainer and its per-step overhead relative to a bare loop.
+
+    python -m benchmarks.bench_trainer
+"""
+import torch
+import torch.nn as nn
+
+from src.trainers import TemplateTrainer
+from benchmarks.common import SmallCNN, make_config, make_loader, measure, temporary_output_dir
+
+
+def bare_train_epoch(model, loader, criterion, optimizer):
+    model.train()
+    for batch in loader:
+        optimizer.zero_grad()
+        loss = criterion(model(batch["x"]), batch["y"])
+        loss.backward()
+        optimizer.step()
+    # wait for the last step, as the trainer does when syncing the metrics
+    loss.item()
+
+
+def run(n_samples=512, batch_size=32, n_iters=3) -> dict:
+    torch.manual_seed(0)
+    train_dl = make_loader(n_samples, batch_size, shuffle=True)
+    val_dl = make_loader(n_samples, batch_size)
+    n_steps = len(train_dl)
+
+    with temporary_output_dir():
+        model = SmallCNN()
+        criterion = nn.CrossEntropyLoss()
+        optimizer = torch.optim.AdamW(model.parameters(), lr=1e-3)
+        trainer = TemplateTrainer(
+            config=make_config(batch_size=batch_size),
+            model=model,
+            train_dl=train_dl,
+            val_dl=val_dl,
+            criterion=criterion,
+            optimizer=optimizer,
+        )
+        train_time = measure(lambda: trainer.train_epoch(0), n_iters)
+        val_time = measure(lambda: trainer.val_epoch(0), n_iters)
+        # same (compiled) model and optimizer, without any of the trainer machinery
+        bare_time = measure(lambda: bare_train_epoch(trainer.model, train_dl, criterion, optimizer), n_iters)
+        trainer.model_checkpoint.close()
+
+    return {
+        "trainer/train_steps_per_sec": n_steps / train_time,
+        "trainer/val_steps_per_sec": len(val_dl) / val_time,
+        "trainer/bare_train_steps_per_sec": n_steps / bare_time,
+        "trainer/step_overhead_ms": (train_time - bare_time) / n_steps * 1000,
+    }
+
+
+if __name__ == "__main__":
+    for name, value in run().items():
+        print(f"{name}: {value:.3f}")
@@ -0,0 +1,77 @@
+"""
+Compare the per-sample albumentations pipeline with the batched transforms of src.transforms.
+
+    python -m benchmarks.bench_transforms --batch-size 64 --device cpu
+"""
+import argparse
+import time
+
+import albumentations as A
+from albumentations.pytorch import ToTensorV2
+import numpy as np
+import torch
+from torch.utils.data import default_collate
+
+from src.transforms import BatchCompose, BatchResize, BatchHorizontalFlip, BatchColorJitter, BatchNormalize
+
+
+def per_sample_pipeline(images, transforms):
+    return default_collate([transforms(image=image)["image"] for image in images])
+
+
+def batched_pipeline(images, transforms, device):
+    batch = torch.from_numpy(np.stack(images)).permute(0, 3, 1, 2).to(device)
+    out = transforms(batch)
+    if out.device.type == "cuda":
+        torch.cuda.synchronize(out.device)
+    return out
+
+
+def measure(fn, n_iters, n_warmup=2):
+    for _ in range(n_warmup):
+        fn()
+    start_time = time.perf_counter()
+    for _ in range(n_iters):
+        fn()
+    return (time.perf_counter() - start_time) / n_iters
+
+
+def run(batch_size=64, image_size=256, output_size=64, n_iters=10, device="cpu") -> dict:
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 256, (image_size, image_size, 3), dtype=np.uint8) for _ in range(batch_size)]
+
+    transforms = A.Compose([
+        A.Resize(width=output_size, height=output_size),
+        A.HorizontalFlip(p=0.5),
+        A.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.0, p=1.0),
+        A.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+        ToTensorV2(),
+    ])
+    batch_transforms = BatchCompose([
+        BatchResize(height=output_size, width=output_size),
+        BatchHorizontalFlip(p=0.5),
+        BatchColorJitter(brightness=0.2, contrast=0.2, saturation=0.2),
+        BatchNormalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+    ])
+
+    per_sample_time = measure(lambda: per_sample_pipeline(images, transforms), n_iters)
+    batched_time = measure(lambda: batched_pipeline(images, batch_transforms, device), n_iters)
+    return {
+        "transforms/per_sample_samples_per_sec": batch_size / per_sample_time,
+        "transforms/batched_samples_per_sec": batch_size / batched_time,
+        "transforms/speedup": per_sample_time / batched_time,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--image-size", type=int, default=256)
+    parser.add_argument("--output-size", type=int, default=64)
+    parser.add_argument("--n-iters", type=int, default=10)
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    results = run(args.batch_size, args.image_size, args.output_size, args.n_iters, args.device)
+    for name, value in results.items():
+        print(f"{name}: {value:.2f}")
@@ -0,0 +1,86 @@
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+import torch
+import torch.nn as nn
+from omegaconf import OmegaConf
+from torch.utils.data import Dataset, DataLoader
+
+from cfgs.config import CFG
+
+
+class SyntheticDataset(Dataset):
+    def __init__(self, n_samples=512, image_size=32, n_classes=10, seed=0):
+        """
+        In-memory dataset of random images and labels, with the same sample format as TemplateDataset.
+        """
+        generator = torch.Generator().manual_seed(seed)
+        self.x = torch.randn(n_samples, 3, image_size, image_size, generator=generator)
+        self.y = torch.randint(0, n_classes, (n_samples,), generator=generator)
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def __getitem__(self, idx) -> dict:
+        return {"x": self.x[idx], "y": self.y[idx]}
+
+
+class SmallCNN(nn.Module):
+    def __init__(self, n_classes=10, width=16):
+        super().__init__()
+        self.features = nn.Sequential(
+            nn.Conv2d(3, width, 3, padding=1),
+            nn.ReLU(),
+            nn.MaxPool2d(2),
+            nn.Conv2d(width, width * 2, 3, padding=1),
+            nn.ReLU(),
+            nn.AdaptiveAvgPool2d(1),
+        )
+        self.head = nn.Linear(width * 2, n_classes)
+
+    def forward(self, x):
+        return self.head(self.features(x).flatten(1))
+
+
+def make_config(**overrides):
+    """
+    Default CFG on CPU, without wandb, with the given overrides.
+    """
+    cfg = OmegaConf.structured(CFG)
+    cfg.device = "cpu"
+    cfg.project_name = None
+    for key, value in overrides.items():
+        setattr(cfg, key, value)
+    return cfg
+
+
+def make_loader(n_samples=512, batch_size=32, image_size=32, shuffle=False):
+    return DataLoader(SyntheticDataset(n_samples, image_size), batch_size=batch_size, shuffle=shuffle)
+
+
+@contextmanager
+def temporary_output_dir():
+    """
+    Run in a temporary working directory, used as output directory by Logger and ModelCheckpoint.
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        try:
+            yield tmp_dir
+        finally:
+            os.chdir(cwd)
+
+
+def measure(fn, n_iters=10, n_warmup=1) -> float:
+    """
+    Average wall time of fn in seconds, after n_warmup calls.
+    """
+    for _ in range(n_warmup):
+        fn()
+    start_time = time.perf_counter()
+    for _ in range(n_iters):
+        fn()
+    return (time.perf_counter() - start_time) / n_iters
@@ -0,0 +1,97 @@
+"""
+Run the benchmark suite on CPU, write the results to JSON and compare them against a stored baseline.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --save-baseline
+    python -m benchmarks.run --compare --only trainer startup --threshold 0.1
+
+Metrics ending in "_per_sec" or "speedup" are better when higher, all the others are times and
+are better when lower. With --compare the run fails if any metric is worse than the baseline by more
+than the threshold, or if there is no baseline to compare with.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+
+# keep the output readable, the trainer loops use tqdm
+os.environ.setdefault("TQDM_DISABLE", "1")
+
+BENCHMARKS = ["trainer", "components", "startup", "transforms", "serving", "metrics", "bucketing", "miners", "media"]
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def higher_is_better(name) -> bool:
+    return name.endswith("_per_sec") or name.endswith("speedup")
+
+
+def compare(results, baseline, threshold) -> list:
+    """
+    Compare the results with the baseline.
+    :return: list of (name, baseline value, value, relative change) of the regressed metrics
+    """
+    regressions = []
+    for name, value in results.items():
+        if name not in baseline or baseline[name] == 0:
+            continue
+        change = (value - baseline[name]) / abs(baseline[name])
+        regression = -change if higher_is_better(name) else change
+        if regression > threshold:
+            regressions.append((name, baseline[name], value, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument("--output", default=None, help="JSON file to write the results to")
+    parser.add_argument("--baseline", default=BASELINE, help="JSON file with the baseline results")
+    parser.add_argument("--compare", action="store_true", help="fail on regressions against the baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="maximum allowed relative regression")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--threads", type=int, default=1, help="torch intra-op threads, for stable numbers")
+    args = parser.parse_args()
+
+    import torch
+    torch.set_num_threads(args.threads)
+
+    results = {}
+    for benchmark in args.only:
+        print(f"Running {benchmark}...")
+        module = importlib.import_module(f"benchmarks.bench_{benchmark}")
+        results.update(module.run())
+    for name, value in results.items():
+        print(f"{name}: {value:.3f}")
+
+    report = {
+        "machine": {"python": platform.python_version(), "torch": torch.__version__, "platform": platform.platform()},
+        "results": results,
+    }
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+    if not args.compare:
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline found at {args.baseline}, run with --save-baseline to create it.")
+        sys.exit(1)
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.threshold)
+    for name, baseline_value, value, change in regressions:
+        print(f"REGRESSION {name}: {baseline_value:.3f} -> {value:.3f} ({change:+.1%})")
+    if regressions:
+        sys.exit(1)
+    print(f"No regressions above {args.threshold:.0%}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
-from dataclasses import dataclass
-from typing import Union
+from dataclasses import dataclass, field
+from typing import List, Union
 
 
 @dataclass
@@ -10,24 +10,103 @@ class CFG:
     # Wandb config
     project_name: Union[str, None] =  None
     entity: Union[str, None] = None
+    upload_queue_size: int = 1000  # pending wandb uploads, dropped when full
+
+    # Local metrics config
+    metrics_format: str = "csv"  # "csv", "jsonl" or "parquet"
+    metrics_flush_interval: float = 30.0  # minimum seconds between two writes of the buffered metrics
 
     # Dataset config
     data_path: str = ""
+    cache_dir: Union[str, None] = None  # cache of the deterministic transforms, disabled if None
+
+    # Dataloader config
+    num_workers: int = 0
+    prefetch_factor: int = 2
+    persistent_workers: bool = True
+    pin_memory: bool = True
+    drop_last: bool = False
+    collate_fn: Union[str, None] = None  # None, "dataset" or the import path of a function
+    autotune_workers: bool = False  # pick the fastest num_workers before training
+    max_batch_tokens: Union[int, None] = None  # padded pixels or tokens per batch with a size index, instead of batch_size
+    n_size_buckets: int = 8  # size buckets along each dimension
+    size_index_path: Union[str, None] = None  # .npy file caching the size index of the training set
 
     # Early stopping and model checkpoint config
     patience: int = 10000
     min_delta: float =  0.0
     max_mode: bool = False
     monitor: str = "loss"
+    save_top_k: int = 0
+
+    # Training state config
+    save_state: bool = False  # full training state saved to ckpts/state.pt at the end of every epoch
+    save_state_every_n_steps: int = 0  # also save it every N optimizer steps, disabled if 0
+    resume: Union[str, None] = None  # state.pt the training continues from
 
     # Model config
     n_classes: int = 10
+    model_ckpt: Union[str, None] = None  # weights loaded by evaluate.py
 
     # Trainer config
     batch_size: int = 64
     n_epochs: int = 1
     device: str = "cuda"
+    log_every_n_steps: int = 10
+    precision: str = "32"  # "32", "16" or "bf16"
+    accumulate_grad_batches: int = 1
+    gradient_clip_val: Union[float, None] = None
+    val_every_n_steps: int = 0  # also validate every N optimizer steps, only at the end of the epochs if 0
+    limit_val_batches: Union[int, None] = None  # batches of the validations within the epochs, all if None
+    max_time: Union[float, None] = None  # training time budget in seconds, the best model is still evaluated
+
+    # Batch size finder config, used by train.py
+    autotune_batch_size: bool = False  # probe the batch size with the highest throughput before training
+    max_batch_size: Union[int, None] = None  # largest batch size per process tried
+    batch_size_probe_steps: int = 10  # training steps measured for each batch size
+    batch_size_min_gain: float = 0.05  # minimum relative throughput gain to keep doubling the batch size
+    scale_lr: Union[str, None] = None  # None, "linear" or "sqrt" scaling of lr and max_lr with the batch size found
+
+    # Compilation config
+    compile: bool = True
+    compile_mode: Union[str, None] = None  # None (default), "reduce-overhead" or "max-autotune"
+    compile_dynamic: Union[bool, None] = None  # None detects dynamic shapes automatically
+    compile_backend: str = "inductor"
+    compile_cache_dir: Union[str, None] = None  # compiled artifacts cache, shared between runs
+
+    # Memory config
+    activation_checkpointing: List[str] = field(default_factory=list)  # submodule names or glob patterns
+    offload_optimizer_state: bool = False  # keep the optimizer state on the host between the steps
+    log_memory: bool = False  # log the peak memory of each phase of the training steps
+
+    # Media config
+    max_media_samples: int = 16  # test samples kept to generate media, disabled if 0
+    max_media_figures: int = 8
+    media_workers: int = 4  # processes rendering the figures, each renders at least 8, else the main process does
+
+    # Profiling config
+    log_step_timing: bool = False  # log the time of each phase of the training steps
+    profiler_start_step: int = 0
+    profiler_steps: int = 0  # number of steps traced with torch.profiler, disabled if 0
 
     # Optimizer config
     lr: float = 0.001
-    max_lr: float = 0.01
\ No newline at end of file
+    max_lr: float = 0.01
+
+    # Serving config, used by serve.py
+    serve_host: str = "127.0.0.1"
+    serve_port: int = 8000
+    serve_max_batch_size: int = 32
+    serve_max_wait_ms: float = 5.0  # time the first request of a batch waits for others
+
+    # Quantization config, used by export.py
+    quant_backend: str = "x86"  # "x86", "fbgemm", "qnnpack" or "onednn"
+    quant_calibration_batches: int = 32  # validation batches observed by static quantization
+    quant_latency_iters: int = 50
+
+    # Sweep config, used by sweep.py
+    sweep_trials: int = 20
+    sweep_jobs: int = 0  # trials run in parallel, 0 to fill the available cores
+    sweep_threads_per_trial: int = 1
+    sweep_pruner: str = "median"  # "median", "hyperband" or "none"
+    sweep_warmup_epochs: int = 1  # epochs before the median pruner can stop a trial
\ No newline at end of file
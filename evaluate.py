@@ -1,16 +1,15 @@
 # Import some packages for off-the-shelf modules
-import albumentations as A
-from albumentations.pytorch import ToTensorV2
-import torch
 import torch.nn as nn
 
 # Import from src for hand-crafted modules
 from src.models import TemplateModel
-from src.datasets import TemplateDataset
+from src.datasets import TemplateDataset, CachedDataset, build_dataloader
 from src.trainers import TemplateTrainer
+from src.utils import init_distributed, cleanup_distributed, load_model_weights
 # from src.losses import ...
 # from src.optimizers import ...
 
+from train import build_metrics
 from cfgs.config import CFG
 from omegaconf import DictConfig, OmegaConf
 import hydra
@@ -20,8 +19,13 @@ import hydra
 def main(cfg: DictConfig):
     default_cfg = OmegaConf.structured(CFG)
     cfg = OmegaConf.merge(default_cfg, cfg)
+    # initialize the process group when launched with torchrun, before creating the dataloaders
+    cfg.device = init_distributed(cfg.device)
+
+    # Define transformations, albumentations is imported once the config is parsed
+    import albumentations as A
+    from albumentations.pytorch import ToTensorV2
 
-    # Define transformations
     transforms_test = A.Compose([
         A.Resize(width=64, height=64),
         A.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
@@ -30,28 +34,36 @@ def main(cfg: DictConfig):
 
     # Create the dataset
     test_dataset = TemplateDataset(train=False, data_path=cfg.data_path, transforms=transforms_test)
+    if cfg.cache_dir is not None:
+        # deterministic transforms are run once and cached on disk
+        test_dataset = CachedDataset(test_dataset, cache_dir=cfg.cache_dir)
 
     # Create the dataloaders
-    test_dl = torch.utils.data.DataLoader(test_dataset, batch_size=cfg.batch_size, shuffle=True)
+    test_dl = build_dataloader(test_dataset, cfg)
 
     # Create the model
     model = TemplateModel(n_classes=cfg.n_classes)
-    # Load the model weights
-    model.load_state_dict(torch.load(cfg.model_ckpt))
+    # Load the model weights, also from checkpoints saved with the compiled model
+    load_model_weights(model, cfg.model_ckpt)
 
     # Instantiate the loss function
     criterion = nn.CrossEntropyLoss()
 
+    # Metrics computed on the device over the whole test set
+    metrics = build_metrics(cfg)
+
     # Initialize trainer
     trainer = TemplateTrainer(
         config=cfg,
         test_dl=test_dl,
         criterion=criterion,
+        metrics=metrics,
         model=model,
     )
 
     # Start evaluation
     trainer.evaluate()
+    cleanup_distributed()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,119 @@
+# Import some packages for off-the-shelf modules
+from itertools import islice
+import os
+import torch.nn as nn
+
+# Import from src for hand-crafted modules
+from src.models import TemplateModel
+from src.datasets import TemplateDataset, CachedDataset, build_dataloader
+from src.trainers import TemplateTrainer
+from src.utils import (
+    load_model_weights,
+    load_batch_to_device,
+    quantize_dynamic_int8,
+    quantize_static_int8,
+    export_torchscript,
+    get_model_size,
+    measure_latency,
+)
+
+from train import build_transforms, build_metrics
+from cfgs.config import CFG
+from omegaconf import DictConfig, OmegaConf
+import hydra
+
+
+def print_table(rows):
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    cells = [[f"{row[c]:.4f}" if isinstance(row.get(c), float) else str(row.get(c, "")) for c in columns] for row in rows]
+    widths = [max(len(c), *(len(line[i]) for line in cells)) for i, c in enumerate(columns)]
+    print(" | ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    print("-|-".join("-" * w for w in widths))
+    for line in cells:
+        print(" | ".join(cell.ljust(w) for cell, w in zip(line, widths)))
+
+
+@hydra.main(version_base=None, config_path="cfgs", config_name="config")
+def main(cfg: DictConfig):
+    default_cfg = OmegaConf.structured(CFG)
+    cfg = OmegaConf.merge(default_cfg, cfg)
+    # quantized kernels only run on the CPU, in eager mode and full precision
+    cfg.device = "cpu"
+    cfg.compile = False
+    cfg.precision = "32"
+
+    # Create the dataset and dataloader, used for the calibration and the evaluation
+    _, transforms_val = build_transforms()
+    valid_dataset = TemplateDataset(train=False, data_path=cfg.data_path, transforms=transforms_val)
+    if cfg.cache_dir is not None:
+        # deterministic transforms are run once and cached on disk
+        valid_dataset = CachedDataset(valid_dataset, cache_dir=cfg.cache_dir)
+    val_dl = build_dataloader(valid_dataset, cfg)
+
+    # Create the model
+    model = TemplateModel(n_classes=cfg.n_classes)
+    # Load the model weights, also from checkpoints saved with the compiled model
+    load_model_weights(model, cfg.model_ckpt)
+    model.eval()
+
+    # Instantiate the loss function
+    criterion = nn.CrossEntropyLoss()
+
+    # Metrics computed over the whole validation set, reported for each variant
+    metrics = build_metrics(cfg)
+
+    # Initialize trainer, each variant is evaluated with its test loop
+    trainer = TemplateTrainer(
+        config=cfg,
+        test_dl=val_dl,
+        criterion=criterion,
+        metrics=metrics,
+        model=model,
+    )
+
+    # Calibration batches for static quantization, with the eval batch transforms applied
+    calibration_inputs = [
+        trainer.transform_batch(load_batch_to_device(batch, "cpu"), trainer.eval_transforms)["x"]
+        for batch in islice(val_dl, cfg.quant_calibration_batches)
+    ]
+    # the first batch is also the example input of the latency measures and the TorchScript export
+    if not calibration_inputs:
+        raise ValueError(
+            f"No calibration batches, quant_calibration_batches is {cfg.quant_calibration_batches} "
+            f"and the validation set has {len(valid_dataset)} samples, both should be positive"
+        )
+
+    # Quantize the model
+    variants = {"fp32": model, "dynamic_int8": quantize_dynamic_int8(model)}
+    try:
+        variants["static_int8"] = quantize_static_int8(model, calibration_inputs, backend=cfg.quant_backend)
+    except Exception as e:
+        print(f"Static quantization failed, the model may not be symbolically traceable: {e}")
+
+    # Evaluate, measure and export each variant
+    export_dir = os.path.join(trainer.logger.results_dir, "export")
+    os.makedirs(export_dir, exist_ok=True)
+    example_input = calibration_inputs[0]
+    rows = []
+    for name, variant in variants.items():
+        print(f"Evaluating {name}...")
+        trainer.model = variant
+        row = {"variant": name}
+        row.update({f"test/{k}": v for k, v in trainer.test().items()})
+        row["size_mb"] = get_model_size(variant)
+        row["latency_ms"] = measure_latency(variant, example_input, n_iters=cfg.quant_latency_iters)
+        export_torchscript(variant, example_input, os.path.join(export_dir, f"{name}.pt"))
+        rows.append(row)
+
+    # Differences of the metrics with respect to the float model
+    for row in rows:
+        for key in [key for key in row if key.startswith("test/")]:
+            row[f"delta/{key[5:]}"] = row[key] - rows[0][key]
+    for row in rows:
+        trainer.logger.upload_metrics(row)
+    print_table(rows)
+    trainer.logger.finish()
+
+
+if __name__ == "__main__":
+    main()
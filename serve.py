@@ -0,0 +1,68 @@
+# Import some packages for off-the-shelf modules
+import torch
+
+# Import from src for hand-crafted modules
+from src.models import TemplateModel
+from src.trainers import TemplateTrainer
+from src.serving import InferenceServer, make_predict_fn, decode_image
+from src.utils import load_model_weights
+
+from train import build_transforms
+from cfgs.config import CFG
+from omegaconf import DictConfig, OmegaConf
+import hydra
+
+
+@hydra.main(version_base=None, config_path="cfgs", config_name="config")
+def main(cfg: DictConfig):
+    default_cfg = OmegaConf.structured(CFG)
+    cfg = OmegaConf.merge(default_cfg, cfg)
+
+    # Requests go through the same transforms as the validation samples
+    _, transforms_val = build_transforms()
+
+    # Create the model
+    model = TemplateModel(n_classes=cfg.n_classes)
+    # Load the model weights once, also from checkpoints saved with the compiled model
+    load_model_weights(model, cfg.model_ckpt)
+
+    # Initialize trainer, its predict is used for the batches of requests
+    trainer = TemplateTrainer(
+        config=cfg,
+        model=model,
+    )
+
+    def preprocess(data):
+        return transforms_val(image=decode_image(data))["image"]
+
+    def postprocess(output):
+        scores = torch.softmax(output.float(), dim=-1)
+        return {"prediction": int(scores.argmax()), "scores": scores.tolist()}
+
+    server = InferenceServer(
+        make_predict_fn(trainer),
+        preprocess,
+        postprocess,
+        host=cfg.serve_host,
+        port=cfg.serve_port,
+        max_batch_size=cfg.serve_max_batch_size,
+        max_wait_ms=cfg.serve_max_wait_ms,
+    )
+    print(f"Serving on {server.url}, stop with Ctrl+C")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+    # Report the latency and throughput of the session
+    metrics = server.stats.get_metrics()
+    for name, value in metrics.items():
+        print(f"{name}: {value:.3f}")
+    trainer.logger.upload_metrics({f"serve/{k}": v for k, v in metrics.items()})
+    trainer.logger.finish()
+
+
+if __name__ == "__main__":
+    main()
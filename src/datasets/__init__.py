@@ -1 +1,6 @@
 from .dataset import TemplateDataset
+from .cache import CachedDataset
+from .samplers import ResumableSampler, ShardSampler, BucketBatchSampler, build_size_index
+from .collate import PadCollate, pad_collate
+from .shards import ShardWriter, ShardedDataset, write_shards
+from .loader import build_dataloader, autotune_num_workers
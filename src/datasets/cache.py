@@ -0,0 +1,276 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+
+# transforms that always give the same output for the same input
+DETERMINISTIC_TRANSFORMS = (
+    "Resize",
+    "LongestMaxSize",
+    "SmallestMaxSize",
+    "CenterCrop",
+    "PadIfNeeded",
+    "Normalize",
+    "ToFloat",
+    "ToGray",
+    "ToTensorV2",
+)
+
+
+def compose_like(transforms, items, additional_targets=None):
+    """
+    Compose of the given transforms with the parameters of another Compose (bbox and keypoint params,
+    additional targets, probability).
+    :param transforms: albumentations Compose whose parameters are copied
+    :param items: transforms of the new Compose
+    :param additional_targets: additional targets added to the ones of transforms
+    """
+    import albumentations as A
+
+    processors = getattr(transforms, "processors", {})
+    return A.Compose(
+        items,
+        bbox_params=processors["bboxes"].params if "bboxes" in processors else None,
+        keypoint_params=processors["keypoints"].params if "keypoints" in processors else None,
+        additional_targets={**(getattr(transforms, "additional_targets", None) or {}), **(additional_targets or {})},
+        p=getattr(transforms, "p", 1.0),
+        is_check_shapes=getattr(transforms, "is_check_shapes", True),
+    )
+
+
+def split_deterministic(transforms, additional_targets=None):
+    """
+    Split an albumentations Compose into its deterministic prefix and the remaining transforms.
+    Both keep the parameters of the original Compose.
+    :param transforms: albumentations Compose or None
+    :param additional_targets: additional targets of the suffix, e.g. the cached masks
+    :return: (prefix, suffix) tuple of Compose objects, None if empty
+    """
+    items = list(transforms.transforms) if transforms is not None else []
+    n_deterministic = 0
+    for transform in items:
+        if type(transform).__name__ not in DETERMINISTIC_TRANSFORMS or getattr(transform, "p", 1.0) < 1.0:
+            break
+        n_deterministic += 1
+
+    prefix = compose_like(transforms, items[:n_deterministic]) if n_deterministic > 0 else None
+    suffix = (
+        compose_like(transforms, items[n_deterministic:], additional_targets)
+        if n_deterministic < len(items) else None
+    )
+    return prefix, suffix
+
+
+def has_spatial_transforms(transforms) -> bool:
+    """
+    Whether the pipeline has transforms that move the pixels (flips, crops, affine...), which should
+    also be applied to the masks.
+    """
+    import albumentations as A
+
+    if transforms is None:
+        return False
+    if isinstance(transforms, A.BaseCompose):
+        return any(has_spatial_transforms(transform) for transform in transforms.transforms)
+    return isinstance(transforms, A.DualTransform)
+
+
+def files_fingerprint(path) -> str:
+    """
+    Hash of the names, sizes and modification times of the files under path, so the cache is rebuilt
+    when the source data changes.
+    """
+    files = [path] if os.path.isfile(path) else sorted(
+        os.path.join(root, name) for root, _, names in os.walk(path) for name in names
+    )
+    digest = hashlib.sha1()
+    for filename in files:
+        stat = os.stat(filename)
+        digest.update(f"{os.path.relpath(filename, path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def transform_fingerprint(transforms) -> str:
+    """
+    Stable description of a transform pipeline, used to invalidate the cache when it changes.
+    """
+    if transforms is None:
+        return "none"
+    import albumentations as A
+
+    try:
+        return json.dumps(A.to_dict(transforms), sort_keys=True, default=str)
+    except Exception:
+        return repr(transforms)
+
+
+class CachedDataset(Dataset):
+    def __init__(self, dataset, cache_dir, image_key="x", mask_keys=(), shard_size=1024):
+        """
+        Dataset wrapper that runs the deterministic prefix of the dataset transforms once and stores
+        the results in np.memmap shards on disk. Samples are then served zero-copy from the shards
+        and only the remaining (random) transforms run per sample.
+        The wrapped dataset should expose its transforms as `transforms` and its path as `data_path`,
+        and return dictionaries of arrays, tensors or numbers with a fixed shape after the prefix.
+        The cache is rebuilt when the transforms or the files under `data_path` change.
+        :param dataset: map-style dataset to cache
+        :param cache_dir: directory where the caches are stored, shared between runs
+        :param image_key: key of the sample the remaining transforms are applied to
+        :param mask_keys: keys transformed as masks together with the image, e.g. ("y",) for segmentation,
+        required when the remaining transforms are spatial and the samples have other arrays
+        :param shard_size: number of samples per shard file
+        """
+        self.dataset = dataset
+        self.image_key = image_key
+        self.shard_size = shard_size
+        # the masks are passed to the remaining transforms as additional targets
+        self.mask_targets = {key: f"cached_mask_{i}" for i, key in enumerate(mask_keys)}
+        self.prefix, self.suffix = split_deterministic(
+            dataset.transforms, {target: "mask" for target in self.mask_targets.values()}
+        )
+
+        key = json.dumps({
+            "data_path": os.path.abspath(dataset.data_path),
+            "files": files_fingerprint(dataset.data_path) if os.path.exists(dataset.data_path) else None,
+            "train": getattr(dataset, "train", None),
+            "length": len(dataset),
+            "shard_size": shard_size,
+            "transforms": transform_fingerprint(self.prefix),
+        }, sort_keys=True)
+        self.cache_path = os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest()[:16])
+        if not os.path.exists(os.path.join(self.cache_path, "meta.json")):
+            self.build()
+        with open(os.path.join(self.cache_path, "meta.json")) as f:
+            self.meta = json.load(f)
+        # shards are opened lazily, so each dataloader worker maps its own
+        self.shards = {}
+
+        if has_spatial_transforms(self.suffix):
+            untransformed = [
+                key for key, spec in self.meta["keys"].items()
+                if key != image_key and key not in self.mask_targets and len(spec["shape"]) >= 2
+            ]
+            if untransformed:
+                raise ValueError(
+                    f"The random transforms move the pixels of '{image_key}' but not of {untransformed}, "
+                    f"pass the spatial keys as mask_keys so they are transformed together."
+                )
+
+    def build(self):
+        """
+        Run the deterministic transforms over the whole dataset and write the shards.
+        The cache is written to a temporary directory and renamed at the end, so concurrent runs
+        never read a partially written cache.
+        """
+        tmp_path = f"{self.cache_path}.tmp-{os.getpid()}"
+        os.makedirs(tmp_path, exist_ok=True)
+        transforms = self.dataset.transforms
+        self.dataset.transforms = self.prefix
+        try:
+            keys = {}
+            arrays = {}
+            for idx in range(len(self.dataset)):
+                shard, offset = divmod(idx, self.shard_size)
+                sample = self.dataset[idx]
+                if not keys:
+                    keys = {key: self.describe(value) for key, value in sample.items()}
+                if offset == 0:
+                    self.flush(arrays)
+                    n_samples = min(self.shard_size, len(self.dataset) - idx)
+                    arrays = {
+                        key: np.lib.format.open_memmap(
+                            os.path.join(tmp_path, f"{key}-{shard:05d}.npy"), mode="w+",
+                            dtype=spec["dtype"], shape=(n_samples, *spec["shape"])
+                        )
+                        for key, spec in keys.items()
+                    }
+                for key, value in sample.items():
+                    value = self.to_numpy(value)
+                    if value.shape != tuple(keys[key]["shape"]):
+                        raise ValueError(
+                            f"Cached samples must have a fixed shape, got {value.shape} for '{key}' "
+                            f"instead of {tuple(keys[key]['shape'])}. Add a deterministic resize to the transforms."
+                        )
+                    arrays[key][offset] = value
+            self.flush(arrays)
+
+            with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+                json.dump({"length": len(self.dataset), "keys": keys}, f)
+            try:
+                os.rename(tmp_path, self.cache_path)
+            except OSError:
+                # another process built the same cache in the meantime
+                shutil.rmtree(tmp_path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        finally:
+            self.dataset.transforms = transforms
+
+    @staticmethod
+    def flush(arrays):
+        for array in arrays.values():
+            array.flush()
+
+    @staticmethod
+    def to_numpy(value):
+        if isinstance(value, torch.Tensor):
+            return value.numpy()
+        return np.asarray(value)
+
+    def describe(self, value) -> dict:
+        if isinstance(value, torch.Tensor):
+            kind = "tensor"
+        elif isinstance(value, np.ndarray):
+            kind = "ndarray"
+        else:
+            kind = "scalar"
+        array = self.to_numpy(value)
+        return {"kind": kind, "dtype": array.dtype.str, "shape": list(array.shape)}
+
+    def open_shard(self, shard):
+        if shard not in self.shards:
+            # copy-on-write mapping, the arrays are writable but the cache files are never modified
+            self.shards[shard] = {
+                key: np.load(os.path.join(self.cache_path, f"{key}-{shard:05d}.npy"), mmap_mode="c")
+                for key in self.meta["keys"]
+            }
+        return self.shards[shard]
+
+    def __len__(self) -> int:
+        return self.meta["length"]
+
+    def __getitem__(self, idx) -> dict:
+        shard, offset = divmod(idx, self.shard_size)
+        arrays = self.open_shard(shard)
+
+        sample = {}
+        for key, spec in self.meta["keys"].items():
+            value = np.asarray(arrays[key][offset])
+            if spec["kind"] == "tensor":
+                value = torch.from_numpy(value)
+            elif spec["kind"] == "scalar":
+                value = value.item()
+            sample[key] = value
+
+        # random transforms run on top of the cached sample
+        if self.suffix is not None:
+            outputs = self.suffix(
+                image=sample[self.image_key],
+                **{target: sample[key] for key, target in self.mask_targets.items()},
+            )
+            sample[self.image_key] = outputs["image"]
+            for key, target in self.mask_targets.items():
+                sample[key] = outputs[target]
+        return sample
+
+    def __getstate__(self):
+        # memory maps are not sent to the dataloader workers
+        state = self.__dict__.copy()
+        state["shards"] = {}
+        return state
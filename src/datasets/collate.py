@@ -0,0 +1,49 @@
+import math
+
+import torch
+from torch.utils.data import default_collate
+
+
+class PadCollate:
+    def __init__(self, keys=("x",), n_dims=2, pad_value=0, mask_key="mask", pad_to_multiple=1):
+        """
+        Collate samples of different sizes by padding the last n_dims dimensions of the given keys to the largest
+        sample of the batch, at the end. The other keys are collated with the default collate function.
+        :param keys: keys of the samples to pad, with the same size in the padded dimensions, e.g. ("x", "y")
+        for images and segmentation masks
+        :param n_dims: number of trailing dimensions to pad, 2 for images (C, H, W) and 1 for sequences
+        :param pad_value: padding value, or dictionary with the padding value of each key, e.g. the ignore
+        index of the segmentation masks
+        :param mask_key: key of the boolean mask of the valid positions, with shape (B, *padded size), not added if None
+        :param pad_to_multiple: round the padded size up to a multiple, e.g. the stride of the model
+        """
+        self.keys = keys
+        self.n_dims = n_dims
+        self.pad_value = pad_value
+        self.mask_key = mask_key
+        self.pad_to_multiple = pad_to_multiple
+
+    def __call__(self, batch: list) -> dict:
+        sizes = [tuple(torch.as_tensor(sample[self.keys[0]]).shape[-self.n_dims:]) for sample in batch]
+        padded_size = [
+            math.ceil(max(dim_sizes) / self.pad_to_multiple) * self.pad_to_multiple for dim_sizes in zip(*sizes)
+        ]
+
+        collated = default_collate([{k: v for k, v in sample.items() if k not in self.keys} for sample in batch])
+        for key in self.keys:
+            values = [torch.as_tensor(sample[key]) for sample in batch]
+            pad_value = self.pad_value[key] if isinstance(self.pad_value, dict) else self.pad_value
+            output = values[0].new_full((len(values), *values[0].shape[:-self.n_dims], *padded_size), pad_value)
+            for i, value in enumerate(values):
+                output[(i, Ellipsis, *(slice(0, size) for size in value.shape[-self.n_dims:]))] = value
+            collated[key] = output
+        if self.mask_key is not None:
+            mask = torch.zeros((len(batch), *padded_size), dtype=torch.bool)
+            for i, size in enumerate(sizes):
+                mask[(i, *(slice(0, s) for s in size))] = True
+            collated[self.mask_key] = mask
+        return collated
+
+
+# pads the images "x" of the samples, set collate_fn="src.datasets.collate.pad_collate" to use it
+pad_collate = PadCollate()
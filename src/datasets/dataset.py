@@ -9,7 +9,9 @@ class TemplateDataset(Dataset):
         :param data_path: path to the dataset
         :param transforms: data transforms
         """
-        pass
+        self.train = train
+        self.data_path = data_path
+        self.transforms = transforms
 
     def __len__(self) -> int:
         """
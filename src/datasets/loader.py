@@ -0,0 +1,135 @@
+import os
+import time
+import warnings
+
+import torch
+from torch.utils.data import DataLoader, IterableDataset
+
+from src.utils import get_batch_size, get_rank, get_world_size
+from .samplers import ResumableSampler, ShardSampler, BucketBatchSampler
+from .shards import ShardedDataset
+
+
+def get_collate_fn(dataset, collate_fn):
+    """
+    Resolve the collate function from the config.
+    :param dataset: dataset, or dataset wrapper, the loader is built for
+    :param collate_fn: None for the default pytorch collate function, "dataset" for the collate_fn
+    of the dataset or the import path of a function
+    :return:
+    """
+    if collate_fn is None:
+        return None
+    elif collate_fn == "dataset":
+        # look through dataset wrappers such as CachedDataset
+        while not hasattr(dataset, "collate_fn") and hasattr(dataset, "dataset"):
+            dataset = dataset.dataset
+        return dataset.collate_fn
+    import hydra
+
+    return hydra.utils.get_method(collate_fn)
+
+
+def build_dataloader(dataset, cfg, train=False, num_workers=None, batch_size=None, seed=42, sizes=None) -> DataLoader:
+    """
+    Build the dataloader of a dataset from the config. Only the training loader is shuffled
+    and drops the last incomplete batch. When training with multiple processes each one
+    loads its own part of the dataset, through a ResumableSampler for training and a ShardSampler, which
+    does not repeat samples to even out the processes, for evaluation. A ShardedDataset splits itself.
+    The training loader samples with a ResumableSampler and draws the seed of its workers from
+    its own generator, so an interrupted epoch can be resumed at the same position.
+    With a size index and cfg.max_batch_tokens set, the batches are built by a BucketBatchSampler
+    under a budget of padded pixels or tokens instead of a fixed batch size.
+    :param dataset: dataset to load
+    :param cfg: config
+    :param train: whether the loader is used for training
+    :param num_workers: number of workers, overrides cfg.num_workers
+    :param batch_size: batch size, overrides cfg.batch_size
+    :param seed: seed of the training sampler and workers
+    :param sizes: size index of the dataset, see build_size_index
+    :return:
+    """
+    num_workers = cfg.num_workers if num_workers is None else num_workers
+    batch_size = cfg.batch_size if batch_size is None else batch_size
+    sampler = None
+    generator = None
+    if isinstance(dataset, ShardedDataset):
+        # the workers read whole batches, so the loader yields len(loader) batches
+        dataset = dataset.with_batch_size(batch_size)
+    if train and sizes is None and cfg.max_batch_tokens is not None:
+        warnings.warn(f"max_batch_tokens is set without a size index, using batches of {batch_size} samples.")
+    if sizes is not None and cfg.max_batch_tokens is not None:
+        batch_sampler = BucketBatchSampler(
+            sizes,
+            max_tokens=cfg.max_batch_tokens,
+            n_buckets=cfg.n_size_buckets,
+            shuffle=train,
+            seed=seed,
+            drop_last=cfg.drop_last and train,
+        )
+        return DataLoader(
+            dataset,
+            batch_sampler=batch_sampler,
+            generator=torch.Generator().manual_seed(seed + get_rank()),
+            num_workers=num_workers,
+            collate_fn=get_collate_fn(dataset, cfg.collate_fn),
+            pin_memory=cfg.pin_memory and torch.device(cfg.device).type != "cpu",
+            persistent_workers=cfg.persistent_workers and num_workers > 0,
+            prefetch_factor=cfg.prefetch_factor if num_workers > 0 else None,
+        )
+    if train and not isinstance(dataset, IterableDataset):
+        sampler = ResumableSampler(dataset, shuffle=True, seed=seed, drop_last=cfg.drop_last)
+        # each process gets different worker seeds, as with the global random generator
+        generator = torch.Generator().manual_seed(seed + get_rank())
+    elif get_world_size() > 1 and not isinstance(dataset, IterableDataset):
+        sampler = ShardSampler(dataset)
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        sampler=sampler,
+        generator=generator,
+        num_workers=num_workers,
+        collate_fn=get_collate_fn(dataset, cfg.collate_fn),
+        # page-locked memory only helps the copies to an accelerator
+        pin_memory=cfg.pin_memory and torch.device(cfg.device).type != "cpu",
+        drop_last=cfg.drop_last and train,
+        persistent_workers=cfg.persistent_workers and num_workers > 0,
+        prefetch_factor=cfg.prefetch_factor if num_workers > 0 else None,
+    )
+
+
+def autotune_num_workers(dataset, cfg, candidates=None, n_batches=20, sizes=None) -> int:
+    """
+    Measure the loading throughput of the dataset for several numbers of workers and return the fastest.
+    Worker startup is not measured, only the steady state loading.
+    :param dataset: dataset to load
+    :param cfg: config
+    :param candidates: numbers of workers to try, by default powers of two up to the number of cores
+    :param n_batches: number of batches loaded for each candidate
+    :param sizes: size index of the dataset, see build_size_index
+    :return: the number of workers with the highest samples/sec
+    """
+    if candidates is None:
+        n_cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+        candidates = [0] + [2 ** i for i in range(n_cores.bit_length()) if 2 ** i <= n_cores]
+
+    results = {}
+    for num_workers in candidates:
+        loader = build_dataloader(dataset, cfg, train=True, num_workers=num_workers, sizes=sizes)
+        loader_iter = iter(loader)
+        # the first batch includes the workers startup
+        if next(loader_iter, None) is None:
+            return cfg.num_workers
+        n_samples = 0
+        start_time = time.perf_counter()
+        for _, batch in zip(range(n_batches), loader_iter):
+            n_samples += get_batch_size(batch)
+        elapsed = time.perf_counter() - start_time
+        results[num_workers] = n_samples / elapsed if elapsed > 0 else 0.0
+        del loader_iter, loader
+
+    best_num_workers = max(results, key=results.get)
+    print("Dataloader throughput (samples/sec): " +
+          ", ".join(f"{n} workers: {rate:.1f}" for n, rate in results.items()))
+    print(f"Using {best_num_workers} workers.")
+    return best_num_workers
@@ -0,0 +1,170 @@
+import os
+
+import numpy as np
+from torch.utils.data import DataLoader, DistributedSampler, Sampler
+
+from src.utils import get_rank, get_world_size
+
+
+class ResumableSampler(DistributedSampler):
+    def __init__(self, dataset, shuffle=True, seed=0, drop_last=False):
+        """
+        DistributedSampler that can start the epoch at a given position, so a resumed training skips
+        the samples already consumed without loading them. It also works with a single process,
+        where it samples the whole dataset. The order only depends on the seed and the epoch.
+        The start position is reset by set_epoch, so it only applies to the epoch being resumed.
+        :param dataset: map-style dataset to sample from
+        :param shuffle: whether to shuffle the indices every epoch
+        :param seed: seed of the shuffling, it should be the same in all the processes
+        :param drop_last: drop the tail of the dataset instead of padding it to split it evenly between processes
+        """
+        super().__init__(
+            dataset,
+            num_replicas=get_world_size(),
+            rank=get_rank(),
+            shuffle=shuffle,
+            seed=seed,
+            drop_last=drop_last
+        )
+        self.start_index = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        super().set_epoch(epoch)
+        self.start_index = 0
+
+    def set_start_index(self, start_index: int) -> None:
+        """
+        :param start_index: number of samples of this process already consumed in the current epoch
+        """
+        self.start_index = start_index
+
+    def __iter__(self):
+        indices = list(super().__iter__())
+        return iter(indices[self.start_index:])
+
+    def __len__(self) -> int:
+        return max(self.num_samples - self.start_index, 0)
+
+
+class ShardSampler(Sampler):
+    def __init__(self, dataset):
+        """
+        Split a map-style dataset between the processes without padding it, so each sample is evaluated once.
+        Unlike a DistributedSampler, the processes may get one sample less than the others.
+        :param dataset: map-style dataset to sample from
+        """
+        super().__init__()
+        self.indices = range(get_rank(), len(dataset), get_world_size())
+
+    def __iter__(self):
+        return iter(self.indices)
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+
+def build_size_index(dataset, filename=None, key="x", n_dims=2, num_workers=0) -> np.ndarray:
+    """
+    Size of every sample of the dataset, for the BucketBatchSampler. The sizes are read with dataset.get_size(idx)
+    if the dataset defines it (e.g. from the image headers), otherwise from the shape of the loaded samples.
+    :param dataset: map-style dataset
+    :param filename: .npy file the index is saved to, it is loaded from it if it exists
+    :param key: key of the sample whose shape is measured
+    :param n_dims: number of trailing dimensions of the size, 2 for images (H, W) and 1 for sequences
+    :param num_workers: number of processes loading the samples
+    :return: array of sizes with shape (N, n_dims)
+    """
+    if filename is not None and os.path.exists(filename):
+        return np.load(filename)
+    if hasattr(dataset, "get_size"):
+        sizes = [dataset.get_size(idx) for idx in range(len(dataset))]
+    else:
+        loader = DataLoader(dataset, batch_size=None, num_workers=num_workers)
+        sizes = [np.shape(sample[key])[-n_dims:] for sample in loader]
+    sizes = np.asarray(sizes, dtype=np.int64).reshape(len(dataset), n_dims)
+    if filename is not None:
+        np.save(filename, sizes)
+    return sizes
+
+
+class BucketBatchSampler(Sampler):
+    def __init__(self, sizes, max_tokens, n_buckets=8, max_batch_size=None, shuffle=True, seed=0, drop_last=False):
+        """
+        Batch sampler grouping samples of similar size, so the batches are padded less. The samples are split in
+        buckets by the quantiles of their size along each dimension, and the batches of each bucket hold as many
+        samples as fit in max_tokens when padded to the largest sample of the bucket. Every epoch the samples of
+        each bucket and the batches are shuffled, and the batches are split evenly between the processes,
+        so the number of batches is the same every epoch and in every process.
+        :param sizes: size of each sample, with shape (N,) for lengths or (N, D), e.g. (N, 2) for image heights and widths
+        :param max_tokens: maximum number of padded pixels or tokens of a batch
+        :param n_buckets: number of buckets along each dimension
+        :param max_batch_size: maximum number of samples of a batch, unlimited if None
+        :param shuffle: whether to shuffle the samples and batches every epoch
+        :param seed: seed of the shuffling, it should be the same in all the processes
+        :param drop_last: drop the incomplete batch of each bucket
+        """
+        self.sizes = np.asarray(sizes).reshape(len(sizes), -1)
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+        self.num_replicas = get_world_size()
+        self.rank = get_rank()
+
+        # bucket of each sample, from its bucket along each dimension
+        bucket_ids = np.zeros(len(self.sizes), dtype=np.int64)
+        for dim_sizes in self.sizes.T:
+            edges = np.unique(np.quantile(dim_sizes, np.linspace(0, 1, n_buckets + 1)[1:-1]))
+            bucket_ids = bucket_ids * (len(edges) + 1) + np.searchsorted(edges, dim_sizes)
+        self.buckets = [np.flatnonzero(bucket_ids == bucket) for bucket in np.unique(bucket_ids)]
+        # a batch of the bucket padded to its largest sample along each dimension fits the budget
+        self.batch_sizes = []
+        for indices in self.buckets:
+            batch_size = max(1, int(max_tokens // np.prod(self.sizes[indices].max(0))))
+            self.batch_sizes.append(min(batch_size, max_batch_size) if max_batch_size else batch_size)
+
+        self.set_epoch(0)
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+        self.start_index = 0
+        self.batches = self.build_batches(epoch)
+
+    def set_start_index(self, start_index: int) -> None:
+        """
+        :param start_index: number of batches of this process already consumed in the current epoch
+        """
+        self.start_index = start_index
+
+    def build_batches(self, epoch) -> list:
+        rng = np.random.default_rng((self.seed, epoch))
+        batches = []
+        for indices, batch_size in zip(self.buckets, self.batch_sizes):
+            if self.shuffle:
+                indices = rng.permutation(indices)
+            n_samples = len(indices) // batch_size * batch_size if self.drop_last else len(indices)
+            batches.extend(indices[i:i + batch_size] for i in range(0, n_samples, batch_size))
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        # drop the tail so every process gets the same number of batches
+        n_batches = len(batches) // self.num_replicas * self.num_replicas
+        return batches[self.rank:n_batches:self.num_replicas]
+
+    def get_metrics(self) -> dict:
+        """
+        Padding of the batches of the epoch in this process, the fraction of padded pixels or tokens
+        when each batch is padded to its largest sample along each dimension.
+        """
+        n_padded = sum(len(batch) * np.prod(self.sizes[batch].max(0)) for batch in self.batches)
+        n_tokens = sum(np.prod(self.sizes[batch], axis=1).sum() for batch in self.batches)
+        return {
+            "padding_ratio": float(1 - n_tokens / n_padded) if n_padded > 0 else 0.0,
+            "mean_batch_size": float(np.mean([len(batch) for batch in self.batches])) if self.batches else 0.0,
+        }
+
+    def __iter__(self):
+        for batch in self.batches[self.start_index:]:
+            yield batch.tolist()
+
+    def __len__(self) -> int:
+        return max(len(self.batches) - self.start_index, 0)
@@ -0,0 +1,306 @@
+import copy
+import json
+import os
+import pickle
+import shutil
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+
+from src.utils import get_rank, get_world_size
+
+
+def open_file(path, mode="rb"):
+    """
+    Open a local file, or a remote one (s3://, gs://, ...) with fsspec.
+    """
+    if "://" in path:
+        import fsspec
+
+        return fsspec.open(path, mode).open()
+    return open(path, mode)
+
+
+def encode_sample(sample: dict) -> bytes:
+    # tensors are stored as numpy arrays, the default collate function converts them back
+    sample = {key: value.numpy() if isinstance(value, torch.Tensor) else value for key, value in sample.items()}
+    return pickle.dumps(sample, protocol=5)
+
+
+class ShardWriter:
+    def __init__(self, output_dir, shard_size_mb=256):
+        """
+        Write samples sequentially to packed binary shards. Each shard "shard-XXXXX.bin" holds the pickled
+        samples back to back, and its index "shard-XXXXX.idx.npy" holds their byte offsets. The list of shards
+        and their number of samples is written to "index.json" on close.
+        :param output_dir: directory of the shards
+        :param shard_size_mb: size at which a new shard is started
+        """
+        self.output_dir = output_dir
+        self.shard_size = int(shard_size_mb * 2 ** 20)
+        self.shards = []
+        self.file = None
+        self.offsets = []
+        os.makedirs(output_dir, exist_ok=True)
+
+    def write(self, sample: dict) -> None:
+        """
+        :param sample: dictionary of arrays, tensors, numbers, strings or bytes (e.g. encoded images)
+        """
+        if self.file is None or self.offsets[-1] >= self.shard_size:
+            self.close_shard()
+            self.file = open(os.path.join(self.output_dir, f"shard-{len(self.shards):05d}.bin"), "wb")
+            self.offsets = [0]
+        data = encode_sample(sample)
+        self.file.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+    def close_shard(self) -> None:
+        if self.file is None:
+            return
+        self.file.close()
+        filename = os.path.basename(self.file.name)
+        np.save(os.path.join(self.output_dir, filename.replace(".bin", ".idx.npy")), np.array(self.offsets))
+        self.shards.append({"filename": filename, "n_samples": len(self.offsets) - 1})
+        self.file = None
+
+    def close(self) -> None:
+        self.close_shard()
+        with open(os.path.join(self.output_dir, "index.json"), "w") as f:
+            json.dump({"n_samples": sum(shard["n_samples"] for shard in self.shards), "shards": self.shards}, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_shards(dataset, output_dir, shard_size_mb=256, num_workers=0) -> str:
+    """
+    Convert a map-style dataset to packed binary shards, in the order of the dataset. The samples are written
+    as returned by the dataset, so set its random transforms to None and apply them in the ShardedDataset.
+    The shards are written to a temporary directory and renamed at the end, so readers never see partial shards.
+    :param dataset: map-style dataset returning dictionaries
+    :param output_dir: directory of the shards, it should not exist
+    :param shard_size_mb: size of each shard
+    :param num_workers: number of processes reading the dataset
+    :return: output_dir
+    """
+    tmp_dir = f"{output_dir.rstrip('/')}.tmp-{os.getpid()}"
+    # batch_size=None loads the samples one by one and in order, without collating them
+    loader = DataLoader(dataset, batch_size=None, num_workers=num_workers)
+    try:
+        with ShardWriter(tmp_dir, shard_size_mb=shard_size_mb) as writer:
+            for sample in loader:
+                writer.write(sample)
+        os.rename(tmp_dir, output_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return output_dir
+
+
+class ShardedDataset(IterableDataset):
+    def __init__(self, data_path, shuffle=False, shuffle_buffer=1000, transforms=None, seed=0):
+        """
+        Dataset streaming the samples of the shards written by ShardWriter with sequential reads.
+        Every epoch the shard order is shuffled, the stream of samples is split evenly between the processes
+        in contiguous ranges, and each range between the dataloader workers in contiguous runs of whole
+        batches, so the loader yields len(loader) batches in every process. The remaining samples (fewer than
+        the number of processes) are dropped. Each worker shuffles its samples with a bounded buffer.
+        Call set_epoch before each epoch to change the order, the trainer does it for the training loader,
+        and set_start_index to resume an epoch.
+        :param data_path: directory of the shards, local or remote with fsspec
+        :param shuffle: whether to shuffle the shards and the samples
+        :param shuffle_buffer: number of samples held in memory by each worker to shuffle them
+        :param transforms: function applied to each decoded sample dictionary, e.g. to decode and augment images
+        :param seed: seed of the shuffling, it should be the same in all the processes
+        """
+        self.data_path = data_path
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer
+        self.transforms = transforms
+        self.seed = seed
+        with open_file(os.path.join(data_path, "index.json")) as f:
+            self.shards = json.load(f)["shards"]
+        self.n_samples = sum(shard["n_samples"] for shard in self.shards)
+        # loader batch size, set by build_dataloader, the workers read whole batches
+        self.batch_size = 1
+        # read in the main process, the dataloader workers are not part of the process group
+        self.rank = get_rank()
+        self.world_size = get_world_size()
+        # shared with the persistent dataloader workers
+        self.epoch = torch.zeros(1, dtype=torch.long).share_memory_()
+        self.start_index = torch.zeros(1, dtype=torch.long).share_memory_()
+        self.offsets = {}
+
+    def with_batch_size(self, batch_size):
+        """
+        Copy of the dataset for a loader with the given batch size, it shares the epoch and start index
+        with the original.
+        """
+        dataset = copy.copy(self)
+        dataset.batch_size = batch_size or 1
+        dataset.rank = get_rank()
+        dataset.world_size = get_world_size()
+        return dataset
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch.fill_(epoch)
+        self.start_index.fill_(0)
+
+    def set_start_index(self, start_index: int) -> None:
+        """
+        :param start_index: number of batches of this process already consumed in the current epoch
+        """
+        self.start_index.fill_(start_index)
+
+    def __len__(self) -> int:
+        return max(self.n_samples // self.world_size - int(self.start_index.item()) * self.batch_size, 0)
+
+    def get_shard_order(self, epoch) -> np.ndarray:
+        if not self.shuffle:
+            return np.arange(len(self.shards))
+        return np.random.default_rng((self.seed, epoch)).permutation(len(self.shards))
+
+    def get_worker_range(self, worker, n_workers, start_index=0) -> tuple:
+        """
+        Contiguous range of the stream of samples read by a worker of this process. The batches of the process
+        are split in contiguous runs, the first workers get one more batch if they don't split evenly.
+        :param start_index: number of batches of this process already consumed
+        :return: (start, stop, n_consumed) tuple, n_consumed is the number of samples of the range consumed
+        """
+        n_samples = self.n_samples // self.world_size
+        n_batches = -(-n_samples // self.batch_size)
+        n_worker_batches, n_extra = divmod(n_batches, n_workers)
+        first_batch = worker * n_worker_batches + min(worker, n_extra)
+        n_worker_batches += worker < n_extra
+        # the loader takes the batches from its workers in turn, worker w gave the batches w, w + n_workers, ...
+        n_consumed = min(len(range(worker, start_index, n_workers)), n_worker_batches)
+        start = self.rank * n_samples + first_batch * self.batch_size
+        stop = self.rank * n_samples + min((first_batch + n_worker_batches) * self.batch_size, n_samples)
+        return start, stop, min(n_consumed * self.batch_size, stop - start)
+
+    def get_ranges(self, epoch, spans) -> list:
+        """
+        Sample ranges of the shards holding spans of the stream of samples, in order.
+        :param spans: list of (start, stop) positions in the stream of samples
+        :return: list of (shard, start, stop) tuples
+        """
+        order = self.get_shard_order(epoch)
+        ends = np.cumsum([self.shards[shard]["n_samples"] for shard in order])
+        ranges = []
+        for position, span_stop in spans:
+            while position < span_stop:
+                i = int(np.searchsorted(ends, position, side="right"))
+                shard_start = int(ends[i]) - self.shards[order[i]]["n_samples"]
+                stop = min(span_stop, int(ends[i]))
+                ranges.append((int(order[i]), position - shard_start, stop - shard_start))
+                position = stop
+        return ranges
+
+    def get_offsets(self, shard) -> np.ndarray:
+        if shard not in self.offsets:
+            filename = self.shards[shard]["filename"].replace(".bin", ".idx.npy")
+            with open_file(os.path.join(self.data_path, filename)) as f:
+                self.offsets[shard] = np.load(f)
+        return self.offsets[shard]
+
+    def read_samples(self, ranges):
+        """
+        Read the samples of the ranges, with one read per range.
+        """
+        file, file_shard = None, None
+        try:
+            for shard, start, stop in ranges:
+                if shard != file_shard:
+                    if file is not None:
+                        file.close()
+                    file = open_file(os.path.join(self.data_path, self.shards[shard]["filename"]))
+                    file_shard = shard
+                offsets = self.get_offsets(shard)
+                file.seek(int(offsets[start]))
+                data = memoryview(file.read(int(offsets[stop] - offsets[start])))
+                for i in range(start, stop):
+                    yield pickle.loads(data[offsets[i] - offsets[start]:offsets[i + 1] - offsets[start]])
+        finally:
+            if file is not None:
+                file.close()
+
+    def read_positions(self, epoch, positions) -> list:
+        """
+        Read the samples at the given positions of the stream of samples, with one read per run of positions.
+        """
+        spans = []
+        for position in sorted(positions):
+            if spans and spans[-1][1] == position:
+                spans[-1][1] += 1
+            else:
+                spans.append([position, position + 1])
+        samples = dict(zip(sorted(positions), self.read_samples(self.get_ranges(epoch, spans))))
+        return [samples[position] for position in positions]
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker, n_workers = (worker_info.id, worker_info.num_workers) if worker_info is not None else (0, 1)
+        epoch = int(self.epoch.item())
+        start, stop, n_consumed = self.get_worker_range(worker, n_workers, int(self.start_index.item()))
+        if self.shuffle and self.shuffle_buffer > 1:
+            rng = np.random.default_rng((self.seed, epoch, self.rank, worker))
+            # a resumed epoch reads the samples left in the buffer, then the rest of the range
+            buffer, position, shuffled = self.skip_shuffled(stop - start, n_consumed, rng)
+            buffer = self.read_positions(epoch, [start + i for i in buffer])
+            samples = self.read_samples(self.get_ranges(epoch, [(start + position, stop)]))
+            samples = self.shuffle_samples(samples, rng, buffer, shuffled)
+        else:
+            samples = self.read_samples(self.get_ranges(epoch, [(start + n_consumed, stop)]))
+        for sample in samples:
+            yield self.transforms(sample) if self.transforms is not None else sample
+
+    def shuffle_samples(self, samples, rng, buffer=None, shuffled=False):
+        """
+        Shuffle a stream of samples, holding at most shuffle_buffer of them in memory.
+        :param buffer: samples already in the buffer, when resuming
+        :param shuffled: whether the stream ended and the buffer was shuffled, when resuming
+        """
+        buffer = buffer if buffer is not None else []
+        if shuffled:
+            yield from buffer
+            return
+        for sample in samples:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(sample)
+                continue
+            i = rng.integers(len(buffer))
+            yield buffer[i]
+            buffer[i] = sample
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def skip_shuffled(self, n_samples, n_consumed, rng) -> tuple:
+        """
+        Replay shuffle_samples on the positions of a stream of n_samples until n_consumed samples are yielded,
+        without reading them. The random draws don't depend on the samples, so rng ends in the same state.
+        :return: (buffer, position, shuffled) tuple, the positions in the buffer, the position of the next sample
+        to read and whether the buffer was shuffled at the end of the stream
+        """
+        buffer, position, n_yielded = [], 0, 0
+        while n_yielded < n_consumed and position < n_samples:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(position)
+            else:
+                buffer[rng.integers(len(buffer))] = position
+                n_yielded += 1
+            position += 1
+        if n_yielded < n_consumed:
+            rng.shuffle(buffer)
+            return buffer[n_consumed - n_yielded:], position, True
+        return buffer, position, False
+
+    def __getstate__(self):
+        # offsets are loaded again by each worker, only for its shards
+        state = self.__dict__.copy()
+        state["offsets"] = {}
+        return state
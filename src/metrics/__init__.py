@@ -1 +1,4 @@
 from .metric_monitor import MetricMonitor
+from .base import StreamingMetric
+from .classification import ConfusionMatrix, Accuracy, ClassificationMetrics
+from .segmentation import MeanIoU
@@ -0,0 +1,49 @@
+import torch
+
+
+class StreamingMetric:
+    def __init__(self) -> None:
+        """
+        Base class of the metrics accumulated over an epoch. The state is a dictionary of tensors
+        summed over the batches, kept on the device of the inputs, so the metric can be merged with
+        the states of other processes by summing them.
+        Subclasses define default_state, update and compute.
+        """
+        self.state = None
+
+    def default_state(self) -> dict:
+        """
+        Empty state, a dictionary of zero tensors.
+        """
+        raise NotImplementedError
+
+    def get_state(self, device) -> dict:
+        if self.state is None:
+            self.state = {name: value.to(device) for name, value in self.default_state().items()}
+        return self.state
+
+    def reset(self) -> None:
+        self.state = None
+
+    def accumulate(self, device, **values) -> None:
+        state = self.get_state(device)
+        for name, value in values.items():
+            state[name] += value
+
+    def merge(self, other: "StreamingMetric") -> None:
+        """
+        Add the state of another metric of the same kind, e.g. computed on another part of the data.
+        """
+        if other.state is None:
+            return
+        device = next(iter(other.state.values())).device
+        self.accumulate(device, **other.state)
+
+    def update(self, output: torch.Tensor, target: torch.Tensor) -> None:
+        raise NotImplementedError
+
+    def compute(self) -> dict:
+        """
+        :return: dictionary of scalar tensors, on the device of the state
+        """
+        raise NotImplementedError
@@ -0,0 +1,110 @@
+import torch
+
+from .base import StreamingMetric
+from .metric_monitor import accumulation_dtype
+
+
+def to_labels(output: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
+    """
+    Predicted labels of the output, the argmax over the class dimension when output has scores.
+    """
+    if output.dim() == target.dim() + 1:
+        return output.argmax(dim=1)
+    return output
+
+
+class ConfusionMatrix(StreamingMetric):
+    def __init__(self, n_classes: int, ignore_index=None) -> None:
+        """
+        Confusion matrix with the targets as rows and the predictions as columns, computed with a single bincount.
+        Works with any shape of labels, e.g. (B,) for classification and (B, H, W) for segmentation.
+        :param n_classes: number of classes
+        :param ignore_index: target value that is not counted
+        """
+        super().__init__()
+        self.n_classes = n_classes
+        self.ignore_index = ignore_index
+
+    def default_state(self) -> dict:
+        return {"matrix": torch.zeros(self.n_classes, self.n_classes, dtype=torch.int64)}
+
+    def update(self, output: torch.Tensor, target: torch.Tensor) -> None:
+        """
+        :param output: predicted labels, or scores with the classes in dimension 1
+        :param target: target labels
+        """
+        preds = to_labels(output, target).flatten().long()
+        target = target.flatten().long()
+        valid = (target >= 0) & (target < self.n_classes) & (preds >= 0) & (preds < self.n_classes)
+        if self.ignore_index is not None:
+            valid &= target != self.ignore_index
+        # invalid pairs are counted in an extra bin, which is dropped, to avoid a data dependent shape
+        index = torch.where(valid, target * self.n_classes + preds, self.n_classes ** 2)
+        counts = torch.bincount(index, minlength=self.n_classes ** 2 + 1)[:-1]
+        self.accumulate(target.device, matrix=counts.view(self.n_classes, self.n_classes))
+
+    @property
+    def matrix(self) -> torch.Tensor:
+        return self.state["matrix"] if self.state is not None else self.default_state()["matrix"]
+
+    def compute(self) -> dict:
+        return {}
+
+
+class Accuracy(StreamingMetric):
+    def __init__(self, top_k: int = 1) -> None:
+        """
+        Fraction of samples whose target is among the top_k predicted classes.
+        :param top_k: number of highest scores considered, the output should have scores if greater than 1
+        """
+        super().__init__()
+        self.top_k = top_k
+        self.name = "accuracy" if top_k == 1 else f"top{top_k}_accuracy"
+
+    def default_state(self) -> dict:
+        return {"correct": torch.zeros((), dtype=torch.int64), "total": torch.zeros((), dtype=torch.int64)}
+
+    def update(self, output: torch.Tensor, target: torch.Tensor) -> None:
+        if self.top_k == 1:
+            correct = to_labels(output, target) == target
+        else:
+            top_k = output.topk(self.top_k, dim=1).indices
+            correct = (top_k == target.unsqueeze(1)).any(dim=1)
+        self.accumulate(target.device, correct=correct.sum(), total=torch.tensor(correct.numel()))
+
+    def compute(self) -> dict:
+        state = self.get_state("cpu")
+        correct = state["correct"].to(accumulation_dtype(state["correct"].device))
+        return {self.name: correct / state["total"].clamp(min=1)}
+
+
+class ClassificationMetrics(ConfusionMatrix):
+    def compute(self) -> dict:
+        """
+        Accuracy, and precision, recall and F1 with macro and micro averages. Macro averages are taken
+        over the classes present in the targets or the predictions, and undefined values count as 0.
+        """
+        matrix = self.matrix.to(accumulation_dtype(self.matrix.device))
+        tp = matrix.diagonal()
+        support = matrix.sum(dim=1)
+        predicted = matrix.sum(dim=0)
+        present = (support + predicted) > 0
+        n_present = present.sum().clamp(min=1)
+
+        precision = tp / predicted.clamp(min=1)
+        recall = tp / support.clamp(min=1)
+        f1 = 2 * tp / (support + predicted).clamp(min=1)
+
+        total_tp = tp.sum()
+        precision_micro = total_tp / predicted.sum().clamp(min=1)
+        recall_micro = total_tp / support.sum().clamp(min=1)
+        f1_micro = 2 * total_tp / (predicted.sum() + support.sum()).clamp(min=1)
+        return {
+            "accuracy": total_tp / matrix.sum().clamp(min=1),
+            "precision_macro": (precision * present).sum() / n_present,
+            "recall_macro": (recall * present).sum() / n_present,
+            "f1_macro": (f1 * present).sum() / n_present,
+            "precision_micro": precision_micro,
+            "recall_micro": recall_micro,
+            "f1_micro": f1_micro,
+        }
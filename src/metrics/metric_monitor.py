@@ -1,29 +1,130 @@
 from collections import defaultdict
+import copy
+
+import torch
+
+from src.utils.distributed import all_reduce_sum, is_distributed
+
+
+def accumulation_dtype(device) -> torch.dtype:
+    """
+    Floating point type of the accumulators on the device, float64 except on MPS, which does not support it.
+    """
+    return torch.float32 if torch.device(device).type == "mps" else torch.float64
 
 
 class MetricMonitor:
-    def __init__(self) -> None:
+    def __init__(self, streaming_metrics=None) -> None:
         """
         Metric Monitor class. Accumulate and compute metrics.
+        Values given as tensors are accumulated on their own device, so no host/device
+        synchronization happens until the metrics are requested with get_metrics.
+        :param streaming_metrics: list of StreamingMetric updated with update_streaming_metrics,
+        the monitor works on reset copies of them
         """
-        self.metrics = defaultdict(lambda: {"val": 0, "count": 0, "avg": 0})
+        self.metrics = defaultdict(lambda: {"val": 0, "count": 0})
+        self.streaming_metrics = [copy.deepcopy(metric) for metric in streaming_metrics or []]
+        for metric in self.streaming_metrics:
+            metric.reset()
 
-    def update(self, metric_name: str, val: float) -> None:
+    def update(self, metric_name: str, val) -> None:
         """
         Update the metric with the given value.
         :param metric_name: name of the metric to update
-        :param val: value to update the metric with
+        :param val: value to update the metric with, either a python number or a scalar tensor
         :return:
         """
         metric = self.metrics[metric_name]
 
-        metric["val"] += val
+        if isinstance(val, torch.Tensor):
+            # accumulate in double precision where supported, to match python float accumulation
+            val = val.detach().to(accumulation_dtype(val.device))
+        metric["val"] = metric["val"] + val
         metric["count"] += 1
-        metric["avg"] = metric["val"] / metric["count"]
+
+    def update_streaming_metrics(self, output: torch.Tensor, target: torch.Tensor) -> None:
+        """
+        Update all the streaming metrics with the output and target of a batch.
+        """
+        for metric in self.streaming_metrics:
+            metric.update(output, target)
 
     def get_metrics(self) -> dict:
         """
-        Get the metrics as a dictionary.
-        :return: dictionary of metrics, with the metric name as key and the average value as value
+        Get the metrics as a dictionary. Synchronizes all the tensor accumulators with the host at once.
+        :return: dictionary of metrics, with the metric name as key and the average value as value,
+        followed by the values of the streaming metrics
         """
-        return {metric_name: metric["avg"] for metric_name, metric in self.metrics.items()}
+        names = [name for name, metric in self.metrics.items() if isinstance(metric["val"], torch.Tensor)]
+        tensors = [self.metrics[name]["val"] for name in names]
+        streaming = {}
+        for metric in self.streaming_metrics:
+            if metric.state is not None:
+                streaming.update(metric.compute())
+        tensors += list(streaming.values())
+        if tensors:
+            # a single device to host transfer for all the tensor accumulators
+            device = tensors[0].device
+            dtype = accumulation_dtype(device)
+            values = torch.stack([tensor.to(device, dtype) for tensor in tensors]).tolist()
+            synced = dict(zip(names + list(streaming), values))
+        else:
+            synced = {}
+
+        metrics = {
+            metric_name: synced.get(metric_name, metric["val"]) / metric["count"]
+            for metric_name, metric in self.metrics.items()
+        }
+        metrics.update({name: synced[name] for name in streaming})
+        return metrics
+
+    def state_dict(self) -> dict:
+        """
+        Partial sums and counts of the metrics, so a resumed epoch keeps averaging over all its steps.
+        """
+        return {metric_name: dict(metric) for metric_name, metric in self.metrics.items()}
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        for metric_name, metric in state_dict.items():
+            self.metrics[metric_name] = dict(metric)
+
+    def all_reduce(self, device) -> None:
+        """
+        Sum the accumulated values and counts over all the processes, so every process gets the global averages.
+        All the processes should have updated the same metrics.
+        :param device: device used for the communication, it should be supported by the process group backend
+        :return:
+        """
+        if not is_distributed():
+            return
+        names = sorted(self.metrics)
+        dtype = accumulation_dtype(device)
+        values = torch.tensor([[float(self.metrics[name]["count"]), 0.0] for name in names], dtype=dtype, device=device)
+        for i, name in enumerate(names):
+            values[i, 1] = self.metrics[name]["val"]
+        # the integer states of the streaming metrics (counts) are summed as int64, so they stay exact
+        # also on MPS, where the floating point ones are float32
+        states = [metric.get_state(device) for metric in self.streaming_metrics]
+        state_tensors = [state[key] for state in states for key in sorted(state)]
+        float_tensors = [tensor for tensor in state_tensors if tensor.is_floating_point()]
+        int_tensors = [tensor for tensor in state_tensors if not tensor.is_floating_point()]
+        packed = torch.cat([values.flatten()] + [tensor.to(device, dtype).flatten() for tensor in float_tensors])
+        all_reduce_sum(packed)
+        if int_tensors:
+            packed_ints = torch.cat([tensor.to(device, torch.int64).flatten() for tensor in int_tensors])
+            all_reduce_sum(packed_ints)
+
+        values = packed[:values.numel()].view_as(values)
+        counts = values[:, 0].tolist()
+        for i, name in enumerate(names):
+            self.metrics[name]["count"] = int(counts[i])
+            self.metrics[name]["val"] = values[i, 1]
+        offsets = {True: values.numel(), False: 0}
+        for state in states:
+            for key in sorted(state):
+                tensor = state[key]
+                is_float = tensor.is_floating_point()
+                offset = offsets[is_float]
+                reduced = (packed if is_float else packed_ints)[offset:offset + tensor.numel()]
+                state[key] = reduced.view_as(tensor).to(tensor.dtype)
+                offsets[is_float] += tensor.numel()
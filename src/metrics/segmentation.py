@@ -0,0 +1,18 @@
+from .classification import ConfusionMatrix
+from .metric_monitor import accumulation_dtype
+
+
+class MeanIoU(ConfusionMatrix):
+    def compute(self) -> dict:
+        """
+        Intersection over union of each class, averaged over the classes present in the targets or the predictions.
+        """
+        matrix = self.matrix.to(accumulation_dtype(self.matrix.device))
+        intersection = matrix.diagonal()
+        union = matrix.sum(dim=0) + matrix.sum(dim=1) - intersection
+        present = union > 0
+        iou = intersection / union.clamp(min=1)
+        return {
+            "miou": (iou * present).sum() / present.sum().clamp(min=1),
+            "pixel_accuracy": intersection.sum() / matrix.sum().clamp(min=1),
+        }
@@ -1 +1,4 @@
-
+from .base import BaseMiner, pairwise_distance
+from .triplet import HardTripletMiner, SemiHardTripletMiner, DistanceWeightedMiner
+from .pair import MultiSimilarityMiner
+from .memory_bank import MemoryBank
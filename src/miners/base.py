@@ -0,0 +1,68 @@
+import torch
+import torch.nn.functional as F
+
+
+def pairwise_distance(x: torch.Tensor, y: torch.Tensor, distance: str = "euclidean") -> torch.Tensor:
+    """
+    Distances between the rows of x and y.
+    :param distance: "euclidean" or "cosine" (1 - cosine similarity)
+    :return: tensor with shape (len(x), len(y))
+    """
+    if distance == "euclidean":
+        return torch.cdist(x, y)
+    elif distance == "cosine":
+        return 1 - F.normalize(x, dim=1) @ F.normalize(y, dim=1).T
+    raise ValueError(f"Unknown distance {distance}, expected 'euclidean' or 'cosine'")
+
+
+class BaseMiner:
+    # outputs of mine_block that index the anchors
+    anchor_outputs = (0,)
+
+    def __init__(self, distance="euclidean", chunk_size=1024):
+        """
+        Base class of the miners, which select the pairs or triplets of a batch of embeddings that a metric learning
+        loss is computed on. The distances are computed on the device in blocks of chunk_size anchors against all
+        the references, so the memory grows with chunk_size * n_references instead of n_references ** 2.
+        Subclasses define mine_block.
+        :param distance: "euclidean" or "cosine"
+        :param chunk_size: number of anchors of each block of distances
+        """
+        self.distance = distance
+        self.chunk_size = chunk_size
+
+    @torch.no_grad()
+    def __call__(self, embeddings, labels, ref_embeddings=None, ref_labels=None) -> tuple:
+        """
+        Mine the embeddings of the batch, the anchors, against the references.
+        :param embeddings: embeddings of the batch, with shape (B, D)
+        :param labels: labels of the batch, with shape (B,)
+        :param ref_embeddings: reference embeddings, the batch by default. Their first B rows should be the batch,
+        as given by MemoryBank.get_references, so the anchors are not paired with themselves
+        :param ref_labels: labels of the references
+        :return: tuple of index tensors, the anchors index the batch and the others the references
+        """
+        if ref_embeddings is None:
+            ref_embeddings, ref_labels = embeddings, labels
+        embeddings, ref_embeddings = embeddings.detach(), ref_embeddings.detach()
+        outputs = []
+        for start in range(0, len(embeddings), self.chunk_size):
+            anchors = embeddings[start:start + self.chunk_size]
+            dist = pairwise_distance(anchors, ref_embeddings, self.distance)
+            same = labels[start:start + len(anchors), None] == ref_labels[None, :]
+            # the anchors themselves are the references start, start + 1, ...
+            rows = torch.arange(len(anchors), device=dist.device)
+            is_self = torch.zeros_like(same)
+            is_self[rows, start + rows] = True
+            indices = self.mine_block(dist, same & ~is_self, ~same)
+            outputs.append(tuple(x + start if i in self.anchor_outputs else x for i, x in enumerate(indices)))
+        return tuple(torch.cat(parts) for parts in zip(*outputs))
+
+    def mine_block(self, dist, positive, negative) -> tuple:
+        """
+        :param dist: distances of a block of anchors to the references, with shape (C, R)
+        :param positive: mask of the references with the label of the anchor, except the anchor itself
+        :param negative: mask of the references with a different label
+        :return: tuple of index tensors, the anchors index the rows of the block
+        """
+        raise NotImplementedError
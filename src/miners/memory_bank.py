@@ -0,0 +1,43 @@
+import torch
+
+
+class MemoryBank:
+    def __init__(self, size: int):
+        """
+        First in, first out queue of the embeddings of the last batches (cross-batch memory, Wang et al., 2020),
+        used as extra references for the miners. The embeddings are stored detached, on their device.
+        :param size: number of embeddings kept
+        """
+        self.size = size
+        self.embeddings = None
+        self.labels = None
+        # next position to write and number of stored embeddings
+        self.position = 0
+        self.n_stored = 0
+
+    def add(self, embeddings: torch.Tensor, labels: torch.Tensor) -> None:
+        embeddings, labels = embeddings.detach()[-self.size:], labels.detach()[-self.size:]
+        if self.embeddings is None:
+            self.embeddings = embeddings.new_empty((self.size, embeddings.shape[1]))
+            self.labels = labels.new_empty((self.size,))
+        indices = (self.position + torch.arange(len(embeddings), device=self.embeddings.device)) % self.size
+        self.embeddings[indices] = embeddings
+        self.labels[indices] = labels
+        self.position = (self.position + len(embeddings)) % self.size
+        self.n_stored = min(self.n_stored + len(embeddings), self.size)
+
+    def get_references(self, embeddings: torch.Tensor, labels: torch.Tensor) -> tuple:
+        """
+        References of a batch for the miners and the loss: the batch followed by the stored embeddings.
+        :return: (embeddings, labels)
+        """
+        if self.n_stored == 0:
+            return embeddings, labels
+        return (
+            torch.cat([embeddings, self.embeddings[:self.n_stored].to(embeddings.dtype)]),
+            torch.cat([labels, self.labels[:self.n_stored]]),
+        )
+
+    def reset(self) -> None:
+        self.position = 0
+        self.n_stored = 0
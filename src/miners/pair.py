@@ -0,0 +1,26 @@
+import math
+
+from .base import BaseMiner
+
+
+class MultiSimilarityMiner(BaseMiner):
+    anchor_outputs = (0, 2)
+
+    def __init__(self, epsilon=0.1, chunk_size=1024):
+        """
+        Multi-similarity pair mining (Wang et al., 2019) on the cosine similarity: the negative pairs more similar
+        than the least similar positive of the anchor minus epsilon, and the positive pairs less similar than the
+        most similar negative of the anchor plus epsilon.
+        Returns (positive anchors, positives, negative anchors, negatives).
+        :param epsilon: similarity margin
+        """
+        super().__init__(distance="cosine", chunk_size=chunk_size)
+        self.epsilon = epsilon
+
+    def mine_block(self, dist, positive, negative) -> tuple:
+        similarity = 1 - dist
+        hardest_positive = similarity.masked_fill(~positive, math.inf).min(1, keepdim=True).values
+        hardest_negative = similarity.masked_fill(~negative, -math.inf).max(1, keepdim=True).values
+        positive_anchors, positives = (positive & (similarity - self.epsilon < hardest_negative)).nonzero(as_tuple=True)
+        negative_anchors, negatives = (negative & (similarity + self.epsilon > hardest_positive)).nonzero(as_tuple=True)
+        return positive_anchors, positives, negative_anchors, negatives
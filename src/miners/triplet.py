@@ -0,0 +1,86 @@
+import math
+
+import torch
+
+from .base import BaseMiner
+
+
+class HardTripletMiner(BaseMiner):
+    """
+    Batch hard mining: the farthest positive and the closest negative of each anchor.
+    Returns (anchors, positives, negatives), one triplet per anchor with a positive and a negative.
+    """
+
+    def mine_block(self, dist, positive, negative) -> tuple:
+        positives = dist.masked_fill(~positive, -math.inf).argmax(1)
+        negatives = dist.masked_fill(~negative, math.inf).argmin(1)
+        anchors = torch.nonzero(positive.any(1) & negative.any(1)).squeeze(1)
+        return anchors, positives[anchors], negatives[anchors]
+
+
+class SemiHardTripletMiner(BaseMiner):
+    def __init__(self, margin=0.2, distance="euclidean", chunk_size=1024):
+        """
+        Semi-hard mining: for every anchor-positive pair, the closest negative farther than the positive and
+        within the margin, d(a, p) < d(a, n) < d(a, p) + margin. The negatives of each anchor are sorted once
+        and searched for all its positives. Pairs without a semi-hard negative are left out.
+        Returns (anchors, positives, negatives).
+        :param margin: margin of the triplet loss
+        """
+        super().__init__(distance=distance, chunk_size=chunk_size)
+        self.margin = margin
+
+    def mine_block(self, dist, positive, negative) -> tuple:
+        n_positives = int(positive.sum(1).max())
+        if n_positives == 0:
+            empty = torch.empty(0, dtype=torch.long, device=dist.device)
+            return empty, empty, empty
+        # distances of the positives of each anchor, padded with inf
+        positive_dist, positives = dist.masked_fill(~positive, math.inf).topk(n_positives, dim=1, largest=False)
+        sorted_negatives, order = dist.masked_fill(~negative, math.inf).sort(dim=1, stable=True)
+        # position of the closest negative farther than each positive
+        position = torch.searchsorted(sorted_negatives, positive_dist, right=True).clamp_max(dist.shape[1] - 1)
+        closest = sorted_negatives.gather(1, position)
+        valid = torch.isfinite(positive_dist) & (closest > positive_dist) & (closest < positive_dist + self.margin)
+        anchors, k = valid.nonzero(as_tuple=True)
+        return anchors, positives[anchors, k], order[anchors, position[anchors, k]]
+
+
+class DistanceWeightedMiner(BaseMiner):
+    def __init__(self, cutoff=0.5, nonzero_loss_cutoff=1.4, distance="euclidean", chunk_size=1024):
+        """
+        Distance weighted sampling (Wu et al., 2017): for every anchor-positive pair, a negative sampled with
+        a probability inversely proportional to the density of the distances between points on the unit
+        hypersphere, so the negatives are spread over all the distances. The embeddings should be L2-normalized.
+        Returns (anchors, positives, negatives).
+        :param cutoff: distances are clipped to it, so the closest negatives don't take all the probability
+        :param nonzero_loss_cutoff: negatives at this distance or farther are not sampled, they give no loss
+        """
+        super().__init__(distance=distance, chunk_size=chunk_size)
+        self.cutoff = cutoff
+        self.nonzero_loss_cutoff = nonzero_loss_cutoff
+        self.embedding_dim = None
+
+    def __call__(self, embeddings, labels, ref_embeddings=None, ref_labels=None) -> tuple:
+        self.embedding_dim = embeddings.shape[1]
+        return super().__call__(embeddings, labels, ref_embeddings, ref_labels)
+
+    def mine_block(self, dist, positive, negative) -> tuple:
+        n = self.embedding_dim
+        d = dist.clamp_min(self.cutoff)
+        # log of the inverse of the density q(d) = d^(n - 2) * (1 - d^2 / 4)^((n - 3) / 2)
+        log_weights = (2 - n) * d.log() - (n - 3) / 2 * (1 - d * d / 4).clamp_min(1e-8).log()
+        log_weights = log_weights.masked_fill(~negative | (dist >= self.nonzero_loss_cutoff), -math.inf)
+        n_positives = positive.sum(1)
+        rows = torch.nonzero(torch.isfinite(log_weights).any(1) & (n_positives > 0)).squeeze(1)
+        if len(rows) == 0:
+            empty = torch.empty(0, dtype=torch.long, device=dist.device)
+            return empty, empty, empty
+        log_weights = log_weights[rows]
+        weights = (log_weights - log_weights.max(1, keepdim=True).values).exp()
+        # one negative per positive, the k-th positive of an anchor gets its k-th sample
+        samples = torch.multinomial(weights, int(n_positives.max()), replacement=True)
+        positive = positive[rows]
+        rank = positive.cumsum(1) - 1
+        anchors, positives = positive.nonzero(as_tuple=True)
+        return rows[anchors], positives, samples[anchors, rank[anchors, positives]]
@@ -0,0 +1,3 @@
+from .stats import LatencyStats
+from .batcher import MicroBatcher
+from .server import InferenceServer, make_predict_fn, decode_image
@@ -0,0 +1,83 @@
+from concurrent.futures import Future
+import queue
+import threading
+import time
+
+import torch
+
+from src.utils import apply_to_collection
+
+
+class MicroBatcher:
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=5.0, stats=None):
+        """
+        Gather concurrent single-sample requests into batches, run by a single worker thread.
+        A batch is run when it reaches max_batch_size or max_wait_ms after its first request arrived,
+        so under low load requests wait at most max_wait_ms and under high load batches are full.
+        :param predict_fn: function from a batch of inputs with shape (B, ...) to a batch of outputs,
+        either a tensor or a collection of tensors with the batch as first dimension
+        :param max_batch_size: maximum number of requests per batch
+        :param max_wait_ms: maximum time the first request of a batch waits for others
+        :param stats: LatencyStats the batch sizes are recorded to
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.stats = stats
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, sample: torch.Tensor) -> Future:
+        """
+        Queue a single sample, without batch dimension.
+        :return: future with the output of the sample
+        """
+        future = Future()
+        self.queue.put((sample, future))
+        return future
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self.queue.get()
+            if item is None:
+                return
+            requests = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(requests) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    # run the requests already gathered before stopping
+                    stop = True
+                    break
+                requests.append(item)
+            self._process(requests)
+
+    def _process(self, requests):
+        try:
+            outputs = self.predict_fn(torch.stack([sample for sample, _ in requests]))
+            # a single transfer to the host for the whole batch
+            outputs = apply_to_collection(outputs, lambda tensor: tensor.detach().cpu())
+        except Exception as e:
+            for _, future in requests:
+                future.set_exception(e)
+            return
+        if self.stats is not None:
+            self.stats.record_batch(len(requests))
+        for i, (_, future) in enumerate(requests):
+            future.set_result(apply_to_collection(outputs, lambda tensor: tensor[i]))
+
+    def close(self):
+        """
+        Run the pending requests and stop the worker thread.
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
@@ -0,0 +1,90 @@
+"""
+Load generator for the inference server: sends concurrent POST /predict requests and reports
+the client side latency percentiles and throughput, followed by the server stats.
+
+    python -m src.serving.loadgen --url http://127.0.0.1:8000 --requests 2000 --concurrency 32
+    python -m src.serving.loadgen --image sample.jpg
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import time
+import urllib.request
+
+import numpy as np
+
+from .stats import LatencyStats
+
+
+def random_image(height=64, width=64, seed=0) -> bytes:
+    """
+    Random RGB image encoded as PNG, used when no input is given.
+    """
+    import cv2
+
+    image = np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    return cv2.imencode(".png", image)[1].tobytes()
+
+
+def send_request(url, payload) -> dict:
+    request = urllib.request.Request(url + "/predict", data=payload, method="POST")
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def get_server_stats(url) -> dict:
+    with urllib.request.urlopen(url + "/stats") as response:
+        return json.loads(response.read())
+
+
+def run_load_test(url, payload, n_requests=1000, concurrency=16) -> dict:
+    """
+    Send n_requests with the same payload from concurrency client threads.
+    :param url: base url of the server
+    :param payload: request body
+    :param n_requests: total number of requests
+    :param concurrency: number of requests in flight at the same time
+    :return: client side latency percentiles in ms, throughput and number of failed requests
+    """
+    stats = LatencyStats(window=n_requests)
+    n_errors = 0
+
+    def request(_):
+        start_time = time.perf_counter()
+        send_request(url, payload)
+        stats.record_request(time.perf_counter() - start_time)
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        for future in [executor.submit(request, i) for i in range(n_requests)]:
+            if future.exception() is not None:
+                n_errors += 1
+
+    metrics = stats.get_metrics()
+    metrics["errors"] = n_errors
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--image", default=None, help="image file sent in every request, random if not given")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    if args.image is not None:
+        with open(args.image, "rb") as f:
+            payload = f.read()
+    else:
+        payload = random_image()
+
+    print("Client:")
+    for name, value in run_load_test(args.url, payload, args.requests, args.concurrency).items():
+        print(f"  {name}: {value:.3f}")
+    print("Server:")
+    for name, value in get_server_stats(args.url).items():
+        print(f"  {name}: {value:.3f}")
+
+
+if __name__ == "__main__":
+    main()
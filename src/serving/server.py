@@ -0,0 +1,150 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+import numpy as np
+import torch
+
+from src.utils import load_batch_to_device
+from .batcher import MicroBatcher
+from .stats import LatencyStats
+
+
+def make_predict_fn(trainer):
+    """
+    Batch prediction function built on the trainer, so the server runs the same eval batch transforms,
+    autocast and predict as the evaluation. It runs under torch.inference_mode.
+    :param trainer: trainer with the model loaded
+    :return: function from a batch of inputs on the host to the outputs of the model
+    """
+    trainer.model.eval()
+
+    @torch.inference_mode()
+    def predict_fn(x):
+        batch = load_batch_to_device({"x": x}, trainer.device)
+        batch = trainer.transform_batch(batch, trainer.eval_transforms)
+        with trainer.autocast():
+            return trainer.predict(trainer.model, batch)
+
+    return predict_fn
+
+
+def decode_image(data: bytes) -> np.ndarray:
+    """
+    Decode an encoded image (PNG, JPEG, ...) to an RGB array with shape (H, W, C).
+    """
+    import cv2
+
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("The request body is not a valid image")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    # set by InferenceServer
+    app = None
+
+    def do_POST(self):
+        if self.path != "/predict":
+            return self.send_json({"error": f"Unknown path {self.path}"}, status=404)
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            response = self.app.handle_predict(data)
+        except ValueError as e:
+            return self.send_json({"error": str(e)}, status=400)
+        except Exception as e:
+            return self.send_json({"error": str(e)}, status=500)
+        self.send_json(response)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            return self.send_json(self.app.stats.get_metrics())
+        elif self.path == "/health":
+            return self.send_json({"status": "ok"})
+        self.send_json({"error": f"Unknown path {self.path}"}, status=404)
+
+    def send_json(self, obj, status=200):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # one line per request would slow down the server under load
+        pass
+
+
+class HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # connections above the listen backlog are retried by the clients after a second
+    request_queue_size = 128
+
+
+class InferenceServer:
+    def __init__(
+            self,
+            predict_fn,
+            preprocess,
+            postprocess,
+            host="127.0.0.1",
+            port=8000,
+            max_batch_size=32,
+            max_wait_ms=5.0,
+    ):
+        """
+        HTTP inference server. Each request is handled in its own thread, decoded and preprocessed there,
+        and its sample is batched with the concurrent ones by a MicroBatcher.
+        POST /predict with the encoded input as body returns the postprocessed output as JSON,
+        GET /stats returns the latency percentiles and throughput.
+        :param predict_fn: batch prediction function, see make_predict_fn
+        :param preprocess: function from the request body to a single input tensor
+        :param postprocess: function from the output of a single sample to a JSON serializable object
+        :param host: host to listen on
+        :param port: port to listen on, 0 to pick a free one
+        :param max_batch_size: maximum number of requests per batch
+        :param max_wait_ms: maximum time the first request of a batch waits for others
+        """
+        self.preprocess = preprocess
+        self.postprocess = postprocess
+        self.stats = LatencyStats()
+        self.batcher = MicroBatcher(predict_fn, max_batch_size, max_wait_ms, stats=self.stats)
+        handler = type("Handler", (RequestHandler,), {"app": self})
+        self.httpd = HTTPServer((host, port), handler)
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle_predict(self, data: bytes):
+        start_time = time.perf_counter()
+        sample = self.preprocess(data)
+        output = self.batcher.submit(sample).result()
+        response = self.postprocess(output)
+        self.stats.record_request(time.perf_counter() - start_time)
+        return response
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def start(self):
+        """
+        Serve in a background thread.
+        """
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def shutdown(self):
+        """
+        Stop accepting requests and wait for the pending batches.
+        """
+        if self.thread is not None:
+            self.httpd.shutdown()
+            self.thread.join()
+        self.httpd.server_close()
+        self.batcher.close()
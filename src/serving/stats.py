@@ -0,0 +1,53 @@
+from collections import deque
+import threading
+import time
+
+import numpy as np
+
+
+class LatencyStats:
+    def __init__(self, window=10000):
+        """
+        Thread-safe record of request latencies and batch sizes. Percentiles are computed over
+        the last `window` requests, the throughput since the first request.
+        :param window: number of latencies kept
+        """
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.n_requests = 0
+        self.n_batches = 0
+        self.n_batched_requests = 0
+        self.start_time = None
+        self.last_time = None
+
+    def record_request(self, latency: float) -> None:
+        """
+        :param latency: time from the arrival of the request to its response, in seconds
+        """
+        now = time.perf_counter()
+        with self.lock:
+            if self.start_time is None:
+                self.start_time = now - latency
+            self.last_time = now
+            self.latencies.append(latency)
+            self.n_requests += 1
+
+    def record_batch(self, batch_size: int) -> None:
+        with self.lock:
+            self.n_batches += 1
+            self.n_batched_requests += batch_size
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            elapsed = self.last_time - self.start_time if self.n_requests > 0 else 0.0
+            metrics = {"requests": self.n_requests}
+            if len(latencies) > 0:
+                metrics["latency_p50_ms"] = float(np.percentile(latencies, 50))
+                metrics["latency_p99_ms"] = float(np.percentile(latencies, 99))
+                metrics["latency_mean_ms"] = float(latencies.mean())
+            if elapsed > 0:
+                metrics["requests_per_sec"] = self.n_requests / elapsed
+            if self.n_batches > 0:
+                metrics["mean_batch_size"] = self.n_batched_requests / self.n_batches
+        return metrics
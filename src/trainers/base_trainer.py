@@ -1,17 +1,46 @@
+from contextlib import nullcontext
+import json
+import os
+import time
 from tqdm import tqdm
 import torch
-from typing import Dict
-from matplotlib.figure import Figure
+from torch.nn.parallel import DistributedDataParallel
+from typing import Dict, Union, TYPE_CHECKING
 
 from src.metrics import MetricMonitor
 from src.utils import (
-    load_batch_to_device,
+    BatchPrefetcher,
     Logger,
     EarlyStopping,
     ModelCheckpoint,
-    set_random_seed
+    StepTimer,
+    build_profiler,
+    MemoryMonitor,
+    reset_peak_rss,
+    get_peak_rss,
+    OptimizerStateOffloader,
+    is_out_of_memory,
+    apply_activation_checkpointing,
+    compile_model,
+    snapshot_state_dict,
+    set_random_seed,
+    get_rng_state,
+    set_rng_state,
+    init_distributed,
+    get_rank,
+    get_world_size,
+    is_main_process,
+    all_gather_object,
+    broadcast_object,
+    broadcast_model,
+    unwrap_model,
+    denormalize_to_uint8,
+    get_batch_size,
 )
 
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+
 
 class BaseTrainer:
     def __init__(
@@ -25,138 +54,646 @@ class BaseTrainer:
             criterion=None,
             scheduler=None,
             seed=42,
+            train_transforms=None,
+            eval_transforms=None,
+            metrics=None,
     ):
+        # multiple processes when launched with torchrun, the device gets the local rank as index
+        self.device = init_distributed(config.device)
         self.seed = seed
         set_random_seed(self.seed)
 
         self.config = config
-        self.device = config.device
         self.logger = Logger(config)
 
         # TRAINING
         self.n_epochs = config.n_epochs
+        self.log_every_n_steps = config.log_every_n_steps
+        # validations within the epochs and time budget
+        self.val_every_n_steps = config.val_every_n_steps
+        self.limit_val_batches = config.limit_val_batches
+        self.max_time = config.max_time
+        self.start_time = time.monotonic()
+        self.stop_training = False
+        self.trial = None
         self.early_stopping = EarlyStopping(
             patience=config.patience,
             min_delta=config.min_delta,
             monitor=config.monitor,
             max_mode=config.max_mode
         )
-        self.model_checkpoint = ModelCheckpoint(monitor=config.monitor, max_mode=config.max_mode)
+        self.model_checkpoint = ModelCheckpoint(
+            monitor=config.monitor,
+            max_mode=config.max_mode,
+            save_top_k=config.save_top_k
+        )
 
         # DATASET
         self.train_dl = train_dl
         self.val_dl = val_dl
         self.test_dl = test_dl if test_dl is not None else val_dl
+        # batch level transforms, applied on the device after the batch is loaded
+        self.train_transforms = train_transforms
+        self.eval_transforms = eval_transforms
 
         # LOSS FUNCTION
         self.criterion = criterion
+        # streaming metrics computed on the validation and test sets, they can be monitored by the callbacks
+        self.metrics = metrics or []
 
         # MODEL
+        # activations of the selected submodules are recomputed in the backward pass to save memory
+        apply_activation_checkpointing(model, config.activation_checkpointing)
         self.model = model.to(self.device)
-        self.model = torch.compile(self.model)
+        if get_world_size() > 1:
+            device_ids = [self.device] if torch.device(self.device).type == "cuda" else None
+            self.model = DistributedDataParallel(self.model, device_ids=device_ids)
+        self.ddp_model = self.model if get_world_size() > 1 else None
+        self.model = compile_model(self.model, config)
+        # compilation happens on the first step of each mode, its time is reported apart from the step times
+        self.compile_times = {}
 
         # OPTIMIZER
         self.optimizer = optimizer
         self.scheduler = scheduler
+        self.accumulate_grad_batches = config.accumulate_grad_batches
+        self.gradient_clip_val = config.gradient_clip_val
+        self.optimizer_offloader = OptimizerStateOffloader(
+            optimizer, self.device, enabled=config.offload_optimizer_state and optimizer is not None
+        )
+
+        # PROFILING
+        self.timer = StepTimer(enabled=config.log_step_timing, device=self.device)
+        self.profiler = build_profiler(config, self.logger.results_dir)
+        self.memory = MemoryMonitor(enabled=config.log_memory, device=self.device)
+
+        # MIXED PRECISION
+        self.device_type = torch.device(self.device).type
+        self.amp_dtype = self.get_amp_dtype(config.precision)
+        # loss scaling is only needed with float16, bfloat16 has the same range as float32
+        self.scaler = torch.amp.GradScaler(self.device_type, enabled=self.amp_dtype == torch.float16)
+
+        # MEDIA
+        # first test samples, kept on the host once the test loop ends
+        self.max_media_samples = config.max_media_samples
+        self.media_samples = {}
+
+        # TRAINING STATE
+        self.save_state = config.save_state
+        self.save_state_every_n_steps = config.save_state_every_n_steps
+        # number of optimizer steps, and position the training starts from when it is resumed
+        self.global_step = 0
+        self.start_epoch = 0
+        self.start_step = 0
+        self.resume_metrics = {}
+        # state of the loader generator at the start of the current epoch, it seeds the loader workers
+        self.epoch_loader_rng = None
 
     def train_epoch(self, epoch):
         self.model.train()
         metric_monitor = MetricMonitor()
+        self.set_epoch(self.train_dl, epoch)
+        # a resumed epoch starts after the last saved step, the consumed batches are not loaded again
+        start_step, self.start_step = self.start_step, 0
+        if start_step > 0:
+            self.set_start_index(self.train_dl, start_step)
+            metric_monitor.load_state_dict(self.resume_metrics)
+        n_steps = start_step + len(self.train_dl)
+        if self.train_dl.generator is not None:
+            self.epoch_loader_rng = self.train_dl.generator.get_state()
 
+        # batches loaded in this process draw from the random generators, loading them ahead would
+        # move the generators of a saved state past the batches that are not consumed yet
+        loads_in_process = getattr(self.train_dl, "num_workers", 0) == 0
+        saves_state = self.save_state or self.save_state_every_n_steps > 0
+        prefetcher = BatchPrefetcher(self.train_dl, self.device, prefetch=not (loads_in_process and saves_state))
         # use tqdm to track progress
-        with tqdm(self.train_dl, unit="batch") as tepoch:
+        with tqdm(prefetcher, unit="batch", initial=start_step, total=n_steps, disable=not is_main_process()) as tepoch:
             tepoch.set_description(f"Epoch {epoch + 1}/{self.n_epochs} train")
+            # zero the parameter gradients, freeing their memory
+            self.optimizer.zero_grad(set_to_none=True)
+            self.timer.reset()
+            self.memory.reset()
             # Iterate over data.
-            for step, batch in enumerate(tepoch):
-                batch = load_batch_to_device(batch, self.device)
-                # zero the parameter gradients
-                self.optimizer.zero_grad()
-                # forward
-                output = self.predict(self.model, batch)
-                # loss
-                loss = self.compute_loss(output, batch)
-                # backward
-                loss.backward()
-                # optimize
-                self.optimizer.step()
-                if self.scheduler is not None:
-                    self.scheduler.step()
+            for step, batch in enumerate(tepoch, start=start_step):
+                batch = self.transform_batch(batch, self.train_transforms)
+                self.timer.mark("data")
+                self.memory.mark("data")
+                compile_start = self.start_compile_timer("train")
+                # optimize once every accumulate_grad_batches batches and at the end of the epoch
+                is_optimizer_step = (step + 1) % self.accumulate_grad_batches == 0 or step + 1 == n_steps
+                # gradients are only synchronized between processes on the optimizer steps
+                with self.no_sync(not is_optimizer_step):
+                    with self.autocast():
+                        # forward
+                        output = self.predict(self.model, batch)
+                        # loss
+                        loss = self.compute_loss(output, batch)
+                    self.timer.mark("forward")
+                    self.memory.mark("forward")
+                    # backward, gradients are averaged over the batches of the window, shorter at the end of the epoch
+                    window_start = step - step % self.accumulate_grad_batches
+                    window_size = min(self.accumulate_grad_batches, n_steps - window_start)
+                    self.scaler.scale(loss / window_size).backward()
+                    self.timer.mark("backward")
+                    self.memory.mark("backward")
+                if is_optimizer_step:
+                    self.optimizer_step()
+                    self.timer.mark("optimizer")
+                    self.memory.mark("optimizer")
+                if compile_start is not None:
+                    self.stop_compile_timer("train", compile_start)
                 # update loss and learning rate
-                metric_monitor.update("loss", loss.item())
-                metrics = metric_monitor.get_metrics()
-                metrics["lr"] = self.optimizer.param_groups[0]['lr']
-                tepoch.set_postfix(**metrics)
+                metric_monitor.update("loss", loss)
+                if self.should_log(step, n_steps):
+                    metrics = metric_monitor.get_metrics()
+                    metrics["lr"] = self.optimizer.param_groups[0]['lr']
+                    tepoch.set_postfix(**metrics)
+                # validations, state and time budget within the epoch, the end of the epoch is handled by fit
+                if is_optimizer_step and step + 1 < n_steps:
+                    if self.should_validate():
+                        self.validate_during_epoch(epoch)
+                        self.timer.mark("validation")
+                        self.memory.mark("validation")
+                    if not self.stop_training and self.global_step % self.log_every_n_steps == 0:
+                        self.stop_training = self.time_exceeded()
+                    if self.should_save_state() or (self.stop_training and self.save_state):
+                        self.save_training_state(epoch, step + 1, metric_monitor)
+                    if self.stop_training:
+                        break
+                self.timer.mark("other")
+                self.memory.mark("other")
+                self.timer.step(batch)
+                self.profiler.step()
 
+        metric_monitor.all_reduce(self.device)
+        metrics = metric_monitor.get_metrics()
+        metrics["lr"] = self.optimizer.param_groups[0]['lr']
+        # per phase times and throughput, empty if the timer is disabled
+        metrics.update(self.timer.get_metrics())
+        # per phase peak memory, empty if disabled
+        metrics.update(self.memory.get_metrics())
+        # padding of the batches of a bucketing batch sampler
+        if hasattr(self.train_dl.batch_sampler, "get_metrics"):
+            metrics.update(self.train_dl.batch_sampler.get_metrics())
+        if epoch == 0 and "train" in self.compile_times:
+            metrics["compile_time"] = self.compile_times["train"]
         return metrics
 
     @torch.no_grad()
-    def val_epoch(self, epoch):
+    def val_epoch(self, epoch, limit_batches=None):
+        """
+        :param epoch: current epoch
+        :param limit_batches: number of batches to validate on, all of them if None
+        """
         self.model.eval()
-        metric_monitor = MetricMonitor()
+        metric_monitor = MetricMonitor(self.metrics)
+        n_batches = len(self.val_dl) if limit_batches is None else min(limit_batches, len(self.val_dl))
 
         # use tqdm to track progress
-        with tqdm(self.val_dl, unit="batch") as tepoch:
+        prefetcher = BatchPrefetcher(self.val_dl, self.device)
+        with tqdm(prefetcher, unit="batch", total=n_batches, disable=not is_main_process()) as tepoch:
             tepoch.set_description(f"Epoch {epoch + 1}/{self.n_epochs} val")
-            # Iterate over data.
-            for step, batch in enumerate(tepoch):
-                batch = load_batch_to_device(batch, self.device)
-                # predict
-                output = self.predict(self.model, batch)
-                # loss
-                if self.criterion is not None:
-                    loss = self.compute_loss(output, batch)
-                    # update metrics and loss
-                    metric_monitor.update("loss", loss.item())
-                metrics = self.compute_metrics(metric_monitor, output, batch)
-                tepoch.set_postfix(**metrics)
+            # Iterate over data, the batches after the limit are not loaded
+            for step, batch in zip(range(n_batches), tepoch):
+                batch = self.transform_batch(batch, self.eval_transforms)
+                compile_start = self.start_compile_timer("eval")
+                with self.autocast():
+                    # predict
+                    output = self.predict(self.model, batch)
+                    if compile_start is not None:
+                        self.stop_compile_timer("eval", compile_start)
+                    # loss
+                    if self.criterion is not None:
+                        loss = self.compute_loss(output, batch)
+                        # update metrics and loss
+                        metric_monitor.update("loss", loss)
+                self.compute_metrics(metric_monitor, output, batch)
+                if self.should_log(step, n_batches):
+                    tepoch.set_postfix(**metric_monitor.get_metrics())
 
+        metric_monitor.all_reduce(self.device)
+        metrics = metric_monitor.get_metrics()
+        if epoch == 0 and "eval" in self.compile_times:
+            metrics["compile_time"] = self.compile_times["eval"]
         return metrics
 
     @torch.no_grad()
     def test(self):
         self.model.eval()
-        metric_monitor = MetricMonitor()
+        metric_monitor = MetricMonitor(self.metrics)
+        # media samples are kept on the device during the loop
+        samples = {}
 
         # use tqdm to track progress
-        with tqdm(self.test_dl, unit="batch") as tepoch:
+        with tqdm(BatchPrefetcher(self.test_dl, self.device), unit="batch", disable=not is_main_process()) as tepoch:
             tepoch.set_description(f"Test")
             # Iterate over data.
             for step, batch in enumerate(tepoch):
-                batch = load_batch_to_device(batch, self.device)
-                # predict
-                output = self.predict(self.model, batch)
-                # loss
-                if self.criterion is not None:
-                    loss = self.compute_loss(output, batch)
-                    # update metrics and loss
-                    metric_monitor.update("loss", loss.item())
-                metrics = self.compute_metrics(metric_monitor, output, batch)
-                tepoch.set_postfix(**metrics)
+                batch = self.transform_batch(batch, self.eval_transforms)
+                with self.autocast():
+                    # predict
+                    output = self.predict(self.model, batch)
+                    # loss
+                    if self.criterion is not None:
+                        loss = self.compute_loss(output, batch)
+                        # update metrics and loss
+                        metric_monitor.update("loss", loss)
+                self.compute_metrics(metric_monitor, output, batch)
+                self.collect_media_samples(samples, output, batch)
+                if self.should_log(step, len(tepoch)):
+                    tepoch.set_postfix(**metric_monitor.get_metrics())
 
-        return metrics
+        metric_monitor.all_reduce(self.device)
+        self.media_samples = self.prepare_media_samples(samples)
+        return metric_monitor.get_metrics()
 
-    def fit(self):
-        for epoch in range(self.n_epochs):
-            train_metrics = self.train_epoch(epoch)
-            val_metrics = self.val_epoch(epoch)
+    def fit(self, trial=None):
+        """
+        Train the model, validating it every epoch and every val_every_n_steps optimizer steps, and evaluate
+        the best model. The training stops after n_epochs, when early stopped or when max_time is spent.
+        :param trial: optuna trial the monitored validation metric is reported to every epoch,
+        the training is stopped with optuna.TrialPruned if the trial should be pruned
+        :return: best value of the monitored validation metric
+        """
+        try:
+            if self.config.resume is not None:
+                self.load_training_state(self.config.resume)
+            self.trial = trial
+            self.start_time = time.monotonic()
+            self.stop_training = False
+            # the profiler is stepped once per training step and only traces the configured window
+            with self.profiler:
+                for epoch in range(self.start_epoch, self.n_epochs):
+                    train_metrics = self.train_epoch(epoch)
+                    train_logs = {f"train/{k}": v for k, v in train_metrics.items()}
+                    if self.stop_training and self.model_checkpoint.has_best_model():
+                        # stopped within the epoch, there is already a validated model to evaluate
+                        self.logger.upload_metrics({"epoch": epoch, "step": self.global_step, **train_logs})
+                        break
+                    val_metrics = self.val_epoch(epoch)
 
-            # upload metrics to wandb and save locally
-            train_logs = {f"train/{k}": v for k, v in train_metrics.items()}
-            val_logs = {f"val/{k}": v for k, v in val_metrics.items()}
-            logs = {"epoch": epoch, **train_logs, **val_logs}
-            self.logger.upload_metrics(logs)
+                    # upload metrics to wandb and save locally
+                    val_logs = {f"val/{k}": v for k, v in val_metrics.items()}
+                    logs = {"epoch": epoch, "step": self.global_step, **train_logs, **val_logs}
+                    self.logger.upload_metrics(logs)
+
+                    # save model and early stop callbacks
+                    early_stop = self.run_callbacks(epoch, val_metrics)
+                    if self.save_state and not self.stop_training:
+                        self.save_training_state(epoch + 1, 0)
+                    if early_stop or self.stop_training or self.time_exceeded():
+                        break
+                    self.report_trial(trial, self.global_step if self.val_every_n_steps > 0 else epoch, val_metrics)
+
+            # wait for the pending checkpoints and evaluate the best model
+            self.model_checkpoint.flush()
+            print("Loading best model from training...")
+            if is_main_process():
+                self.model_checkpoint.load_best_model(self.model)
+            broadcast_model(self.model)
+            self.evaluate()
+            return self.model_checkpoint.best_metric
+        finally:
+            # write the pending checkpoints and stop the writer thread
+            self.model_checkpoint.close()
+
+    def find_batch_size(self, dataset, max_batch_size=None, n_steps=10, min_gain=0.05) -> int:
+        """
+        Find the batch size with the highest training throughput. Starting from config.batch_size, it is doubled
+        until a step runs out of memory, the throughput improves less than min_gain, or it reaches max_batch_size
+        or the size of the dataset. If config.batch_size runs out of memory it is halved instead.
+        The probe trains on real batches of the dataset, the model, optimizer and random states are restored after.
+        The results are saved to batch_size_finder.json in the output directory.
+        :param dataset: training dataset
+        :param max_batch_size: largest batch size per process to try, unlimited if None
+        :param n_steps: training steps measured for each batch size, after a warmup step
+        :param min_gain: minimum relative throughput gain to keep doubling the batch size
+        :return: batch size per process
+        """
+        from src.datasets import build_dataloader
+
+        self.optimizer_offloader.synchronize()
+        state = snapshot_state_dict({
+            "model": unwrap_model(self.model).state_dict(),
+            "optimizer": self.optimizer.state_dict(),
+            "scaler": self.scaler.state_dict(),
+        })
+        rng_state = get_rng_state()
 
-            # save model and early stop callbacks
-            self.model_checkpoint(self.model, val_metrics)
-            early_stop = self.early_stopping(epoch, val_metrics)
-            if early_stop:
+        results = []
+        batch_size = self.config.batch_size
+        while max_batch_size is None or batch_size <= max_batch_size:
+            loader = build_dataloader(dataset, self.config, train=True, batch_size=batch_size)
+            if len(loader) < n_steps + 1:
                 break
+            # a batch size runs out of memory if it does in any process, the throughput is the total one
+            rank_results = all_gather_object(self.probe_batch_size(loader, n_steps))
+            result = {
+                "batch_size": batch_size,
+                "oom": any(r["oom"] for r in rank_results),
+                "samples_per_sec": sum(r["samples_per_sec"] for r in rank_results),
+                "peak_memory_mb": max(r["peak_memory_mb"] for r in rank_results),
+            }
+            results.append(result)
+            del loader
+            print(f"Batch size {batch_size}: " + ("out of memory" if result["oom"] else
+                                                  f"{result['samples_per_sec']:.1f} samples/sec, "
+                                                  f"{result['peak_memory_mb']:.0f} MB"))
+            fitted = [r for r in results if not r["oom"]]
+            if result["oom"] and not fitted:
+                if batch_size == 1:
+                    raise RuntimeError("The training runs out of memory with a batch size of 1")
+                batch_size //= 2
+                continue
+            if result["oom"] or batch_size < self.config.batch_size:
+                break
+            best_rate = max(r["samples_per_sec"] for r in fitted[:-1]) if len(fitted) > 1 else 0.0
+            if best_rate > 0 and result["samples_per_sec"] < best_rate * (1 + min_gain):
+                break
+            batch_size *= 2
+
+        unwrap_model(self.model).load_state_dict(state["model"])
+        self.optimizer.load_state_dict(state["optimizer"])
+        self.optimizer_offloader.offload()
+        self.scaler.load_state_dict(state["scaler"])
+        set_rng_state(rng_state)
 
-        # evaluate the best model
-        print("Loading best model from training...")
-        self.model_checkpoint.load_best_model(self.model)
-        self.evaluate()
-        return self.model_checkpoint.best_metric
+        fitted = [r for r in results if not r["oom"]]
+        best = max(fitted, key=lambda r: r["samples_per_sec"])["batch_size"] if fitted else self.config.batch_size
+        if is_main_process():
+            with open(os.path.join(self.logger.results_dir, "batch_size_finder.json"), "w") as f:
+                json.dump({"batch_size": best, "results": results}, f, indent=2)
+        print(f"Using a batch size of {best}.")
+        return best
+
+    def probe_batch_size(self, loader, n_steps) -> dict:
+        """
+        Run a warmup step and n_steps training steps on the batches of the loader. With multiple processes
+        the model is probed without DistributedDataParallel, so a process running out of memory does not block
+        the others, and the memory of the gradient synchronization is not included.
+        :return: dictionary with whether it ran out of memory, the samples/sec and the peak memory in MB
+        """
+        model = self.model if self.ddp_model is None else self.ddp_model.module
+        model.train()
+        cuda = self.device_type == "cuda"
+        if cuda:
+            torch.cuda.reset_peak_memory_stats(self.device)
+        reset_peak_rss()
+        n_samples = 0
+        elapsed = 0.0
+        oom = False
+        try:
+            for step, batch in enumerate(BatchPrefetcher(loader, self.device)):
+                if step == 1:
+                    # the first step includes the workers startup and compilation
+                    if cuda:
+                        torch.cuda.synchronize(self.device)
+                    start_time = time.perf_counter()
+                elif step == n_steps + 1:
+                    break
+                batch = self.transform_batch(batch, self.train_transforms)
+                with self.autocast():
+                    loss = self.compute_loss(self.predict(model, batch), batch)
+                self.scaler.scale(loss).backward()
+                self.optimizer_offloader.load()
+                self.scaler.step(self.optimizer)
+                self.optimizer_offloader.offload()
+                self.scaler.update()
+                self.optimizer.zero_grad(set_to_none=True)
+                n_samples += get_batch_size(batch) if step > 0 else 0
+            if cuda:
+                torch.cuda.synchronize(self.device)
+            elapsed = time.perf_counter() - start_time
+        except RuntimeError as error:
+            if not is_out_of_memory(error):
+                raise
+            elapsed = 0.0
+            oom = True
+        # free the memory of the failed step before the next batch size
+        batch = loss = None
+        self.optimizer.zero_grad(set_to_none=True)
+        peak_memory = torch.cuda.max_memory_allocated(self.device) / 2 ** 20 if cuda else get_peak_rss()
+        if cuda:
+            torch.cuda.empty_cache()
+        return {
+            "oom": oom,
+            "samples_per_sec": n_samples / elapsed if elapsed > 0 else 0.0,
+            "peak_memory_mb": peak_memory,
+        }
+
+    def report_trial(self, trial, step, val_metrics):
+        """
+        Report the monitored validation metric to the optuna trial, and stop the training if it should be pruned.
+        :param step: epoch, or optimizer step when validating within the epochs
+        """
+        if trial is None:
+            return
+        trial.report(val_metrics[self.config.monitor], step)
+        if trial.should_prune():
+            import optuna
+
+            self.model_checkpoint.flush()
+            self.logger.finish()
+            raise optuna.TrialPruned(f"Trial pruned at step {step}.")
+
+    def run_callbacks(self, epoch, val_metrics, step=None) -> bool:
+        """
+        Save the model and update the early stopping with the validation metrics.
+        :return: whether the training should stop, decided by the main process
+        """
+        self.model_checkpoint(self.model, val_metrics, epoch, step)
+        early_stop = self.early_stopping(epoch, val_metrics) if is_main_process() else False
+        return broadcast_object(early_stop)
+
+    def should_validate(self) -> bool:
+        return self.val_every_n_steps > 0 and self.global_step % self.val_every_n_steps == 0
+
+    def validate_during_epoch(self, epoch):
+        """
+        Validate on the first limit_val_batches batches and run the callbacks, then continue training.
+        """
+        val_metrics = self.val_epoch(epoch, limit_batches=self.limit_val_batches)
+        val_logs = {f"val/{k}": v for k, v in val_metrics.items()}
+        self.logger.upload_metrics({"epoch": epoch, "step": self.global_step, **val_logs})
+        if self.run_callbacks(epoch, val_metrics, step=self.global_step):
+            self.stop_training = True
+        else:
+            self.report_trial(self.trial, self.global_step, val_metrics)
+        self.model.train()
+
+    def time_exceeded(self) -> bool:
+        """
+        Whether the max_time budget is spent. The main process decides, so all the processes stop at the same step.
+        """
+        if self.max_time is None:
+            return False
+        return broadcast_object(time.monotonic() - self.start_time > self.max_time)
+
+    def should_save_state(self) -> bool:
+        return self.save_state_every_n_steps > 0 and self.global_step % self.save_state_every_n_steps == 0
+
+    def save_training_state(self, epoch, step, metric_monitor=None):
+        """
+        Save everything needed to continue the training exactly from this point to ckpts/state.pt.
+        It should be called by all the processes, after an optimizer step.
+        :param epoch: epoch the training continues from
+        :param step: number of batches of the epoch already consumed, 0 at the end of an epoch
+        :param metric_monitor: metrics of the epoch so far, None at the end of an epoch
+        """
+        # random generators and partial metrics differ between processes
+        rank_states = all_gather_object(snapshot_state_dict({
+            "rng": get_rng_state(),
+            "metrics": metric_monitor.state_dict() if metric_monitor is not None else {},
+        }))
+        if not is_main_process():
+            return
+        # the offloaded optimizer state may still be copied to the host
+        self.optimizer_offloader.synchronize()
+        generator = self.train_dl.generator
+        state = {
+            "epoch": epoch,
+            "step": step,
+            "global_step": self.global_step,
+            "model": unwrap_model(self.model).state_dict(),
+            "optimizer": self.optimizer.state_dict(),
+            "scheduler": self.scheduler.state_dict() if self.scheduler is not None else None,
+            "scaler": self.scaler.state_dict(),
+            "early_stopping": self.early_stopping.state_dict(),
+            "model_checkpoint": self.model_checkpoint.state_dict(),
+            # the workers of a resumed epoch are seeded from the generator state at the start of the epoch
+            "loader_rng": self.epoch_loader_rng if step > 0 else (generator.get_state() if generator else None),
+            "ranks": rank_states,
+        }
+        self.model_checkpoint.save_state(state)
+
+    def load_training_state(self, filename):
+        """
+        Restore the training state saved by save_training_state, fit continues from the saved step.
+        The training should be resumed with the same number of processes and batch size.
+        """
+        print(f"Resuming training from {filename}...")
+        # the state holds numpy and python random states besides tensors
+        state = torch.load(filename, map_location="cpu", weights_only=False)
+        if len(state["ranks"]) != get_world_size():
+            raise ValueError(
+                f"The training state was saved with {len(state['ranks'])} processes, "
+                f"it can't be resumed with {get_world_size()}"
+            )
+        unwrap_model(self.model).load_state_dict(state["model"])
+        self.optimizer.load_state_dict(state["optimizer"])
+        self.optimizer_offloader.offload()
+        if self.scheduler is not None:
+            self.scheduler.load_state_dict(state["scheduler"])
+        self.scaler.load_state_dict(state["scaler"])
+        self.early_stopping.load_state_dict(state["early_stopping"])
+        self.model_checkpoint.load_state_dict(state["model_checkpoint"])
+        self.start_epoch = state["epoch"]
+        self.start_step = state["step"]
+        self.global_step = state["global_step"]
+        if state["loader_rng"] is not None and self.train_dl.generator is not None:
+            self.train_dl.generator.set_state(state["loader_rng"])
+        rank_state = state["ranks"][get_rank()]
+        self.resume_metrics = rank_state["metrics"]
+        set_rng_state(rank_state["rng"])
+
+    @staticmethod
+    def set_epoch(dataloader, epoch):
+        """
+        Set the epoch of the sampler or batch sampler, so distributed samplers shuffle differently every epoch,
+        or of the dataset for iterable datasets that shuffle themselves.
+        """
+        for name in ("sampler", "batch_sampler", "dataset"):
+            obj = getattr(dataloader, name, None)
+            if hasattr(obj, "set_epoch"):
+                obj.set_epoch(epoch)
+
+    @staticmethod
+    def set_start_index(dataloader, start_step):
+        """
+        Skip the first start_step batches of the current epoch, the sampler should be a ResumableSampler,
+        the batch sampler a BucketBatchSampler or the dataset a ShardedDataset.
+        """
+        for name in ("batch_sampler", "dataset"):
+            obj = getattr(dataloader, name, None)
+            if hasattr(obj, "set_start_index"):
+                return obj.set_start_index(start_step)
+        sampler = getattr(dataloader, "sampler", None)
+        if not hasattr(sampler, "set_start_index"):
+            raise ValueError("Resuming in the middle of an epoch requires a training loader with a ResumableSampler")
+        sampler.set_start_index(start_step * dataloader.batch_size)
+
+    def start_compile_timer(self, mode):
+        """
+        Start timing the step if the model is compiled and it is the first step of the mode.
+        :return: start time, None if the step does not compile
+        """
+        if not self.config.compile or mode in self.compile_times:
+            return None
+        return time.perf_counter()
+
+    def stop_compile_timer(self, mode, start_time):
+        if torch.device(self.device).type == "cuda":
+            torch.cuda.synchronize(self.device)
+        self.compile_times[mode] = time.perf_counter() - start_time
+        # the compilation step is not included in the step times, the first eval step
+        # can run within a training epoch whose times are kept
+        if mode == "train":
+            self.timer.reset()
+
+    def no_sync(self, skip_sync):
+        """
+        Context to skip the gradient synchronization between processes during gradient accumulation.
+        """
+        if skip_sync and self.ddp_model is not None:
+            return self.ddp_model.no_sync()
+        return nullcontext()
+
+    def optimizer_step(self):
+        # unscale the gradients before clipping them
+        if self.gradient_clip_val is not None:
+            self.scaler.unscale_(self.optimizer)
+            torch.nn.utils.clip_grad_norm_(self.model.parameters(), self.gradient_clip_val)
+        self.optimizer_offloader.load()
+        self.scaler.step(self.optimizer)
+        self.optimizer_offloader.offload()
+        scale = self.scaler.get_scale()
+        self.scaler.update()
+        self.optimizer.zero_grad(set_to_none=True)
+        self.global_step += 1
+        # the scheduler follows optimizer steps, not batches, the scale decreases when the step was
+        # skipped because of inf or nan gradients
+        if self.scheduler is not None and self.scaler.get_scale() >= scale:
+            self.scheduler.step()
+
+    def get_amp_dtype(self, precision):
+        """
+        Autocast dtype for the given precision, None for full precision.
+        float16 autocast is not supported on CPU, so bfloat16 is used instead.
+        """
+        if precision == "32":
+            return None
+        elif precision == "bf16":
+            return torch.bfloat16
+        elif precision == "16":
+            return torch.bfloat16 if self.device_type == "cpu" else torch.float16
+        raise ValueError(f"Unknown precision {precision}, expected one of '32', '16' or 'bf16'")
+
+    def autocast(self):
+        return torch.autocast(
+            device_type=self.device_type,
+            dtype=self.amp_dtype,
+            enabled=self.amp_dtype is not None
+        )
+
+    @torch.no_grad()
+    def transform_batch(self, batch, transforms):
+        """
+        Apply the batch level transforms to the inputs of the batch.
+        """
+        if transforms is not None:
+            batch["x"] = transforms(batch["x"])
+        return batch
 
     def predict(self, model, batch):
         return model(batch["x"])
@@ -167,25 +704,74 @@ class BaseTrainer:
         return self.criterion(output, batch["y"])
 
     def evaluate(self):
-        test_metrics = self.test()
-        logs = {f"test/{k}": v for k, v in test_metrics.items()}
-        self.logger.upload_metrics(logs)
+        try:
+            test_metrics = self.test()
+            logs = {f"test/{k}": v for k, v in test_metrics.items()}
+            self.logger.upload_metrics(logs)
 
-        print(f"Generating media...")
-        figures = self.generate_media()
-        self.logger.upload_media(figures)
+            print(f"Generating media...")
+            figures = self.generate_media(self.media_samples)
+            self.logger.upload_media(figures)
 
-        self.logger.finish()
+            self.logger.finish()
+        finally:
+            self.model_checkpoint.close()
 
-    def compute_metrics(self, metric_monitor: MetricMonitor, output, batch) -> dict:
+    def should_log(self, step, n_steps) -> bool:
         """
-        Update metric_monitor with the metrics computed from output and batch and
-        return the metrics as a dictionary.
+        Whether the metrics should be synchronized with the host and shown at this step.
         """
-        return metric_monitor.get_metrics()
+        return (step + 1) % self.log_every_n_steps == 0 or step + 1 == n_steps
+
+    def compute_metrics(self, metric_monitor: MetricMonitor, output, batch) -> None:
+        """
+        Update metric_monitor with the metrics computed from output and batch.
+        Metrics should be given as tensors to avoid synchronizing with the host on every step.
+        By default the streaming metrics are updated with the output and the targets of the batch.
+        """
+        if metric_monitor.streaming_metrics:
+            metric_monitor.update_streaming_metrics(output, batch["y"])
+
+    def collect_media_samples(self, samples, output, batch) -> None:
+        """
+        Keep the inputs, targets and outputs of the first max_media_samples test samples, without leaving the device.
+        """
+        n_samples = sum(len(x) for x in samples.get("x", []))
+        n = min(self.max_media_samples - n_samples, len(batch["x"]))
+        if n <= 0:
+            return
+        samples.setdefault("x", []).append(batch["x"][:n])
+        if isinstance(batch.get("y"), torch.Tensor):
+            samples.setdefault("y", []).append(batch["y"][:n])
+        if isinstance(output, torch.Tensor):
+            samples.setdefault("output", []).append(output[:n])
+
+    def prepare_media_samples(self, samples) -> dict:
+        """
+        Concatenate the collected samples and convert the images to uint8 on the device,
+        then copy each array to the host with a single transfer.
+        :return: dictionary of numpy arrays, "images" with shape (N, H, W, C), and "y" and "output" if available
+        """
+        if not samples:
+            return {}
+        samples = {key: torch.cat(values) for key, values in samples.items()}
+        samples["images"] = self.denormalize_images(samples.pop("x"))
+        return {key: value.float().cpu().numpy() if value.is_floating_point() else value.cpu().numpy()
+                for key, value in samples.items()}
+
+    def denormalize_images(self, x):
+        """
+        Revert the normalization of the inputs, override it if they are not normalized with ImageNet statistics.
+        :return: uint8 images with shape (B, H, W, C)
+        """
+        return denormalize_to_uint8(x)
 
-    def generate_media(self) -> Dict[str, Figure]:
+    def generate_media(self, samples) -> Dict[str, Union["Figure", tuple]]:
         """
-        Generate media from output and batch.
+        Generate media from the test samples.
+        Figures can be given as matplotlib Figures, or as (render_fn, args) tuples to be rendered and saved
+        in a pool of processes, e.g. {"samples": (plot_image_grid, (samples["images"], titles))}.
+        :param samples: samples kept during the test loop, see prepare_media_samples
+        :return: dictionary of figures
         """
         return {}
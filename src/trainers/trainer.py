@@ -1,3 +1,4 @@
+from src.utils import plot_image_grid
 from .base_trainer import BaseTrainer
 
 
@@ -13,6 +14,9 @@ class TemplateTrainer(BaseTrainer):
             criterion=None,
             scheduler=None,
             seed=42,
+            train_transforms=None,
+            eval_transforms=None,
+            metrics=None,
     ):
         """
         Trainer class.
@@ -23,6 +27,9 @@ class TemplateTrainer(BaseTrainer):
         :param optimizer:
         :param criterion:
         :param scheduler:
+        :param train_transforms: batch level transforms for training
+        :param eval_transforms: batch level transforms for validation and test
+        :param metrics: streaming metrics computed on validation and test, e.g. [ClassificationMetrics(n_classes)]
         """
         super().__init__(
             config=config,
@@ -34,4 +41,19 @@ class TemplateTrainer(BaseTrainer):
             optimizer=optimizer,
             scheduler=scheduler,
             seed=seed,
+            train_transforms=train_transforms,
+            eval_transforms=eval_transforms,
+            metrics=metrics,
         )
+
+    def generate_media(self, samples):
+        """
+        Grid of the first test images, titled with their predicted and true classes.
+        The figure is rendered by the logger in a worker process.
+        """
+        if "images" not in samples or "output" not in samples:
+            return {}
+        predictions = samples["output"].argmax(-1)
+        targets = samples.get("y", [None] * len(predictions))
+        titles = [f"pred {p}" + (f" / true {t}" if t is not None else "") for p, t in zip(predictions, targets)]
+        return {"test_samples": (plot_image_grid, (samples["images"], titles))}
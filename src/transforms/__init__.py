@@ -0,0 +1,11 @@
+from .batch_transforms import (
+    BatchCompose,
+    BatchTransform,
+    BatchResize,
+    BatchHorizontalFlip,
+    BatchVerticalFlip,
+    BatchRandomCrop,
+    BatchRandomResizedCrop,
+    BatchColorJitter,
+    BatchNormalize,
+)
@@ -0,0 +1,192 @@
+import math
+
+import torch
+import torch.nn.functional as F
+
+
+class BatchCompose:
+    def __init__(self, transforms):
+        """
+        Compose batch transforms, the batch level counterpart of A.Compose.
+        Integer batches (e.g. uint8 images) are converted to float32 keeping their value range,
+        so BatchNormalize should be given the same max_pixel_value as A.Normalize.
+        :param transforms: list of batch transforms
+        """
+        self.transforms = transforms
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        """
+        :param x: batch of images with shape (B, C, H, W)
+        :return: transformed batch
+        """
+        if not torch.is_floating_point(x):
+            x = x.float()
+        for transform in self.transforms:
+            x = transform(x)
+        return x
+
+
+class BatchTransform:
+    def __init__(self, p: float = 1.0):
+        """
+        Base batch transform, applied independently to each sample of the batch with probability p.
+        :param p: probability of applying the transform to each sample
+        """
+        self.p = p
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        if self.p >= 1.0:
+            return self.apply(x)
+        mask = torch.rand(x.shape[0], device=x.device) < self.p
+        return torch.where(mask[:, None, None, None], self.apply(x), x)
+
+    def apply(self, x: torch.Tensor) -> torch.Tensor:
+        raise NotImplementedError
+
+
+class BatchResize:
+    def __init__(self, height: int, width: int, mode: str = "bilinear", antialias: bool = False):
+        """
+        Resize all the images of the batch.
+        :param height: output height
+        :param width: output width
+        :param mode: interpolation mode of F.interpolate
+        :param antialias: antialias when downsampling, A.Resize does not
+        """
+        self.size = (height, width)
+        self.mode = mode
+        self.antialias = antialias
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        if tuple(x.shape[-2:]) == self.size:
+            return x
+        return F.interpolate(x, size=self.size, mode=self.mode, antialias=self.antialias)
+
+
+class BatchHorizontalFlip(BatchTransform):
+    def __init__(self, p: float = 0.5):
+        super().__init__(p)
+
+    def apply(self, x: torch.Tensor) -> torch.Tensor:
+        return x.flip(-1)
+
+
+class BatchVerticalFlip(BatchTransform):
+    def __init__(self, p: float = 0.5):
+        super().__init__(p)
+
+    def apply(self, x: torch.Tensor) -> torch.Tensor:
+        return x.flip(-2)
+
+
+class BatchRandomCrop:
+    def __init__(self, height: int, width: int):
+        """
+        Crop a region of the given size at a random position of each image.
+        :param height: crop height
+        :param width: crop width
+        """
+        self.height = height
+        self.width = width
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        batch_size, _, height, width = x.shape
+        top = torch.randint(0, height - self.height + 1, (batch_size,), device=x.device)
+        left = torch.randint(0, width - self.width + 1, (batch_size,), device=x.device)
+        rows = top[:, None] + torch.arange(self.height, device=x.device)
+        cols = left[:, None] + torch.arange(self.width, device=x.device)
+        batch_idx = torch.arange(batch_size, device=x.device)[:, None, None]
+        # advanced indexing gives (B, height, width, C)
+        crops = x.permute(0, 2, 3, 1)[batch_idx, rows[:, :, None], cols[:, None, :]]
+        return crops.permute(0, 3, 1, 2).contiguous()
+
+
+class BatchRandomResizedCrop:
+    def __init__(self, height: int, width: int, scale=(0.08, 1.0), ratio=(3 / 4, 4 / 3)):
+        """
+        Crop a random region of each image, with random area and aspect ratio, and resize it to the given size.
+        :param height: output height
+        :param width: output width
+        :param scale: range of the crop area relative to the image area
+        :param ratio: range of the crop aspect ratio
+        """
+        self.size = (height, width)
+        self.scale = scale
+        self.ratio = ratio
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        batch_size, _, height, width = x.shape
+        area = torch.empty(batch_size, device=x.device).uniform_(*self.scale)
+        log_ratio = torch.empty(batch_size, device=x.device).uniform_(math.log(self.ratio[0]), math.log(self.ratio[1]))
+        # aspect ratio in pixels, converted to the normalized image coordinates
+        aspect_ratio = torch.exp(log_ratio) * height / width
+        # crop size relative to the image size, in (0, 1]
+        crop_w = torch.sqrt(area * aspect_ratio).clamp(max=1.0)
+        crop_h = torch.sqrt(area / aspect_ratio).clamp(max=1.0)
+        # crop center in normalized coordinates, so that the crop stays inside the image
+        center_x = (torch.rand(batch_size, device=x.device) * 2 - 1) * (1 - crop_w)
+        center_y = (torch.rand(batch_size, device=x.device) * 2 - 1) * (1 - crop_h)
+
+        theta = torch.zeros(batch_size, 2, 3, device=x.device, dtype=x.dtype)
+        theta[:, 0, 0] = crop_w
+        theta[:, 0, 2] = center_x
+        theta[:, 1, 1] = crop_h
+        theta[:, 1, 2] = center_y
+        grid = F.affine_grid(theta, [batch_size, x.shape[1], *self.size], align_corners=False)
+        return F.grid_sample(x, grid, mode="bilinear", padding_mode="reflection", align_corners=False)
+
+
+class BatchColorJitter(BatchTransform):
+    def __init__(self, brightness=0.0, contrast=0.0, saturation=0.0, max_value=255.0, p=1.0):
+        """
+        Randomly change the brightness, contrast and saturation of each image of RGB batches.
+        Hue jitter is not supported.
+        :param brightness: brightness factor is sampled from [1 - brightness, 1 + brightness]
+        :param contrast: contrast factor is sampled from [1 - contrast, 1 + contrast]
+        :param saturation: saturation factor is sampled from [1 - saturation, 1 + saturation]
+        :param max_value: maximum pixel value, the images are clamped to [0, max_value]
+        :param p: probability of applying the transform to each sample
+        """
+        super().__init__(p)
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+        self.max_value = max_value
+
+    @staticmethod
+    def sample_factor(x, amount):
+        low = max(0.0, 1.0 - amount)
+        return torch.empty(x.shape[0], 1, 1, 1, device=x.device, dtype=x.dtype).uniform_(low, 1.0 + amount)
+
+    @staticmethod
+    def grayscale(x):
+        r, g, b = x.unbind(1)
+        return (0.299 * r + 0.587 * g + 0.114 * b).unsqueeze(1)
+
+    def apply(self, x: torch.Tensor) -> torch.Tensor:
+        if self.brightness > 0:
+            x = x * self.sample_factor(x, self.brightness)
+        if self.contrast > 0:
+            mean = self.grayscale(x).mean(dim=(1, 2, 3), keepdim=True)
+            x = torch.lerp(mean, x, self.sample_factor(x, self.contrast))
+        if self.saturation > 0:
+            x = torch.lerp(self.grayscale(x), x, self.sample_factor(x, self.saturation))
+        return x.clamp(0, self.max_value)
+
+
+class BatchNormalize:
+    def __init__(self, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225), max_pixel_value=255.0):
+        """
+        Normalize the batch as A.Normalize does: (x / max_pixel_value - mean) / std.
+        :param mean: mean of each channel
+        :param std: standard deviation of each channel
+        :param max_pixel_value: maximum pixel value of the input
+        """
+        self.mean = torch.tensor(mean)[None, :, None, None] * max_pixel_value
+        self.std = torch.tensor(std)[None, :, None, None] * max_pixel_value
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        if self.mean.device != x.device:
+            self.mean = self.mean.to(x.device)
+            self.std = self.std.to(x.device)
+        return (x - self.mean.to(x.dtype)) / self.std.to(x.dtype)
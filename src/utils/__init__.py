@@ -1,4 +1,49 @@
-from .io import *
-from .plots import *
-from .logger import *
-from .callbacks import *
+import importlib
+
+# public names of each submodule, the submodules and their dependencies (wandb, matplotlib, ...)
+# are only imported when one of their names is first used
+_SUBMODULES = {
+    "io": [
+        "load_yaml_config", "apply_to_collection", "load_batch_to_device", "pin_batch", "BatchPrefetcher",
+        "get_output_dir", "set_random_seed", "get_rng_state", "set_rng_state", "get_batch_size",
+    ],
+    "distributed": [
+        "is_distributed", "get_rank", "get_world_size", "is_main_process", "init_distributed",
+        "cleanup_distributed", "barrier", "all_reduce_sum", "broadcast_object", "all_gather_object",
+        "broadcast_model", "unwrap_model",
+    ],
+    "figures": ["get_colors", "plot_image_grid", "render_figure", "render_figures"],
+    "plots": ["named_colors", "colors", "denormalize_to_uint8", "norm_tensor_to_original_im", "tensors_to_images"],
+    "logger": ["Logger"],
+    "sinks": ["CSVWriter", "JSONLWriter", "ParquetWriter", "WRITERS", "MetricsSink", "BackgroundUploader"],
+    "callbacks": ["EarlyStopping", "ModelCheckpoint"],
+    "checkpoint": [
+        "WRAPPER_PREFIXES", "snapshot_state_dict", "atomic_save", "strip_state_dict_prefix",
+        "load_model_weights", "CheckpointWriter",
+    ],
+    "profiling": ["StepTimer", "NullProfiler", "build_profiler"],
+    "compile": ["configure_compile_cache", "compile_model"],
+    "memory": [
+        "CheckpointWrapper", "apply_activation_checkpointing", "OptimizerStateOffloader", "is_out_of_memory",
+        "reset_peak_rss", "get_peak_rss", "MemoryMonitor",
+    ],
+    "quantization": [
+        "quantize_dynamic_int8", "quantize_static_int8", "export_torchscript", "get_model_size", "measure_latency",
+    ],
+}
+_NAMES = {name: submodule for submodule, names in _SUBMODULES.items() for name in names}
+
+__all__ = list(_NAMES)
+
+
+def __getattr__(name):
+    if name not in _NAMES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_NAMES[name]}", __name__), name)
+    # cache it, so the next accesses don't go through __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_NAMES))
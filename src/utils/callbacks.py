@@ -2,8 +2,9 @@ from math import inf
 from pathlib import Path
 import os
 
-import hydra
-import torch
+from .checkpoint import CheckpointWriter, snapshot_state_dict, load_model_weights
+from .distributed import is_main_process, unwrap_model
+from .io import get_output_dir
 
 
 class EarlyStopping:
@@ -46,32 +47,120 @@ class EarlyStopping:
 
         return False
 
+    def state_dict(self) -> dict:
+        return {"counter": self.counter, "best_score": self.best_score, "early_stop": self.early_stop}
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        self.counter = state_dict["counter"]
+        self.best_score = state_dict["best_score"]
+        self.early_stop = state_dict["early_stop"]
+
 
 class ModelCheckpoint:
     def __init__(
             self,
             monitor: str,
             max_mode: bool = False,
+            save_top_k: int = 0,
     ) -> None:
-        self.filepath = hydra.core.hydra_config.HydraConfig.get().runtime.output_dir + '/ckpts'
+        self.filepath = get_output_dir() + '/ckpts'
         # track best model
         self.monitor = monitor
         self.max_mode = max_mode
         self.best_metric: float = -inf if max_mode else inf
+        # best weights cached in memory, so they don't need to be read back from disk
+        self.best_state_dict = None
+        # file of the best weights, it belongs to a previous run until the resumed training improves them
+        self.best_filename = os.path.join(self.filepath, 'best.pt')
+        # top k checkpoints as (score, filename) pairs, sorted from best to worst
+        self.save_top_k = save_top_k
+        self.top_k = []
+        # checkpoints are written in a background thread, only by the main process, started by the first write
+        self.enabled = is_main_process()
+        self.writer = None
 
-    def __call__(self, model, metrics: dict) -> None:
-        Path(self.filepath).mkdir(parents=True, exist_ok=True)
+    def __call__(self, model, metrics: dict, epoch: int, step=None) -> None:
         score = metrics[self.monitor]
+        if not self.enabled:
+            # keep track of the best metric in every process
+            if self.is_better(score, self.best_metric):
+                self.best_metric = score
+            return
+        Path(self.filepath).mkdir(parents=True, exist_ok=True)
+        # copy the weights to the CPU once, the copy is shared by all the files written below
+        state_dict = snapshot_state_dict(unwrap_model(model).state_dict())
         # save the last model
         filename = os.path.join(self.filepath, 'last.pt')
-        torch.save(model.state_dict(), filename)
+        self.get_writer().save(state_dict, filename)
         # save if the model is the best
-        is_best = score > self.best_metric if self.max_mode else score < self.best_metric
-        if is_best:
+        if self.is_better(score, self.best_metric):
             self.best_metric = score
-            filename = os.path.join(self.filepath, 'best.pt')
-            torch.save(model.state_dict(), filename)
+            self.best_state_dict = state_dict
+            self.best_filename = os.path.join(self.filepath, 'best.pt')
+            self.get_writer().save(state_dict, self.best_filename)
+        # keep the top k models
+        if self.save_top_k > 0:
+            self.update_top_k(state_dict, score, epoch, step)
+
+    def has_best_model(self) -> bool:
+        return self.best_metric not in (inf, -inf)
+
+    def is_better(self, score, other) -> bool:
+        return score > other if self.max_mode else score < other
+
+    def update_top_k(self, state_dict, score, epoch, step=None):
+        if len(self.top_k) >= self.save_top_k and not self.is_better(score, self.top_k[-1][0]):
+            return
+        name = f'epoch={epoch}' if step is None else f'epoch={epoch}-step={step}'
+        filename = os.path.join(self.filepath, f'{name}-{self.monitor}={score:.4f}.pt')
+        self.get_writer().save(state_dict, filename)
+        self.top_k.append((score, filename))
+        self.top_k.sort(key=lambda item: item[0], reverse=self.max_mode)
+        if len(self.top_k) > self.save_top_k:
+            _, worst_filename = self.top_k.pop()
+            self.get_writer().remove(worst_filename)
+
+    def save_state(self, state: dict) -> None:
+        """
+        Save the full training state to state.pt, from which the training can be resumed.
+        :param state: training state, it is snapshotted before being queued
+        """
+        if not self.enabled:
+            return
+        Path(self.filepath).mkdir(parents=True, exist_ok=True)
+        self.get_writer().save(snapshot_state_dict(state), os.path.join(self.filepath, 'state.pt'))
+
+    def state_dict(self) -> dict:
+        return {"best_metric": self.best_metric, "best_filename": self.best_filename, "top_k": list(self.top_k)}
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        self.best_metric = state_dict["best_metric"]
+        self.best_filename = state_dict["best_filename"]
+        self.top_k = list(state_dict["top_k"])
+
+    def get_writer(self) -> CheckpointWriter:
+        if self.writer is None:
+            self.writer = CheckpointWriter()
+        return self.writer
+
+    def flush(self):
+        """
+        Wait until all the pending checkpoints are written to disk.
+        """
+        if self.writer is not None:
+            self.writer.flush()
+
+    def close(self):
+        """
+        Write the pending checkpoints and stop the writer thread, a later write starts a new one.
+        """
+        if self.writer is not None:
+            writer, self.writer = self.writer, None
+            writer.close()
 
     def load_best_model(self, model):
-        filename = os.path.join(self.filepath, 'best.pt')
-        model.load_state_dict(torch.load(filename))
+        if self.best_state_dict is not None:
+            unwrap_model(model).load_state_dict(self.best_state_dict)
+            return
+        self.flush()
+        load_model_weights(model, self.best_filename)
@@ -0,0 +1,145 @@
+import os
+import queue
+import threading
+
+import torch
+
+from .distributed import unwrap_model
+
+# prefixes added to the state dict keys by torch.compile and DistributedDataParallel
+WRAPPER_PREFIXES = ("_orig_mod.", "module.")
+
+
+def snapshot_state_dict(state_dict):
+    """
+    Copy every tensor of a (possibly nested) state dict to the CPU, so it can be written
+    while the training keeps updating the original tensors.
+    """
+    if isinstance(state_dict, torch.Tensor):
+        return state_dict.detach().to("cpu", copy=True)
+    elif isinstance(state_dict, dict):
+        return {key: snapshot_state_dict(value) for key, value in state_dict.items()}
+    elif isinstance(state_dict, (list, tuple)):
+        return type(state_dict)(snapshot_state_dict(value) for value in state_dict)
+    return state_dict
+
+
+def atomic_save(obj, filename):
+    """
+    Save obj to filename through a temporary file in the same directory, so filename always
+    holds either the previous or the new checkpoint, never a partially written one.
+    """
+    tmp_filename = f"{filename}.tmp"
+    with open(tmp_filename, "wb") as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+
+def strip_state_dict_prefix(state_dict, prefixes=WRAPPER_PREFIXES):
+    """
+    Remove the wrapper prefixes from the keys, so checkpoints saved from a compiled or
+    distributed model load into the plain module.
+    """
+    stripped = {}
+    for key, value in state_dict.items():
+        stripped_prefix = True
+        while stripped_prefix:
+            stripped_prefix = False
+            for prefix in prefixes:
+                if key.startswith(prefix):
+                    key = key[len(prefix):]
+                    stripped_prefix = True
+        stripped[key] = value
+    return stripped
+
+
+def load_model_weights(model, filename):
+    """
+    Load the weights saved in filename into the underlying module of the model.
+    """
+    state_dict = torch.load(filename, map_location="cpu")
+    unwrap_model(model).load_state_dict(strip_state_dict_prefix(state_dict))
+
+
+class CheckpointWriter:
+    def __init__(self, max_pending=4) -> None:
+        """
+        Write checkpoints to disk in a background thread. Saves and removals are executed
+        in the order they were requested. A save replaces the pending save of the same file,
+        and the queue is bounded, so the CPU copies waiting for a slow disk don't pile up.
+        :param max_pending: maximum number of queued saves and removals, save and remove block when full
+        """
+        self.queue = queue.Queue(maxsize=max_pending)
+        # one-item list holding the latest state dict of each queued save, shared with its task
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None:
+                    return
+                action, filename, slot = task
+                if action == "save":
+                    with self.lock:
+                        obj, slot[0] = slot[0], None
+                        if self.pending.get(filename) is slot:
+                            del self.pending[filename]
+                    # None if the file was removed after the save was requested
+                    if obj is not None:
+                        atomic_save(obj, filename)
+                elif action == "remove" and os.path.exists(filename):
+                    os.remove(filename)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _check_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError("Checkpoint writer failed") from error
+
+    def save(self, state_dict, filename):
+        """
+        Queue the state dict to be saved. It should be already snapshotted with snapshot_state_dict.
+        :param state_dict: state dict to save
+        :param filename: destination file
+        :return:
+        """
+        self._check_error()
+        with self.lock:
+            slot = self.pending.get(filename)
+            if slot is not None:
+                slot[0] = state_dict
+                return
+            slot = self.pending[filename] = [state_dict]
+        self.queue.put(("save", filename, slot))
+
+    def remove(self, filename):
+        self._check_error()
+        # a pending save of the file is dropped
+        with self.lock:
+            slot = self.pending.pop(filename, None)
+            if slot is not None:
+                slot[0] = None
+        self.queue.put(("remove", filename, None))
+
+    def flush(self):
+        """
+        Wait until all the queued checkpoints are written.
+        """
+        self.queue.join()
+        self._check_error()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self._check_error()
@@ -0,0 +1,34 @@
+import os
+
+import torch
+
+
+def configure_compile_cache(cache_dir):
+    """
+    Keep the compiled artifacts of torch.compile in cache_dir, so later runs with the same model
+    and shapes reuse them instead of compiling from scratch.
+    :param cache_dir: cache directory, the torch default (a temporary directory) is used if None
+    :return:
+    """
+    if cache_dir is not None:
+        cache_dir = os.path.abspath(cache_dir)
+        os.environ["TORCHINDUCTOR_CACHE_DIR"] = cache_dir
+        os.environ["TRITON_CACHE_DIR"] = os.path.join(cache_dir, "triton")
+    # cache the compiled forward and backward graphs on disk
+    import torch._inductor.config as inductor_config
+    inductor_config.fx_graph_cache = True
+    try:
+        import torch._functorch.config as functorch_config
+        functorch_config.enable_autograd_cache = True
+    except (ImportError, AttributeError):
+        pass
+
+
+def compile_model(model, cfg):
+    """
+    Compile the model with the options of the config, or return it unchanged if compilation is disabled.
+    """
+    if not cfg.compile:
+        return model
+    configure_compile_cache(cfg.compile_cache_dir)
+    return torch.compile(model, mode=cfg.compile_mode, dynamic=cfg.compile_dynamic, backend=cfg.compile_backend)
@@ -0,0 +1,105 @@
+import os
+
+import torch
+import torch.distributed as dist
+
+
+def is_distributed() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank() -> int:
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size() -> int:
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process() -> bool:
+    return get_rank() == 0
+
+
+def init_distributed(device):
+    """
+    Initialize the process group when launched with torchrun, e.g.
+    `torchrun --nproc_per_node=4 train.py device=cpu`. NCCL is used for CUDA and gloo otherwise.
+    :param device: device from the config
+    :return: device of this process, with the local rank as index for CUDA
+    """
+    if int(os.environ.get("WORLD_SIZE", 1)) <= 1:
+        return device
+    if torch.device(device).type == "cuda":
+        device = f"cuda:{int(os.environ.get('LOCAL_RANK', 0))}"
+        torch.cuda.set_device(device)
+        backend = "nccl"
+    else:
+        backend = "gloo"
+    if not is_distributed():
+        dist.init_process_group(backend=backend)
+    return device
+
+
+def cleanup_distributed():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def all_reduce_sum(tensor):
+    """
+    Sum the tensor over all the processes, in place.
+    """
+    if is_distributed():
+        dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor
+
+
+def broadcast_object(obj, src=0):
+    """
+    Send a picklable object from the src process to all the others.
+    """
+    if not is_distributed():
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=src)
+    return objects[0]
+
+
+def all_gather_object(obj) -> list:
+    """
+    Gather a picklable object from every process, in all of them.
+    :return: list of the objects, indexed by rank
+    """
+    if not is_distributed():
+        return [obj]
+    objects = [None] * get_world_size()
+    dist.all_gather_object(objects, obj)
+    return objects
+
+
+def broadcast_model(model, src=0):
+    """
+    Copy the parameters and buffers of the model in the src process to all the others.
+    """
+    if not is_distributed():
+        return
+    for tensor in model.state_dict().values():
+        dist.broadcast(tensor, src=src)
+
+
+def unwrap_model(model):
+    """
+    Get the underlying module of a model wrapped with DistributedDataParallel and/or torch.compile.
+    """
+    while True:
+        if isinstance(model, torch.nn.parallel.DistributedDataParallel):
+            model = model.module
+        elif hasattr(model, "_orig_mod"):
+            model = model._orig_mod
+        else:
+            return model
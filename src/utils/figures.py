@@ -0,0 +1,90 @@
+# Matplotlib figures and their rendering. The module does not import torch, so the rendering workers start quickly
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import math
+import multiprocessing
+import os
+
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def get_colors():
+    """
+    CSS4 color names, starting with black, and their RGB values in [0, 255].
+    Built on first use, so importing this module does not import matplotlib.
+    :return: (named_colors, colors) tuple
+    """
+    import matplotlib.colors as mcolors
+
+    named_colors = list(mcolors.CSS4_COLORS.keys())
+    named_colors.remove('black')
+    named_colors.insert(0, 'black')
+    colors = [[int(mcolors.to_rgb(color)[0]*255), int(mcolors.to_rgb(color)[1]*255), int(mcolors.to_rgb(color)[2]*255)]
+              for color in named_colors]
+    return named_colors, colors
+
+
+def plot_image_grid(images, titles=None, n_cols=4):
+    """
+    Figure with the images in a grid, built without pyplot so it can be rendered in any thread or process.
+    :param images: uint8 images with shape (B, H, W, C)
+    :param titles: title of each image
+    :param n_cols: number of columns of the grid
+    :return: matplotlib Figure
+    """
+    from matplotlib.figure import Figure
+
+    n_cols = max(1, min(n_cols, len(images)))
+    n_rows = max(1, math.ceil(len(images) / n_cols))
+    figure = Figure(figsize=(2.5 * n_cols, 2.5 * n_rows))
+    axes = np.atleast_1d(figure.subplots(n_rows, n_cols, squeeze=False)).ravel()
+    for i, ax in enumerate(axes):
+        ax.axis("off")
+        if i < len(images):
+            ax.imshow(images[i])
+            if titles is not None:
+                ax.set_title(titles[i], fontsize=9)
+    figure.tight_layout()
+    return figure
+
+
+def render_figure(render_fn, args, filename):
+    """
+    Build the figure with render_fn(*args) and save it as PNG.
+    """
+    render_fn(*args).savefig(filename)
+    return filename
+
+
+def render_figures(tasks, filenames, n_workers=4, min_figures_per_worker=8):
+    """
+    Render and save figures in a pool of processes, PNG encoding is CPU bound. Starting a worker costs about
+    as much as rendering a few figures, so a few figures are rendered in this process.
+    :param tasks: dictionary of (render_fn, args) tuples, render_fn should be a module level function
+    returning a matplotlib Figure and args should be picklable, e.g. numpy arrays
+    :param filenames: destination file of each task
+    :param n_workers: maximum number of processes, the figures are rendered in this process if 1 or less
+    :param min_figures_per_worker: minimum number of figures rendered by each worker
+    :return:
+    """
+    n_cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    n_workers = min(n_workers, len(tasks) // min_figures_per_worker, n_cores or 1)
+    if n_workers <= 1:
+        for name, (render_fn, args) in tasks.items():
+            render_figure(render_fn, args, filenames[name])
+        return
+    # the training process runs threads (loader, checkpoint writer...), forking it could deadlock the workers.
+    # The fork server imports the main module and matplotlib once and is reused by the next pools
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["__main__", "matplotlib.figure", "matplotlib.backends.backend_agg"])
+    else:
+        context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(n_workers, mp_context=context) as executor:
+        futures = [
+            executor.submit(render_figure, render_fn, args, filenames[name])
+            for name, (render_fn, args) in tasks.items()
+        ]
+        for future in futures:
+            future.result()
@@ -1,9 +1,18 @@
+from collections import defaultdict
+from collections.abc import Mapping
 from yaml.loader import SafeLoader
+import copy
+import dataclasses
+import os
+import queue
+import threading
 import yaml
 import torch
 import random
 import numpy as np
 
+from .distributed import get_rank
+
 
 def load_yaml_config(path):
     with open(path) as f:
@@ -11,30 +20,200 @@ def load_yaml_config(path):
     return data
 
 
-def load_batch_to_device(batch, device):
+def apply_to_collection(data, fn):
     """
-    Load batch to device recursively in case it finds a list or dictionary in such batch of data,
+    Apply fn to every tensor in data recursively, keeping the container types a collate_fn can return:
+    mappings, lists, tuples, namedtuples and dataclasses.
     """
-    if isinstance(batch, torch.Tensor):
-        return batch.to(device)
-    elif isinstance(batch, dict):
-        new_batch = {}
-        for key, value in batch.items():
-            new_batch[key] = load_batch_to_device(value, device)
-        return new_batch
-    elif isinstance(batch, list):
-        new_batch = []
-        for item in batch:
-            new_batch.append(load_batch_to_device(item, device))
-        return new_batch
+    if isinstance(data, torch.Tensor):
+        return fn(data)
+    elif isinstance(data, Mapping):
+        mapped = {key: apply_to_collection(value, fn) for key, value in data.items()}
+        if isinstance(data, defaultdict):
+            return defaultdict(data.default_factory, mapped)
+        try:
+            return type(data)(mapped)
+        except TypeError:
+            return mapped
+    elif isinstance(data, tuple) and hasattr(data, "_fields"):
+        # namedtuple
+        return type(data)(*(apply_to_collection(item, fn) for item in data))
+    elif isinstance(data, (list, tuple)):
+        return type(data)(apply_to_collection(item, fn) for item in data)
+    elif dataclasses.is_dataclass(data) and not isinstance(data, type):
+        # set the fields on a copy to skip __init__ and __post_init__, also works with frozen dataclasses
+        new_data = copy.copy(data)
+        for field in dataclasses.fields(data):
+            object.__setattr__(new_data, field.name, apply_to_collection(getattr(data, field.name), fn))
+        return new_data
     else:
-        return batch
+        return data
+
+
+def load_batch_to_device(batch, device, non_blocking=False):
+    """
+    Load batch to device recursively in case it finds a container in such batch of data.
+    """
+    return apply_to_collection(batch, lambda tensor: tensor.to(device, non_blocking=non_blocking))
+
+
+def pin_batch(batch):
+    """
+    Copy the tensors of the batch to page-locked memory, so they can be copied asynchronously to the device.
+    """
+    return apply_to_collection(batch, lambda tensor: tensor if tensor.is_pinned() else tensor.pin_memory())
+
+
+class BatchPrefetcher:
+    def __init__(self, loader, device, queue_size=2, prefetch=True):
+        """
+        Iterate over the loader while the next batch is loaded to the device, overlapping
+        the copy with the computation of the current step.
+        On CUDA the batches are copied from pinned memory with non_blocking copies on a side stream,
+        on other devices they are loaded in a background thread.
+        :param loader: dataloader to iterate over
+        :param device: device to load the batches to
+        :param queue_size: maximum number of batches loaded ahead when using the background thread
+        :param prefetch: whether to load the next batch ahead, otherwise each batch is loaded when requested
+        """
+        self.loader = loader
+        self.device = torch.device(device)
+        self.queue_size = queue_size
+        self.prefetch = prefetch
+
+    def __len__(self) -> int:
+        return len(self.loader)
+
+    def __iter__(self):
+        if not self.prefetch:
+            return (load_batch_to_device(batch, self.device) for batch in self.loader)
+        if self.device.type == "cuda":
+            return self._stream_iter()
+        return self._thread_iter()
+
+    def _stream_iter(self):
+        stream = torch.cuda.Stream(self.device)
+
+        def stage(batch):
+            with torch.cuda.stream(stream):
+                return load_batch_to_device(pin_batch(batch), self.device, non_blocking=True)
+
+        def ready(batch):
+            # wait for the copy and tell the allocator the tensors are used by the compute stream
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_stream(stream)
+            apply_to_collection(batch, lambda tensor: tensor.record_stream(current_stream))
+            return batch
+
+        loader_iter = iter(self.loader)
+        try:
+            next_batch = stage(next(loader_iter))
+        except StopIteration:
+            return
+        for batch in loader_iter:
+            current_batch = ready(next_batch)
+            next_batch = stage(batch)
+            yield current_batch
+        yield ready(next_batch)
+
+    def _thread_iter(self):
+        batches = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def load():
+            try:
+                for batch in self.loader:
+                    put(("batch", load_batch_to_device(batch, self.device)))
+                    if stop.is_set():
+                        return
+                put(("done", None))
+            except Exception as e:
+                put(("error", e))
+
+        thread = threading.Thread(target=load, daemon=True)
+        thread.start()
+        try:
+            while True:
+                kind, item = batches.get()
+                if kind == "batch":
+                    yield item
+                elif kind == "error":
+                    raise item
+                else:
+                    return
+        finally:
+            # stop the loading thread if the iteration is interrupted
+            stop.set()
+            thread.join()
+
+
+def get_output_dir():
+    """
+    Output directory of the run: the Hydra output directory when running inside a Hydra app,
+    the working directory otherwise (e.g. in scripts and benchmarks).
+    """
+    from hydra.core.hydra_config import HydraConfig
+
+    if HydraConfig.initialized():
+        return HydraConfig.get().runtime.output_dir
+    return os.getcwd()
 
 
 def set_random_seed(seed):
+    # each process gets a different seed, so random augmentations differ between ranks
+    seed = seed + get_rank()
     torch.manual_seed(seed)
     torch.cuda.manual_seed(seed)
     torch.backends.cudnn.deterministic = True
     torch.backends.cudnn.benchmark = False
     np.random.seed(seed)
     random.seed(seed)
+
+
+def get_rng_state() -> dict:
+    """
+    State of all the random generators of the process, to be restored with set_rng_state.
+    """
+    return {
+        "torch": torch.get_rng_state(),
+        "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+        "numpy": np.random.get_state(),
+        "python": random.getstate(),
+    }
+
+
+def set_rng_state(state):
+    torch.set_rng_state(state["torch"])
+    if state["cuda"] and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+    np.random.set_state(state["numpy"])
+    random.setstate(state["python"])
+
+
+def get_batch_size(batch) -> int:
+    """
+    Number of samples in the batch, taken from the first tensor found in it.
+    """
+    if isinstance(batch, torch.Tensor):
+        return batch.shape[0] if batch.dim() > 0 else 1
+    elif isinstance(batch, Mapping):
+        items = batch.values()
+    elif isinstance(batch, (list, tuple)):
+        items = batch
+    elif dataclasses.is_dataclass(batch) and not isinstance(batch, type):
+        items = [getattr(batch, field.name) for field in dataclasses.fields(batch)]
+    else:
+        return 0
+    for item in items:
+        batch_size = get_batch_size(item)
+        if batch_size > 0:
+            return batch_size
+    return 0
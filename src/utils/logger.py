@@ -1,63 +1,94 @@
-import wandb
 import time
-from omegaconf import OmegaConf
-import hydra
 import os
-import csv
+
+from .distributed import is_main_process
+from .io import get_output_dir
+from .figures import render_figures
+from .sinks import MetricsSink, BackgroundUploader
 
 
 class Logger:
     def __init__(self, cfg):
-        self.results_dir = hydra.core.hydra_config.HydraConfig.get().runtime.output_dir
+        self.results_dir = get_output_dir()
         self.start_time = time.time()
         self.cfg = cfg
         self.project_name = self.cfg.project_name
         self.entity = self.cfg.entity
+        # only the main process logs when training with multiple processes
+        self.enabled = is_main_process()
+        if not self.enabled:
+            return
+        # metrics are buffered in memory and written periodically
+        self.sink = MetricsSink(
+            self.results_dir,
+            metrics_format=self.cfg.metrics_format,
+            flush_interval=self.cfg.metrics_flush_interval
+        )
         if self.project_name is not None:
+            # wandb is slow to import, it is only imported when the run is logged to it
+            import wandb
+            from omegaconf import OmegaConf
+
             cfg_dict = OmegaConf.to_object(cfg)
             self.run = wandb.init(entity=self.entity, project=self.project_name, config=cfg_dict)
+            # wandb uploads run in a background thread
+            self.uploader = BackgroundUploader(max_queue_size=self.cfg.upload_queue_size)
 
     def upload_metrics(self, logs):
+        if not self.enabled:
+            return
         # save metrics locally
         self.save_metrics(logs)
 
         # log to wandb
         if self.project_name is not None:
-            wandb.log(logs)
+            self.uploader.submit(self.run.log, dict(logs))
 
     def upload_media(self, figures):
+        if not self.enabled:
+            return
         # save metrics locally
-        self.save_media(figures)
+        filenames = self.save_media(figures)
 
-        # log to wandb
-        if self.project_name is not None:
-            wandb_logs = {}
-            for figure_name, figure in figures.items():
-                wandb_logs["media/"+figure_name] = wandb.Image(figure)
-            wandb.log(wandb_logs)
+        # log to wandb, from the saved images so the figures are not touched by the upload thread
+        if self.project_name is not None and filenames:
+            self.uploader.submit(self.log_images, filenames)
+
+    def log_images(self, filenames):
+        import wandb
+
+        wandb_logs = {}
+        for figure_name, filename in filenames.items():
+            wandb_logs["media/"+figure_name] = wandb.Image(filename)
+        self.run.log(wandb_logs)
 
     def save_media(self, figures):
+        """
+        Save the figures as PNG. Figures given as (render_fn, args) tuples are rendered in a pool of processes,
+        matplotlib Figures are saved in this process. At most max_media_figures figures are saved.
+        :return: dictionary with the filename of each figure
+        """
         figs_dir = os.path.join(self.results_dir, 'figs')
         os.makedirs(figs_dir, exist_ok=True)
+        figures = dict(list(figures.items())[:self.cfg.max_media_figures])
+        filenames = {figure_name: os.path.join(figs_dir, figure_name + ".png") for figure_name in figures}
+        tasks = {}
         for figure_name, figure in figures.items():
-            fig_filename = os.path.join(figs_dir, figure_name + ".png")
-            figure.savefig(fig_filename)
+            if isinstance(figure, tuple):
+                tasks[figure_name] = figure
+            else:
+                figure.savefig(filenames[figure_name])
+        render_figures(tasks, filenames, n_workers=self.cfg.media_workers)
+        return filenames
 
     def save_metrics(self, logs):
-        csv_filename = os.path.join(self.results_dir, "metrics.csv")
-
-        if not os.path.exists(csv_filename):
-            # If the file doesn't exist, write the keys to the CSV file
-            with open(csv_filename, 'w', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(list(logs.keys()))
-
-        # Write the values corresponding to each key
-        with open(csv_filename, 'a', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=list(logs.keys()))
-            writer.writerow(logs)
+        self.sink.write(logs)
 
     def finish(self):
+        if not self.enabled:
+            return
+        self.sink.close()
         print(f"Experiment finished in {time.time() - self.start_time} seconds.")
         if self.project_name is not None:
+            self.uploader.close()
             self.run.finish()
@@ -0,0 +1,223 @@
+from collections import defaultdict
+from fnmatch import fnmatchcase
+import sys
+
+import torch
+import torch.nn as nn
+
+
+def remove_wrapper_prefix(module, state_dict, prefix, local_metadata) -> None:
+    # state dict post hook, the keys of the wrapped module are saved without "module."
+    for key in [key for key in state_dict if key.startswith(f"{prefix}module.")]:
+        state_dict[prefix + key[len(prefix) + len("module."):]] = state_dict.pop(key)
+
+
+def add_wrapper_prefix(module, state_dict, prefix, *args) -> None:
+    # load state dict pre hook, the inverse of remove_wrapper_prefix
+    for key in [key for key in state_dict if key.startswith(prefix)]:
+        state_dict[f"{prefix}module.{key[len(prefix):]}"] = state_dict.pop(key)
+
+
+class CheckpointWrapper(nn.Module):
+    def __init__(self, module):
+        """
+        Run the module with activation checkpointing while training with gradients, and as is otherwise.
+        The state dict keys are the ones of the wrapped module, and its attributes are reachable through the wrapper.
+        :param module: module to wrap
+        """
+        super().__init__()
+        self.module = module
+        self.register_state_dict_post_hook(remove_wrapper_prefix)
+        self.register_load_state_dict_pre_hook(add_wrapper_prefix)
+
+    def forward(self, *args, **kwargs):
+        if self.training and torch.is_grad_enabled():
+            from torch.utils.checkpoint import checkpoint
+
+            return checkpoint(self.module, *args, use_reentrant=False, **kwargs)
+        return self.module(*args, **kwargs)
+
+    def __getattr__(self, name):
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            if name == "module":
+                raise
+            return getattr(self.module, name)
+
+
+def apply_activation_checkpointing(model, patterns) -> list:
+    """
+    Recompute the activations of the selected submodules during the backward pass instead of keeping them
+    in memory. The modules are replaced in place by a CheckpointWrapper, which keeps the state dict keys.
+    :param model: model to modify
+    :param patterns: names of the submodules, as given by model.named_modules, or glob patterns like "encoder.layers.*"
+    :return: names of the checkpointed submodules
+    """
+    names = []
+    for pattern in patterns:
+        matches = [name for name, _ in model.named_modules() if name and fnmatchcase(name, pattern)]
+        if not matches:
+            raise ValueError(f"No submodule of the model matches {pattern}")
+        names.extend(name for name in matches if name not in names)
+    # the submodules of a checkpointed module are already recomputed
+    names = [name for name in names if not any(name.startswith(f"{other}.") for other in names)]
+
+    for name in names:
+        parent_name, _, child_name = name.rpartition(".")
+        parent = model.get_submodule(parent_name)
+        setattr(parent, child_name, CheckpointWrapper(getattr(parent, child_name)))
+    return names
+
+
+class OptimizerStateOffloader:
+    def __init__(self, optimizer, device, enabled: bool = False) -> None:
+        """
+        Keep the optimizer state (e.g. the Adam moments) in host memory between the optimizer steps, so it
+        does not add to the peak memory of the forward and backward passes. Does nothing on the CPU or when disabled.
+        :param optimizer: optimizer of the training
+        :param device: device of the model parameters
+        :param enabled: whether to offload the state
+        """
+        self.optimizer = optimizer
+        self.device = torch.device(device)
+        self.enabled = enabled and self.device.type != "cpu"
+        # the state is copied into host buffers allocated once, pinned on CUDA so the copies are asynchronous
+        self.pin_memory = self.enabled and self.device.type == "cuda"
+        self.buffers = {}
+        self.event = None
+
+    def load(self) -> None:
+        """
+        Move the state to the device, before the optimizer step.
+        """
+        if self.enabled:
+            self.synchronize()
+            self.move_state(lambda param, key, t: t.to(self.device, non_blocking=True))
+
+    def offload(self) -> None:
+        """
+        Move the state to the host, after the optimizer step. The copies may still be running when it returns,
+        call synchronize before reading the state on the host.
+        """
+        if self.enabled:
+            self.move_state(self.copy_to_buffer)
+            if self.pin_memory:
+                self.event = torch.cuda.Event()
+                self.event.record(torch.cuda.current_stream(self.device))
+
+    def synchronize(self) -> None:
+        """
+        Wait for the copies of the last offload to finish.
+        """
+        if self.event is not None:
+            self.event.synchronize()
+            self.event = None
+
+    def copy_to_buffer(self, param, key, value) -> torch.Tensor:
+        buffers = self.buffers.setdefault(param, {})
+        buffer = buffers.get(key)
+        if buffer is value:
+            return buffer
+        # a loaded state dict may change the shape or the type of the state
+        if buffer is None or buffer.shape != value.shape or buffer.dtype != value.dtype:
+            buffer = buffers[key] = torch.empty_like(value, device="cpu", pin_memory=self.pin_memory)
+        return buffer.copy_(value, non_blocking=self.pin_memory)
+
+    def move_state(self, fn) -> None:
+        for param, state in self.optimizer.state.items():
+            for key, value in state.items():
+                # scalar steps stay where the optimizer keeps them
+                if isinstance(value, torch.Tensor) and value.dim() > 0:
+                    state[key] = fn(param, key, value)
+
+
+def is_out_of_memory(error) -> bool:
+    """
+    Whether an exception is the device running out of memory, including the allocation failures
+    raised by cuDNN and cuBLAS as a plain RuntimeError.
+    """
+    if isinstance(error, torch.OutOfMemoryError):
+        return True
+    message = str(error)
+    return isinstance(error, RuntimeError) and (
+        "out of memory" in message or "CUDNN_STATUS_ALLOC_FAILED" in message or "CUBLAS_STATUS_ALLOC_FAILED" in message
+    )
+
+
+def reset_peak_rss() -> None:
+    """
+    Reset the peak resident set size of the process, only supported on Linux.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def get_peak_rss() -> float:
+    """
+    Peak resident set size of the process since the last reset_peak_rss, or since its start
+    where the peak can't be reset, in MB.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+class MemoryMonitor:
+    def __init__(self, enabled: bool = False, device: str = "cpu") -> None:
+        """
+        Record the peak host (RSS) and CUDA memory of each phase of the training steps over an epoch.
+        Does nothing when disabled.
+        :param enabled: whether to record the memory
+        :param device: device of the training, the CUDA memory is only recorded on CUDA devices
+        """
+        self.enabled = enabled
+        self.device = torch.device(device)
+        self.cuda = enabled and self.device.type == "cuda"
+        self.reset()
+
+    def reset(self) -> None:
+        self.peak_rss = defaultdict(float)
+        self.peak_cuda = defaultdict(float)
+        self.reset_peaks()
+
+    def reset_peaks(self) -> None:
+        if not self.enabled:
+            return
+        reset_peak_rss()
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats(self.device)
+
+    def mark(self, phase: str) -> None:
+        """
+        Attribute the peak memory since the previous mark to the given phase.
+        :param phase: name of the phase that just finished
+        """
+        if not self.enabled:
+            return
+        self.peak_rss[phase] = max(self.peak_rss[phase], get_peak_rss())
+        if self.cuda:
+            peak = torch.cuda.max_memory_allocated(self.device) / 2 ** 20
+            self.peak_cuda[phase] = max(self.peak_cuda[phase], peak)
+        self.reset_peaks()
+
+    def get_metrics(self) -> dict:
+        """
+        Get the peak memory of each phase in MB since the last reset.
+        :return: dictionary of metrics, empty if disabled
+        """
+        metrics = {f"peak_rss_{phase}_mb": peak for phase, peak in self.peak_rss.items()}
+        metrics.update({f"peak_cuda_{phase}_mb": peak for phase, peak in self.peak_cuda.items()})
+        return metrics
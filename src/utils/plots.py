@@ -1,26 +1,35 @@
-import numpy as np
-import matplotlib.colors as mcolors
+import torch
 
+from .figures import get_colors, plot_image_grid, render_figure, render_figures
 
-named_colors = list(mcolors.CSS4_COLORS.keys())
-named_colors.remove('black')
-named_colors.insert(0, 'black')
-colors = [[int(mcolors.to_rgb(color)[0]*255), int(mcolors.to_rgb(color)[1]*255), int(mcolors.to_rgb(color)[2]*255)]
-          for color in named_colors]
+
+def __getattr__(name):
+    # named_colors and colors used to be module constants
+    if name == "named_colors":
+        return get_colors()[0]
+    elif name == "colors":
+        return get_colors()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def denormalize_to_uint8(x, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225), max_pixel_value=255.0):
+    """
+    Revert A.Normalize on a batch of images, on its own device.
+    :param x: normalized images with shape (B, C, H, W)
+    :return: uint8 images with shape (B, H, W, C)
+    """
+    mean = torch.tensor(mean, device=x.device)[:, None, None]
+    std = torch.tensor(std, device=x.device)[:, None, None]
+    images = (x.float() * std + mean) * max_pixel_value
+    return images.clamp(0, 255).to(torch.uint8).permute(0, 2, 3, 1)
 
 
 def norm_tensor_to_original_im(norm_tensor):
-    mean = np.array([0.485, 0.456, 0.406])
-    std = np.array([0.229, 0.224, 0.225])
-    norm_array = norm_tensor.detach().cpu().numpy().transpose((1, 2, 0))
-    reverted_img = (norm_array * std + mean) * 255
-    im = reverted_img.astype("uint8")
-    return im
+    return denormalize_to_uint8(norm_tensor.detach()[None])[0].cpu().numpy()
 
 
 def tensors_to_images(tensor_ims):
-    ims = []
-    for tensor_im in tensor_ims:
-        im = norm_tensor_to_original_im(tensor_im)
-        ims.append(im)
-    return ims
+    # a single transfer to the host for all the images
+    if not isinstance(tensor_ims, torch.Tensor):
+        tensor_ims = torch.stack(list(tensor_ims))
+    return list(denormalize_to_uint8(tensor_ims.detach()).cpu().numpy())
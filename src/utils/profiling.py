@@ -0,0 +1,100 @@
+import os
+import time
+from collections import defaultdict
+
+import torch
+
+from .io import get_batch_size
+
+
+class StepTimer:
+    def __init__(self, enabled: bool = False, device: str = "cpu") -> None:
+        """
+        Accumulate the wall time of each phase of the training steps and the throughput over an epoch.
+        Does nothing when disabled.
+        :param enabled: whether to record the times
+        :param device: device of the training, CUDA is synchronized at each mark to time the kernels
+        """
+        self.enabled = enabled
+        self.device = torch.device(device)
+        self.synchronize = enabled and self.device.type == "cuda"
+        self.reset()
+
+    def reset(self) -> None:
+        self.times = defaultdict(float)
+        self.n_steps = 0
+        self.n_samples = 0
+        self.start_time = self.last_time = time.perf_counter()
+
+    def mark(self, phase: str) -> None:
+        """
+        Attribute the time elapsed since the previous mark to the given phase.
+        :param phase: name of the phase that just finished
+        :return:
+        """
+        if not self.enabled:
+            return
+        if self.synchronize:
+            torch.cuda.synchronize(self.device)
+        now = time.perf_counter()
+        self.times[phase] += now - self.last_time
+        self.last_time = now
+
+    def step(self, batch) -> None:
+        if not self.enabled:
+            return
+        self.n_steps += 1
+        self.n_samples += get_batch_size(batch)
+
+    def get_metrics(self) -> dict:
+        """
+        Get the total time of each phase in seconds and the samples/sec since the last reset.
+        :return: dictionary of metrics, empty if disabled
+        """
+        if not self.enabled:
+            return {}
+        elapsed = time.perf_counter() - self.start_time
+        metrics = {f"time_{phase}": phase_time for phase, phase_time in self.times.items()}
+        metrics["samples_per_sec"] = self.n_samples / elapsed if elapsed > 0 else 0.0
+        return metrics
+
+
+class NullProfiler:
+    """
+    Stand-in for torch.profiler.profile when profiling is disabled.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def step(self):
+        pass
+
+
+def build_profiler(cfg, output_dir):
+    """
+    Build a torch profiler that traces the steps [cfg.profiler_start_step, cfg.profiler_start_step + cfg.profiler_steps)
+    with memory profiling, and saves the trace to output_dir/profiler.
+    :param cfg: config
+    :param output_dir: output directory of the run
+    :return: profiler context manager, stepped once per training step
+    """
+    if cfg.profiler_steps <= 0:
+        return NullProfiler()
+
+    from torch.profiler import profile, schedule, tensorboard_trace_handler, ProfilerActivity
+
+    activities = [ProfilerActivity.CPU]
+    if torch.device(cfg.device).type == "cuda":
+        activities.append(ProfilerActivity.CUDA)
+    # one warmup step right before the traced window, if there is room for it
+    warmup = min(1, cfg.profiler_start_step)
+    return profile(
+        activities=activities,
+        schedule=schedule(wait=cfg.profiler_start_step - warmup, warmup=warmup, active=cfg.profiler_steps, repeat=1),
+        on_trace_ready=tensorboard_trace_handler(os.path.join(output_dir, "profiler")),
+        record_shapes=True,
+        profile_memory=True,
+    )
@@ -0,0 +1,79 @@
+from io import BytesIO
+import copy
+import time
+import warnings
+
+import torch
+
+
+def quantize_dynamic_int8(model):
+    """
+    Quantize the weights of the linear and recurrent layers to int8, their activations are quantized
+    on the fly. It needs no calibration and suits models dominated by linear layers.
+    :param model: float model, it is not modified
+    :return: quantized copy of the model, for CPU inference
+    """
+    from torch.ao.quantization import quantize_dynamic
+
+    model = copy.deepcopy(model).cpu().eval()
+    return quantize_dynamic(model, {torch.nn.Linear, torch.nn.LSTM, torch.nn.GRU}, dtype=torch.qint8)
+
+
+@torch.no_grad()
+def quantize_static_int8(model, calibration_inputs, backend="x86"):
+    """
+    Quantize the weights and activations to int8 with FX graph mode quantization. The activation ranges
+    are observed over the calibration inputs. The model should be symbolically traceable.
+    :param model: float model, it is not modified
+    :param calibration_inputs: list of input batches, representative of the inference data
+    :param backend: quantized engine the model will run on, "x86", "fbgemm", "qnnpack" or "onednn"
+    :return: quantized copy of the model, for CPU inference
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    torch.backends.quantized.engine = backend
+    model = copy.deepcopy(model).cpu().eval()
+    prepared = prepare_fx(model, get_default_qconfig_mapping(backend), example_inputs=(calibration_inputs[0],))
+    for x in calibration_inputs:
+        prepared(x)
+    return convert_fx(prepared)
+
+
+def export_torchscript(model, example_input, filename):
+    """
+    Trace the model and save it as TorchScript, which can be loaded without the model code.
+    :return: whether the model could be exported
+    """
+    try:
+        with torch.no_grad():
+            traced = torch.jit.trace(model, example_input)
+        torch.jit.save(traced, filename)
+        return True
+    except Exception as e:
+        warnings.warn(f"The model could not be exported to {filename}: {e}")
+        return False
+
+
+def get_model_size(model) -> float:
+    """
+    Size of the serialized state dict of the model, in MB.
+    """
+    buffer = BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes / 2 ** 20
+
+
+@torch.inference_mode()
+def measure_latency(model, x, n_iters=50, n_warmup=5) -> float:
+    """
+    Median wall time of the forward pass of the model on the batch x, in ms.
+    """
+    for _ in range(n_warmup):
+        model(x)
+    times = []
+    for _ in range(n_iters):
+        start_time = time.perf_counter()
+        model(x)
+        times.append(time.perf_counter() - start_time)
+    return sorted(times)[len(times) // 2] * 1000
@@ -0,0 +1,163 @@
+import csv
+import json
+import os
+import queue
+import threading
+import time
+import warnings
+
+
+class CSVWriter:
+    def __init__(self, results_dir):
+        """
+        Write the records to metrics.csv. When records bring new keys the file is rewritten
+        once with the extended header, so all the rows stay aligned with their columns.
+        """
+        self.filename = os.path.join(results_dir, "metrics.csv")
+        self.columns = []
+        if os.path.exists(self.filename):
+            with open(self.filename, newline="") as f:
+                self.columns = next(csv.reader(f), [])
+
+    def write(self, records):
+        new_columns = [key for record in records for key in record if key not in self.columns]
+        if new_columns:
+            self.columns += list(dict.fromkeys(new_columns))
+            self.rewrite()
+        with open(self.filename, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=self.columns)
+            writer.writerows(records)
+
+    def rewrite(self):
+        rows = []
+        if os.path.exists(self.filename):
+            with open(self.filename, newline="") as f:
+                rows = list(csv.DictReader(f))
+        tmp_filename = f"{self.filename}.tmp"
+        with open(tmp_filename, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=self.columns)
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(tmp_filename, self.filename)
+
+
+class JSONLWriter:
+    def __init__(self, results_dir):
+        """
+        Append the records to metrics.jsonl, one JSON object per line.
+        """
+        self.filename = os.path.join(results_dir, "metrics.jsonl")
+
+    def write(self, records):
+        with open(self.filename, "a") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+
+
+class ParquetWriter:
+    def __init__(self, results_dir):
+        """
+        Write each flush as a new part file in the metrics/ folder. The parts can be read together,
+        with their schemas unified, with pyarrow.dataset or pandas.read_parquet.
+        """
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("pyarrow is required to save the metrics in parquet format: pip install pyarrow")
+        self.metrics_dir = os.path.join(results_dir, "metrics")
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        self.n_parts = len([name for name in os.listdir(self.metrics_dir) if name.endswith(".parquet")])
+
+    def write(self, records):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pylist(records)
+        pq.write_table(table, os.path.join(self.metrics_dir, f"part-{self.n_parts:05d}.parquet"))
+        self.n_parts += 1
+
+
+WRITERS = {
+    "csv": CSVWriter,
+    "jsonl": JSONLWriter,
+    "parquet": ParquetWriter,
+}
+
+
+class MetricsSink:
+    def __init__(self, results_dir, metrics_format="csv", flush_interval=30.0):
+        """
+        Buffer the metric records in memory and write them to disk with the first record written at least
+        flush_interval seconds after the previous write, and when closed. There is no timer, so a record
+        stays in memory until the next one if none follows. Records can have different keys.
+        :param results_dir: directory where the metrics are saved
+        :param metrics_format: "csv", "jsonl" or "parquet"
+        :param flush_interval: minimum time in seconds between two writes, 0 to write every record
+        """
+        if metrics_format not in WRITERS:
+            raise ValueError(f"Unknown metrics format {metrics_format}, expected one of {list(WRITERS)}")
+        self.writer = WRITERS[metrics_format](results_dir)
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def write(self, record: dict):
+        self.buffer.append(dict(record))
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.writer.write(self.buffer)
+            self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+
+
+class BackgroundUploader:
+    def __init__(self, max_queue_size=1000):
+        """
+        Run upload calls in a background thread, in the order they were submitted. The queue is bounded
+        and uploads are dropped when it is full, so a slow network never blocks the training.
+        :param max_queue_size: maximum number of pending uploads
+        """
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.n_dropped = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                return
+            fn, args = task
+            try:
+                fn(*args)
+            except Exception as e:
+                warnings.warn(f"Upload failed: {e}")
+
+    def submit(self, fn, *args) -> bool:
+        """
+        Queue fn(*args) to be run in the background.
+        :return: whether the upload was queued, False if it was dropped because the queue is full
+        """
+        try:
+            self.queue.put_nowait((fn, args))
+            return True
+        except queue.Full:
+            if self.n_dropped == 0:
+                warnings.warn("Upload queue is full, uploads are being dropped.")
+            self.n_dropped += 1
+            return False
+
+    def close(self):
+        """
+        Wait for the pending uploads to finish.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        if self.n_dropped > 0:
+            print(f"{self.n_dropped} uploads were dropped because the upload queue was full.")
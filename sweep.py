@@ -0,0 +1,130 @@
+# Hyperparameter search with Optuna. Trials run in parallel processes and report the monitored
+# validation metric every epoch, so the pruner can stop hopeless trials early.
+#   python sweep.py sweep_trials=40 sweep_jobs=4 sweep_pruner=hyperband n_epochs=20
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import optuna
+import torch
+
+from train import build_datasets, train
+from src.datasets import build_dataloader, build_size_index
+from src.utils import get_output_dir
+
+from cfgs.config import CFG
+from omegaconf import DictConfig, OmegaConf
+import hydra
+
+
+def suggest(trial, cfg):
+    """
+    Define the search space here: sample the hyperparameters of the trial and set them in the config.
+    """
+    cfg.lr = trial.suggest_float("lr", 1e-5, 1e-2, log=True)
+    cfg.max_lr = trial.suggest_float("max_lr", 1e-4, 1e-1, log=True)
+    return cfg
+
+
+def get_storage(output_dir):
+    # sqlite database shared by the trial processes, waiting for the locks held by the others
+    url = f"sqlite:///{os.path.join(output_dir, 'optuna.db')}"
+    return optuna.storages.RDBStorage(url, engine_kwargs={"connect_args": {"timeout": 60}})
+
+
+def get_steps_per_epoch(cfg):
+    """
+    Number of optimizer steps of a training epoch, as counted by the trainer.
+    """
+    train_dataset, _ = build_datasets(cfg)
+    sizes = None
+    if cfg.max_batch_tokens is not None:
+        sizes = build_size_index(train_dataset, cfg.size_index_path, num_workers=cfg.num_workers)
+    train_dl = build_dataloader(train_dataset, cfg, train=True, sizes=sizes)
+    return math.ceil(len(train_dl) / cfg.accumulate_grad_batches)
+
+
+def get_pruner(cfg, steps_per_epoch=1):
+    """
+    :param steps_per_epoch: optimizer steps per epoch, the trials report the optimizer step instead of the epoch
+    when validating every val_every_n_steps, so the pruner resources are converted to steps
+    """
+    if cfg.val_every_n_steps > 0:
+        warmup_steps, min_resource = cfg.sweep_warmup_epochs * steps_per_epoch, cfg.val_every_n_steps
+        max_resource = cfg.n_epochs * steps_per_epoch
+    else:
+        warmup_steps, min_resource, max_resource = cfg.sweep_warmup_epochs, 1, cfg.n_epochs
+    if cfg.sweep_pruner == "median":
+        return optuna.pruners.MedianPruner(n_warmup_steps=warmup_steps)
+    elif cfg.sweep_pruner == "hyperband":
+        return optuna.pruners.HyperbandPruner(min_resource=min_resource, max_resource=max_resource)
+    elif cfg.sweep_pruner == "none":
+        return optuna.pruners.NopPruner()
+    raise ValueError(f"Unknown pruner {cfg.sweep_pruner}, expected one of 'median', 'hyperband' or 'none'")
+
+
+def run_trials(cfg_dict, output_dir, n_threads, steps_per_epoch):
+    """
+    Run trials of the study in this process until the total number of trials is reached.
+    """
+    torch.set_num_threads(n_threads)
+    cfg = OmegaConf.merge(OmegaConf.structured(CFG), cfg_dict)
+    pruner = get_pruner(cfg, steps_per_epoch)
+    study = optuna.load_study(study_name="sweep", storage=get_storage(output_dir), pruner=pruner)
+
+    def objective(trial):
+        trial_cfg = suggest(trial, cfg.copy())
+        # Logger and ModelCheckpoint save to the working directory outside a Hydra app
+        trial_dir = os.path.join(output_dir, f"trial_{trial.number}")
+        os.makedirs(trial_dir, exist_ok=True)
+        os.chdir(trial_dir)
+        return train(trial_cfg, trial=trial)
+
+    # counting the running trials too, so the processes stop as soon as all the trials have started
+    study.optimize(objective, callbacks=[optuna.study.MaxTrialsCallback(cfg.sweep_trials, states=None)])
+
+
+@hydra.main(version_base=None, config_path="cfgs", config_name="config")
+def main(cfg: DictConfig):
+    default_cfg = OmegaConf.structured(CFG)
+    cfg = OmegaConf.merge(default_cfg, cfg)
+    output_dir = get_output_dir()
+    # the trials run in their own directories
+    cfg.data_path = os.path.abspath(cfg.data_path)
+    if cfg.cache_dir is not None:
+        cfg.cache_dir = os.path.abspath(cfg.cache_dir)
+        # build the preprocessed dataset cache once, the trials share it read-only
+        build_datasets(cfg)
+    if cfg.size_index_path is not None:
+        cfg.size_index_path = os.path.abspath(cfg.size_index_path)
+    steps_per_epoch = get_steps_per_epoch(cfg) if cfg.val_every_n_steps > 0 else 1
+
+    n_cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    n_threads = cfg.sweep_threads_per_trial
+    n_jobs = cfg.sweep_jobs if cfg.sweep_jobs > 0 else max(1, n_cores // n_threads)
+    print(f"Running {cfg.sweep_trials} trials, {n_jobs} in parallel with {n_threads} threads each.")
+
+    study = optuna.create_study(
+        study_name="sweep",
+        storage=get_storage(output_dir),
+        direction="maximize" if cfg.max_mode else "minimize",
+        pruner=get_pruner(cfg, steps_per_epoch),
+    )
+
+    # the thread budget is inherited by the trial processes before they import torch
+    os.environ["OMP_NUM_THREADS"] = str(n_threads)
+    cfg_dict = OmegaConf.to_container(cfg)
+    with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(run_trials, cfg_dict, output_dir, n_threads, steps_per_epoch) for _ in range(n_jobs)]
+        for future in futures:
+            future.result()
+
+    best_trial = study.best_trial
+    print(f"Best trial {best_trial.number}: {cfg.monitor}={best_trial.value}, params={best_trial.params}")
+    OmegaConf.save(OmegaConf.create(best_trial.params), os.path.join(output_dir, "best_params.yaml"))
+    return best_trial.value
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Streaming metrics against naive per-sample implementations, and against scikit-learn when it is installed.
+
+    python -m pytest tests
+"""
+import numpy as np
+import pytest
+import torch
+
+from src.metrics import MetricMonitor, Accuracy, ClassificationMetrics, ConfusionMatrix, MeanIoU
+
+
+def naive_confusion_matrix(preds, targets, n_classes, ignore_index=None) -> np.ndarray:
+    matrix = np.zeros((n_classes, n_classes), dtype=np.int64)
+    for target, pred in zip(targets, preds):
+        if target != ignore_index:
+            matrix[target, pred] += 1
+    return matrix
+
+
+def naive_classification(preds, targets, n_classes) -> dict:
+    """
+    Macro averages over the classes present in the targets or the predictions, undefined values counted as 0.
+    """
+    matrix = naive_confusion_matrix(preds, targets, n_classes)
+    precisions, recalls, f1s = [], [], []
+    for c in range(n_classes):
+        tp, n_predicted, n_target = matrix[c, c], matrix[:, c].sum(), matrix[c, :].sum()
+        if n_predicted + n_target == 0:
+            continue
+        precision = tp / n_predicted if n_predicted > 0 else 0.0
+        recall = tp / n_target if n_target > 0 else 0.0
+        precisions.append(precision)
+        recalls.append(recall)
+        f1s.append(2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0)
+    accuracy = np.trace(matrix) / matrix.sum()
+    return {
+        "accuracy": accuracy,
+        "precision_macro": np.mean(precisions),
+        "recall_macro": np.mean(recalls),
+        "f1_macro": np.mean(f1s),
+        "precision_micro": accuracy,
+        "recall_micro": accuracy,
+        "f1_micro": accuracy,
+    }
+
+
+def make_batches(n_batches=6, batch_size=50, n_classes=7, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    scores = torch.randn(n_batches, batch_size, n_classes, generator=generator)
+    targets = torch.randint(0, n_classes, (n_batches, batch_size), generator=generator)
+    # correlate the predictions with the targets and leave the last class out of the predictions
+    scores[torch.arange(n_batches)[:, None], torch.arange(batch_size), targets] += 1.0
+    scores[..., n_classes - 1] -= 100.0
+    return scores, targets
+
+
+def compute(metrics, scores, targets) -> dict:
+    metric_monitor = MetricMonitor(metrics)
+    for output, target in zip(scores, targets):
+        metric_monitor.update_streaming_metrics(output, target)
+    return {name: float(value) for name, value in metric_monitor.get_metrics().items()}
+
+
+def assert_close(results, reference):
+    for name, value in reference.items():
+        assert results[name] == pytest.approx(float(value), rel=1e-9, abs=1e-12), name
+
+
+def test_confusion_matrix():
+    scores, targets = make_batches()
+    metric = ConfusionMatrix(7)
+    for output, target in zip(scores, targets):
+        metric.update(output, target)
+    reference = naive_confusion_matrix(scores.argmax(2).flatten().numpy(), targets.flatten().numpy(), 7)
+    np.testing.assert_array_equal(metric.matrix.numpy(), reference)
+
+
+def test_classification_metrics():
+    scores, targets = make_batches()
+    results = compute([ClassificationMetrics(7)], scores, targets)
+    assert_close(results, naive_classification(scores.argmax(2).flatten().numpy(), targets.flatten().numpy(), 7))
+
+
+def test_classification_metrics_absent_class():
+    # the class 3 is neither a target nor a prediction, so it is not part of the macro averages
+    targets = torch.tensor([0, 0, 1, 2, 2, 2])
+    preds = torch.tensor([0, 1, 1, 2, 0, 4])
+    results = compute([ClassificationMetrics(5)], preds[None], targets[None])
+    assert_close(results, naive_classification(preds.numpy(), targets.numpy(), 5))
+
+
+@pytest.mark.parametrize("top_k", [1, 3])
+def test_top_k_accuracy(top_k):
+    scores, targets = make_batches()
+    results = compute([Accuracy(top_k=top_k)], scores, targets)
+    flat_scores, flat_targets = scores.flatten(0, 1).numpy(), targets.flatten().numpy()
+    reference = np.mean([target in np.argsort(-score)[:top_k] for score, target in zip(flat_scores, flat_targets)])
+    name = "accuracy" if top_k == 1 else f"top{top_k}_accuracy"
+    assert_close(results, {name: reference})
+
+
+def test_mean_iou():
+    generator = torch.Generator().manual_seed(0)
+    masks = torch.randint(0, 5, (3, 4, 16, 16), generator=generator)
+    masks[:, :, :4] = 255
+    scores = torch.randn(3, 4, 5, 16, 16, generator=generator)
+    results = compute([MeanIoU(5, ignore_index=255)], scores, masks)
+
+    matrix = naive_confusion_matrix(scores.argmax(2).flatten().numpy(), masks.flatten().numpy(), 5, ignore_index=255)
+    ious = []
+    for c in range(5):
+        union = matrix[c, :].sum() + matrix[:, c].sum() - matrix[c, c]
+        if union > 0:
+            ious.append(matrix[c, c] / union)
+    assert_close(results, {"miou": np.mean(ious), "pixel_accuracy": np.trace(matrix) / matrix.sum()})
+
+
+def test_classification_metrics_sklearn():
+    metrics = pytest.importorskip("sklearn.metrics")
+    scores, targets = make_batches()
+    results = compute([ClassificationMetrics(7)], scores, targets)
+    preds, targets = scores.argmax(2).flatten().numpy(), targets.flatten().numpy()
+    reference = {"accuracy": metrics.accuracy_score(targets, preds)}
+    for average in ("macro", "micro"):
+        precision, recall, f1, _ = metrics.precision_recall_fscore_support(
+            targets, preds, average=average, zero_division=0
+        )
+        reference.update({f"precision_{average}": precision, f"recall_{average}": recall, f"f1_{average}": f1})
+    assert_close(results, reference)
@@ -1,13 +1,14 @@
 # Import some packages for off-the-shelf modules
-import albumentations as A
-from albumentations.pytorch import ToTensorV2
+import math
 import torch
 import torch.nn as nn
 
 # Import from src for hand-crafted modules
 from src.models import TemplateModel
-from src.datasets import TemplateDataset
+from src.datasets import TemplateDataset, CachedDataset, build_dataloader, autotune_num_workers, build_size_index
 from src.trainers import TemplateTrainer
+from src.metrics import Accuracy, ClassificationMetrics
+from src.utils import init_distributed, cleanup_distributed
 # from src.losses import ...
 # from src.optimizers import ...
 
@@ -16,12 +17,13 @@ from omegaconf import DictConfig, OmegaConf
 import hydra
 
 
-@hydra.main(version_base=None, config_path="cfgs", config_name="config")
-def main(cfg: DictConfig):
-    default_cfg = OmegaConf.structured(CFG)
-    cfg = OmegaConf.merge(default_cfg, cfg)
+def build_transforms():
+    """
+    Training and validation transforms, the validation ones are also used by serve.py.
+    """
+    import albumentations as A
+    from albumentations.pytorch import ToTensorV2
 
-    # Define transformations
     transforms_train = A.Compose([
         A.Resize(width=64, height=64),
         A.HorizontalFlip(p=0.5),
@@ -33,14 +35,79 @@ def main(cfg: DictConfig):
         A.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
         ToTensorV2(),
     ])
+    return transforms_train, transforms_val
+
+
+def build_datasets(cfg):
+    # Define transformations
+    transforms_train, transforms_val = build_transforms()
 
     # Create the dataset
     train_dataset = TemplateDataset(train=True, data_path=cfg.data_path, transforms=transforms_train)
     valid_dataset = TemplateDataset(train=False, data_path=cfg.data_path, transforms=transforms_val)
+    if cfg.cache_dir is not None:
+        # deterministic transforms are run once and cached on disk, random ones still run per sample
+        train_dataset = CachedDataset(train_dataset, cache_dir=cfg.cache_dir)
+        valid_dataset = CachedDataset(valid_dataset, cache_dir=cfg.cache_dir)
+
+    return train_dataset, valid_dataset
+
+
+def build_metrics(cfg):
+    """
+    Streaming metrics of the validation and test sets. ClassificationMetrics already gives the accuracy,
+    the top-5 accuracy is added when there are more than 5 classes, where it differs from 1.
+    """
+    metrics = [ClassificationMetrics(cfg.n_classes)]
+    if cfg.n_classes > 5:
+        metrics.append(Accuracy(top_k=5))
+    return metrics
+
+
+def build_scheduler(cfg, optimizer, train_dl):
+    # the scheduler is stepped once per optimizer step
+    steps_per_epoch = math.ceil(len(train_dl) / cfg.accumulate_grad_batches)
+    return torch.optim.lr_scheduler.OneCycleLR(optimizer, max_lr=cfg.max_lr, total_steps=cfg.n_epochs * steps_per_epoch)
+
+
+def scale_lr(cfg, optimizer, batch_size):
+    """
+    Scale lr and max_lr with the ratio of the new batch size to cfg.batch_size, linearly or with its square root.
+    The learning rates set by the scheduler in the param groups are reset, so the scheduler rebuilt
+    for the new batch size starts from the scaled ones.
+    """
+    ratio = batch_size / cfg.batch_size
+    factor = ratio if cfg.scale_lr == "linear" else math.sqrt(ratio) if cfg.scale_lr == "sqrt" else 1.0
+    cfg.lr *= factor
+    cfg.max_lr *= factor
+    for group in optimizer.param_groups:
+        for key in ("initial_lr", "max_lr", "min_lr"):
+            group.pop(key, None)
+        group["lr"] = cfg.lr
+
+
+def train(cfg, trial=None):
+    """
+    Train a model with the given config.
+    :param cfg: config
+    :param trial: optuna trial the validation metric is reported to every epoch, used by sweep.py
+    :return: best value of the monitored validation metric
+    """
+    # Create the dataset
+    train_dataset, valid_dataset = build_datasets(cfg)
+
+    # Size index of the training set, the training batches are built under the max_batch_tokens budget
+    sizes = None
+    if cfg.max_batch_tokens is not None:
+        if cfg.autotune_batch_size:
+            raise ValueError("autotune_batch_size tunes a fixed batch size, it can't be used with max_batch_tokens")
+        sizes = build_size_index(train_dataset, cfg.size_index_path, num_workers=cfg.num_workers)
 
     # Create the dataloaders
-    train_dl = torch.utils.data.DataLoader(train_dataset, batch_size=cfg.batch_size, shuffle=True)
-    val_dl = torch.utils.data.DataLoader(valid_dataset, batch_size=cfg.batch_size, shuffle=True)
+    if cfg.autotune_workers:
+        cfg.num_workers = autotune_num_workers(train_dataset, cfg, sizes=sizes)
+    train_dl = build_dataloader(train_dataset, cfg, train=True, sizes=sizes)
+    val_dl = build_dataloader(valid_dataset, cfg)
 
     # Create the model
     model = TemplateModel(n_classes=cfg.n_classes)
@@ -48,10 +115,12 @@ def main(cfg: DictConfig):
     # Instantiate the loss function
     criterion = nn.CrossEntropyLoss()
 
+    # Metrics computed on the device over the whole validation set, they can be used as monitor
+    metrics = build_metrics(cfg)
+
     # Instantiate the optimizer and scheduler
     optimizer = torch.optim.AdamW(model.parameters(), lr=cfg.lr)
-    scheduler = torch.optim.lr_scheduler.OneCycleLR(optimizer, max_lr=cfg.max_lr,
-                                                    total_steps=cfg.n_epochs * len(train_dl))
+    scheduler = build_scheduler(cfg, optimizer, train_dl)
 
     # Initialize trainer
     trainer = TemplateTrainer(
@@ -59,13 +128,38 @@ def main(cfg: DictConfig):
         train_dl=train_dl,
         val_dl=val_dl,
         criterion=criterion,
+        metrics=metrics,
         model=model,
         optimizer=optimizer,
         scheduler=scheduler,
     )
 
+    # Probe the batch size on real batches, then rebuild the training loader and scheduler for it
+    if cfg.autotune_batch_size:
+        batch_size = trainer.find_batch_size(
+            train_dataset,
+            max_batch_size=cfg.max_batch_size,
+            n_steps=cfg.batch_size_probe_steps,
+            min_gain=cfg.batch_size_min_gain,
+        )
+        scale_lr(cfg, optimizer, batch_size)
+        cfg.batch_size = batch_size
+        trainer.train_dl = build_dataloader(train_dataset, cfg, train=True)
+        trainer.scheduler = build_scheduler(cfg, optimizer, trainer.train_dl)
+
     # Start training
-    best_metric = trainer.fit()
+    return trainer.fit(trial=trial)
+
+
+@hydra.main(version_base=None, config_path="cfgs", config_name="config")
+def main(cfg: DictConfig):
+    default_cfg = OmegaConf.structured(CFG)
+    cfg = OmegaConf.merge(default_cfg, cfg)
+    # initialize the process group when launched with torchrun, before creating the dataloaders
+    cfg.device = init_distributed(cfg.device)
+
+    best_metric = train(cfg)
+    cleanup_distributed()
 
     return best_metric
 